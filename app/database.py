@@ -36,6 +36,37 @@ SessionLocal = sessionmaker(
     future=True,
 )
 
+# Motor asíncrono (asyncpg) para la ingesta MQTT en modo asyncio.
+# Se crea bajo demanda: el modo por hilos no necesita asyncpg instalado.
+ASYNC_DATABASE_URL = (
+    f"postgresql+asyncpg://{APP_DB_USER}:{APP_DB_PASSWORD}@{PG_HOST}:{PG_PORT}/{APP_DB_NAME}"
+)
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "20"))
+ASYNC_DB_MAX_OVERFLOW = int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "10"))
+
+_async_session_factory = None
+
+
+def get_async_session_factory():
+    """Devuelve (y crea la primera vez) el async_sessionmaker sobre asyncpg."""
+    global _async_session_factory
+    if _async_session_factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        async_engine = create_async_engine(
+            ASYNC_DATABASE_URL,
+            echo=False,
+            pool_pre_ping=True,
+            pool_size=ASYNC_DB_POOL_SIZE,
+            max_overflow=ASYNC_DB_MAX_OVERFLOW,
+        )
+        _async_session_factory = async_sessionmaker(
+            bind=async_engine,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+    return _async_session_factory
+
 # Base declarativa para los modelos
 Base = declarative_base()
 
@@ -0,0 +1,134 @@
+# app/logger.py
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Volcados completos de payload: 1 de cada N mensajes por módulo (0 = nunca)
+LOG_PAYLOAD_SAMPLE_EVERY = int(os.getenv("LOG_PAYLOAD_SAMPLE_EVERY", "100"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+_listener: logging.handlers.QueueListener | None = None
+_setup_lock = threading.Lock()
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Formato `fecha nivel logger evento k=v k=v` para eventos estructurados."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        base = super().format(record)
+        fields: Dict[str, Any] = getattr(record, "fields", None) or {}
+        if not fields:
+            return base
+        return base + " " + " ".join(f"{k}={v!r}" if isinstance(v, str) and " " in v else f"{k}={v}" for k, v in fields.items())
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que NO formatea en el hilo que loguea: el registro se encola tal cual
+    y el formateo + I/O ocurren en el hilo del QueueListener. Si la cola está llena,
+    el registro se descarta en lugar de bloquear la ingesta.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def setup_logging(level: str = LOG_LEVEL):
+    """Configura el logger `app` con un handler en cola (idempotente)."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        stream = logging.StreamHandler()
+        stream.setFormatter(KeyValueFormatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+
+        log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        root = logging.getLogger("app")
+        root.setLevel(level)
+        root.handlers[:] = [_DeferredQueueHandler(log_queue)]
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+class StructLogger:
+    """
+    Envoltorio de logging.Logger para eventos con campos clave/valor:
+        log.info("tags_procesado", module=code, status="ok")
+    Comprueba el nivel antes de crear el registro, así un log.debug()
+    desactivado cuesta sólo una comparación.
+    """
+
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(name)
+
+    def isEnabledFor(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level: int, event: str, fields: Dict[str, Any], exc_info=None):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={"fields": fields}, exc_info=exc_info, stacklevel=3)
+
+    def debug(self, event: str, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def get_logger(name: str) -> StructLogger:
+    return StructLogger(name)
+
+
+class PayloadSampler:
+    """Decide qué mensajes de cada módulo merecen un volcado completo del payload (1 de cada N)."""
+
+    def __init__(self, every: int = LOG_PAYLOAD_SAMPLE_EVERY):
+        self.every = every
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def should_sample(self, module_code: str) -> bool:
+        if self.every <= 0:
+            return False
+        with self._lock:
+            count = self._counts.get(module_code, 0)
+            self._counts[module_code] = count + 1
+        return count % self.every == 0
+
+
+payload_sampler = PayloadSampler()
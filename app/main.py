@@ -1,6 +1,6 @@
 # app/main.py
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from app.create_db import reset_database
@@ -15,10 +15,23 @@ from app.routers import (
     people_in_maintenance,
     type_alerts,
     alerts,
+    dead_letters,
 )
 
 # ⬇️ MQTT
 from app.mqtt.client import MqttService
+from app.mqtt.config import MQTT_MODE
+from app.mqtt.registry import tag_registry
+from app.mqtt.alert_index import alert_index
+from app.mqtt.presence import presence_tracker
+from app.mqtt.bay_state import bay_state_view
+from app.database import SessionLocal
+from app.logger import get_logger, setup_logging
+from app.metrics import PROMETHEUS_CONTENT_TYPE, registry as metrics_registry
+
+# Logging en cola: el formateo y la escritura ocurren fuera de los hilos de ingesta
+setup_logging()
+log = get_logger("app.main")
 
 app = FastAPI(
     title="IoT Platform API",
@@ -46,29 +59,68 @@ app.include_router(maintenance.router)
 app.include_router(people_in_maintenance.router)
 app.include_router(type_alerts.router)
 app.include_router(alerts.router)
+app.include_router(dead_letters.router)
 
 
 # Si quieres servir archivos estáticos (ej: imágenes, documentos, calibraciones)
 app.mount("/public", StaticFiles(directory="app/public"), name="public")
 
-# MQTT service instance
-mqtt_service = MqttService()
+# MQTT service instance (MQTT_MODE=asyncio → ingesta sobre el event loop de la app)
+if MQTT_MODE == "asyncio":
+    from app.mqtt.async_client import AsyncMqttService
+    mqtt_service = AsyncMqttService()
+else:
+    mqtt_service = MqttService()
 
 # Evento al iniciar la aplicación
 @app.on_event("startup")
 def startup_event():
     # reset_database() # Dejar solo en entorno de pruebas
-    print("✅ Base de datos lista y tablas creadas/verificadas.")
+    log.info("base_datos_lista")
+
+    # Cargar registro de tags en memoria (tag_code → usuario)
+    db = SessionLocal()
+    try:
+        tag_registry.load(db)
+        # Alertas abiertas: evita duplicados tras un reinicio
+        alert_index.rebuild(db)
+        # Presencia de módulos: LWT/ONLINE se registran en memoria y se vuelcan por lotes
+        presence_tracker.load(db)
+        # Orden natural de bahías persistido (filas previas a la columna sort_key)
+        bahias.backfill_sort_keys(db)
+        # Estado de las bahías para el dashboard: la ingesta lo mantiene desde aquí
+        bay_state_view.rebuild(db)
+    finally:
+        db.close()
 
     # Iniciar MQTT
     mqtt_service.start()
-    print("🔗 MQTT loop iniciado")
+    log.info("mqtt_loop_iniciado")
 
 @app.get("/")
 def root():
     return {"message": "🚀 API IoT en ejecución"}
 
+@app.get("/api/mqtt/stats")
+def mqtt_stats():
+    """Profundidad de colas y latencia por shard del pool de ingesta MQTT."""
+    return mqtt_service.stats()
+
+@app.get("/api/mqtt/presence")
+def mqtt_presence():
+    """Estado actual (online/offline/error) de cada módulo, servido desde memoria."""
+    return presence_tracker.snapshot()
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Contadores e histogramas de la ingesta MQTT en formato de texto de Prometheus."""
+    return Response(content=metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 @app.on_event("shutdown")
-def shutdown_event():
-    mqtt_service.stop()
-    print("🛑 MQTT loop detenido")
\ No newline at end of file
+async def shutdown_event():
+    if MQTT_MODE == "asyncio":
+        # Los consumidores vacían sus colas antes de cancelarse
+        await mqtt_service.stop_async()
+    else:
+        mqtt_service.stop()
+    log.info("mqtt_loop_detenido")
\ No newline at end of file
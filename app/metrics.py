@@ -0,0 +1,206 @@
+# app/metrics.py
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+# Buckets (segundos) pensados para etapas de milisegundos
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monotónico con etiquetas posicionales: counter.inc("TAGS")."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class _Timer:
+    """Mide con perf_counter y registra en el histograma al salir (también si hubo excepción)."""
+
+    __slots__ = ("_histogram", "_labelvalues", "_start")
+
+    def __init__(self, histogram: "Histogram", labelvalues: LabelValues):
+        self._histogram = histogram
+        self._labelvalues = labelvalues
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, *self._labelvalues)
+        return False
+
+
+class Histogram:
+    """
+    Histograma acumulativo de buckets fijos (formato Prometheus).
+    observe() cuesta un bisect + una suma bajo lock; no guarda muestras individuales.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues → [conteo por bucket (+Inf al final), suma]
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = ([0] * (len(self.buckets) + 1), [0.0])
+                self._series[labelvalues] = series
+            series[0][index] += 1
+            series[1][0] += value
+
+    def time(self, *labelvalues: str) -> _Timer:
+        return _Timer(self, labelvalues)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(c), s[0])) for k, (c, s) in self._series.items())
+        lines: List[str] = []
+        for labelvalues, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Counter | Histogram] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrica duplicada: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Exposición en formato de texto de Prometheus (versión 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Instancia global del proceso
+registry = MetricsRegistry()
+
+# ----------- métricas de ingesta MQTT -----------
+mqtt_messages = registry.counter(
+    "mqtt_messages_total", "Mensajes MQTT recibidos por sufijo de tópico", ("suffix",)
+)
+mqtt_parse_failures = registry.counter(
+    "mqtt_parse_failures_total", "Payloads que no pudieron parsearse", ("suffix",)
+)
+mqtt_dead_letters = registry.counter(
+    "mqtt_dead_letters_total", "Mensajes enviados a dead letters por tipo de error", ("error",)
+)
+mqtt_duplicates = registry.counter(
+    "mqtt_duplicate_messages_total", "TAGS descartados por ser redeliveries QoS 1 ya procesadas"
+)
+tag_reads_written = registry.counter(
+    "tag_reads_written_total", "Lecturas escritas en tag_reads", ("method",)
+)
+tag_reads_dropped = registry.counter(
+    "tag_reads_dropped_total", "Lecturas descartadas por cola de tag_reads llena"
+)
+mqtt_stale_snapshots = registry.counter(
+    "mqtt_stale_snapshots_total", "TAGS descartados por ser anteriores al último snapshot aplicado del módulo"
+)
+mqtt_publishes = registry.counter(
+    "mqtt_publish_total", "Mensajes publicados por sufijo de tópico", ("suffix",)
+)
+mqtt_publish_suppressed = registry.counter(
+    "mqtt_publish_suppressed_total", "Publicaciones omitidas porque el contenido no cambió", ("suffix",)
+)
+mqtt_publish_superseded = registry.counter(
+    "mqtt_publish_superseded_total", "Mensajes en cola reemplazados por uno más nuevo del mismo tópico", ("suffix",)
+)
+mqtt_publish_failures = registry.counter(
+    "mqtt_publish_failures_total", "Publicaciones descartadas, rechazadas o sin confirmar", ("suffix", "reason")
+)
+mqtt_publish_ack_seconds = registry.histogram(
+    "mqtt_publish_ack_seconds", "Latencia de confirmación del broker (publish → on_publish)"
+)
+mqtt_stage_seconds = registry.histogram(
+    "mqtt_stage_seconds",
+    "Duración de cada etapa del procesamiento de TAGS",
+    ("stage",),
+)
+mqtt_ingest_latency_seconds = registry.histogram(
+    "mqtt_ingest_latency_seconds",
+    "Latencia de ingesta por mensaje: encolado en el pool → fin del procesamiento",
+)
@@ -6,8 +6,10 @@ from sqlalchemy import (
     ForeignKey,
     TIMESTAMP,
     Time,
+    Index,
+    JSON,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship, validates
 from .database import Base
 
 
@@ -89,6 +91,17 @@ class StatusBahia(Base):
 # -------------------
 # BAHIAS
 # -------------------
+BAHIA_SORT_KEY_FALLBACK = 9999  # nombres sin número van al final
+
+
+def bahia_sort_key(name: str | None) -> int:
+    """Número de la bahía para ordenarlas ("Bahía 12" → 12)."""
+    try:
+        return int((name or "").split()[-1])
+    except (ValueError, IndexError):
+        return BAHIA_SORT_KEY_FALLBACK
+
+
 class Bahia(Base):
     __tablename__ = "bahias"
 
@@ -98,6 +111,18 @@ class Bahia(Base):
     id_headquarters = Column(Integer, ForeignKey("headquarters.id"))
     module_loto_code = Column(String, unique=True, nullable=True)
     module_loto_status = Column(String, default="offline", nullable=False)
+    # Orden natural por número, persistido para ordenar y paginar en SQL (ver bahia_sort_key)
+    sort_key = Column(Integer, nullable=False, default=BAHIA_SORT_KEY_FALLBACK, server_default=str(BAHIA_SORT_KEY_FALLBACK))
+    # Lecturas del último TAGS aplicado (suscripción compartida, ver reorder.dump_watermark);
+    # diferida: sólo se carga con la bahía bloqueada
+    last_reads = deferred(Column(JSON, nullable=True))
+
+    __table_args__ = (Index("ix_bahias_sort_key_id", sort_key, id),)
+
+    @validates("name")
+    def _set_sort_key(self, key, name):
+        self.sort_key = bahia_sort_key(name)
+        return name
 
     # relaciones
     status = relationship("StatusBahia", back_populates="bahias")
@@ -118,6 +143,19 @@ class Maintenance(Base):
     end_time = Column(TIMESTAMP, nullable=True)
     status = Column(String(50), nullable=False, default="active")
 
+    # A lo sumo un mantenimiento activo (sin end_time) por bahía
+    __table_args__ = (
+        # Último mantenimiento de cada bahía (GET /api/bahias)
+        Index("ix_maintenance_bahia_start", id_bahias, start_time),
+        Index(
+            "uq_maintenance_bahia_activa",
+            id_bahias,
+            unique=True,
+            postgresql_where=end_time.is_(None),
+            sqlite_where=end_time.is_(None),
+        ),
+    )
+
     # relaciones
     bahia = relationship("Bahia", back_populates="maintenances")
     people_in_maintenance = relationship(
@@ -172,12 +210,43 @@ class Alert(Base):
         Integer, ForeignKey("people_in_maintenance.id")
     )
     id_types_alerts = Column(Integer, ForeignKey("types_alerts.id"))
+    id_users = Column(Integer, ForeignKey("users.id"), nullable=True)  # infractor
     resolved = Column(Boolean, default=False)
     resolved_at = Column(TIMESTAMP, nullable=True)  # <-- Corregido aquí
 
+    # Alertas sin resolver por mantenimiento (GET /api/bahias)
+    __table_args__ = (Index("ix_alerts_maintenance_resolved", id_maintenance, resolved),)
+
     # relaciones
     maintenance = relationship("Maintenance", back_populates="alerts")
     people_in_maintenance = relationship(
         "PeopleInMaintenance", back_populates="alerts"
     )
     type_alert = relationship("TypeAlert", back_populates="alerts")
+
+
+# -------------------
+# TAG_READS (registro de lecturas, append-only)
+# -------------------
+class TagReadEvent(Base):
+    """
+    Cada lectura CARD/LOTO recibida por MQTT, para auditar quién se detectó en qué
+    bahía y cuándo. Sólo se inserta (por lotes, ver app/mqtt/tag_log.py).
+    En PostgreSQL la tabla se particiona por día de received_at (tag_reads_AAAAMMDD)
+    y la retención se aplica borrando particiones completas.
+    """
+    __tablename__ = "tag_reads"
+
+    received_at = Column(TIMESTAMP(timezone=True), nullable=False)  # llegada al backend
+    read_at = Column(TIMESTAMP(timezone=True), nullable=True)       # timestamp del lector (None si inválido)
+    module_loto_code = Column(String, nullable=False)
+    tag_type = Column(String(10), nullable=False)                   # "CARD" o "LOTO"
+    tag_code = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index("ix_tag_reads_module_received", module_loto_code, received_at),
+        Index("ix_tag_reads_tag_received", tag_code, received_at),
+        {"postgresql_partition_by": "RANGE (received_at)"},
+    )
+    # Tabla de eventos sin clave primaria en la BD; el ORM necesita una para mapearla
+    __mapper_args__ = {"primary_key": [received_at, module_loto_code, tag_type, tag_code]}
@@ -0,0 +1,135 @@
+# app/mqtt/alert_index.py
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app import models
+from app.logger import get_logger
+from .config import ALERT_WINDOW_MINUTES, ALERT_INDEX_MAX_ENTRIES
+
+log = get_logger(__name__)
+
+# (id_users, id_bahias, id_types_alerts)
+AlertKey = Tuple[int, int, int]
+
+
+def _as_utc(dt: datetime) -> datetime:
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+class AlertSuppressionIndex:
+    """
+    Índice en memoria de alertas abiertas para no repetir la misma infracción.
+    - Una infracción (usuario, bahía, tipo) vista de nuevo dentro de la ventana
+      se colapsa en la alerta abierta: no se inserta otra fila.
+    - La ventana es deslizante: cada nueva detección renueva `last_seen`.
+    - Las entradas se guardan ordenadas por `last_seen`, así la poda de vencidas
+      sólo recorre el inicio del diccionario.
+    """
+
+    def __init__(self, window_minutes: int, max_entries: int = 0):
+        self.window = timedelta(minutes=window_minutes)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[AlertKey, datetime]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.suppressed = 0
+
+    def reserve(self, key: AlertKey, now: datetime) -> bool:
+        """
+        True si hay que crear una alerta nueva (y la registra como abierta);
+        False si se colapsa en una alerta abierta dentro de la ventana.
+        """
+        with self._lock:
+            self._prune(now)
+            last_seen = self._entries.get(key)
+            self._entries[key] = now
+            self._entries.move_to_end(key)
+            if last_seen is not None and now - last_seen <= self.window:
+                self.suppressed += 1
+                return False
+            self.created += 1
+            if self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def mark(self, key: AlertKey, now: datetime):
+        """Registra como abierta una alerta creada por otra réplica (sin contarla en `created`)."""
+        with self._lock:
+            self._prune(now)
+            self._entries[key] = now
+            self._entries.move_to_end(key)
+            if self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def release(self, keys: Iterable[AlertKey]):
+        """Olvida alertas abiertas: su INSERT no llegó a confirmarse (ROLLBACK) o se resolvieron."""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def _prune(self, now: datetime):
+        limit = now - self.window
+        while self._entries:
+            key, last_seen = next(iter(self._entries.items()))
+            if last_seen >= limit:
+                break
+            self._entries.popitem(last=False)
+
+    def rebuild(self, db: Session, now: Optional[datetime] = None) -> int:
+        """
+        Reconstruye el índice desde las alertas no resueltas, para que un reinicio
+        no provoque una ráfaga de duplicados. Las alertas de mantenimientos aún
+        abiertos se consideran vigentes desde ahora.
+        """
+        now = now or datetime.now(timezone.utc)
+        try:
+            rows = self._open_alerts(db)
+        except DBAPIError as e:
+            # Base anterior sin alerts.id_users (ver README): arrancar con el índice vacío
+            db.rollback()
+            log.warning("indice_alertas_no_reconstruido", error=str(e.orig))
+            return 0
+        with self._lock:
+            self._entries.clear()
+            for user_id, bahia_id, type_id, alert_time, end_time in rows:
+                last_seen = now if end_time is None or alert_time is None else _as_utc(alert_time)
+                if now - last_seen <= self.window:
+                    self._entries[(user_id, bahia_id, type_id)] = last_seen
+            self._entries = OrderedDict(sorted(self._entries.items(), key=lambda kv: kv[1]))
+            size = len(self._entries)
+        log.info("indice_alertas_reconstruido", alertas_abiertas=size)
+        return size
+
+    @staticmethod
+    def _open_alerts(db: Session):
+        return (
+            db.query(
+                models.Alert.id_users,
+                models.Maintenance.id_bahias,
+                models.Alert.id_types_alerts,
+                models.Alert.alert_time,
+                models.Maintenance.end_time,
+            )
+            .join(models.Maintenance, models.Maintenance.id == models.Alert.id_maintenance)
+            .filter(models.Alert.resolved == False, models.Alert.id_users.isnot(None))
+            .order_by(models.Alert.alert_time)
+            .all()
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open": len(self._entries),
+                "window_minutes": int(self.window.total_seconds() // 60),
+                "created": self.created,
+                "suppressed": self.suppressed,
+            }
+
+
+# Instancia global del proceso
+alert_index = AlertSuppressionIndex(ALERT_WINDOW_MINUTES, ALERT_INDEX_MAX_ENTRIES)
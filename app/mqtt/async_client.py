@@ -0,0 +1,282 @@
+# app/mqtt/async_client.py
+import asyncio
+import threading
+import time
+import zlib
+from typing import Callable, List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.logger import get_logger
+from app.metrics import mqtt_ingest_latency_seconds, mqtt_messages
+from .client import MqttService
+from .config import MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE, MQTT_ASYNC_CONCURRENCY, MQTT_WORKER_QUEUE_SIZE
+from .topics import extract_module_code, topic_suffix
+from .transport import PahoTransport, Transport
+from .presence import presence_tracker
+from .dead_letter import dead_letters
+from .tag_log import tag_read_log
+from .cache_sync import cache_sync
+from .unit_of_work import tx_stats
+
+log = get_logger(__name__)
+
+# (encolado_en, topic, payload, reenvío con flag DUP)
+_Item = Tuple[float, str, bytes, bool]
+
+
+class _PahoAsyncioBridge:
+    """
+    Conduce el socket de paho desde el event loop (loop externo de paho):
+    add_reader/add_writer llaman a loop_read/loop_write y una tarea periódica
+    ejecuta loop_misc (keepalive) y reconecta si se pierde la conexión.
+    connect/reconnect (DNS y TCP bloqueantes) corren en el executor por defecto; los
+    callbacks de socket que llegan desde ahí se pasan al event loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client):
+        self.loop = loop
+        self.client = client
+        self._misc: Optional[asyncio.Task] = None
+        self._loop_thread = threading.get_ident()  # se construye desde el event loop
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def start(self, host: str, port: int, keepalive: int):
+        self._misc = self.loop.create_task(self._connect_and_run(host, port, keepalive))
+
+    def stop(self):
+        if self._misc:
+            self._misc.cancel()
+
+    async def _connect_and_run(self, host: str, port: int, keepalive: int):
+        try:
+            await self.loop.run_in_executor(None, self.client.connect, host, port, keepalive)
+        except Exception as e:
+            # Sin conexión inicial: _misc_loop reintenta con backoff
+            log.warning("mqtt_conexion_fallida", host=host, port=port, error=str(e))
+        await self._misc_loop()
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call_in_loop(self.loop.add_reader, sock.fileno(), client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        # paho cierra el socket al volver: se usa el descriptor, no el objeto
+        fd = sock.fileno()
+        self._call_in_loop(self._remove_fd, fd)
+
+    def _remove_fd(self, fd: int):
+        self.loop.remove_reader(fd)
+        self.loop.remove_writer(fd)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        # La cola de salida publica desde su propio hilo: add_writer sólo es seguro en el loop
+        self._call_in_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call_in_loop(self.loop.remove_writer, sock)
+
+    def _call_in_loop(self, fn, *args):
+        if threading.get_ident() == self._loop_thread:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    async def _misc_loop(self):
+        backoff = 1.0
+        while True:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                try:
+                    await self.loop.run_in_executor(None, self.client.reconnect)
+                    backoff = 1.0
+                except Exception as e:
+                    log.warning("mqtt_reconexion_fallida", error=str(e), reintento_s=backoff)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 30.0)
+                    continue
+            await asyncio.sleep(1)
+
+
+class AsyncMqttService(MqttService):
+    """
+    Ingesta MQTT sobre el event loop de la aplicación (MQTT_MODE=asyncio).
+    - paho no tiene hilo propio: su socket lo atiende el event loop (_PahoAsyncioBridge).
+    - Los mensajes se reparten por módulo en MQTT_ASYNC_CONCURRENCY colas asyncio;
+      cada cola tiene una tarea consumidora, así el orden por módulo se mantiene y
+      miles de mensajes pueden estar en vuelo sin un hilo por llamada bloqueante.
+    - La lógica de app/mqtt/logic.py (síncrona) se ejecuta con AsyncSession.run_sync
+      sobre el motor asyncpg: cada consulta cede el event loop mientras espera a la BD,
+      pero la CPU de la lógica (validación, ORM) corre en el hilo del loop y lo ocupa
+      mientras tanto; con carga de CPU alta conviene el modo por hilos.
+    - No usa el ShardedWorkerPool de MqttService (_create_pool retorna None).
+    - La conexión al broker (DNS, TCP) y las reconexiones van al executor por defecto.
+    La publicación de STATUS/USERS reutiliza la cola de salida de MqttService.
+    """
+
+    def __init__(
+        self,
+        transport: Transport | None = None,
+        session_factory: Callable[[], AsyncSession] | None = None,
+        concurrency: int = MQTT_ASYNC_CONCURRENCY,
+        queue_size: int = MQTT_WORKER_QUEUE_SIZE,
+    ):
+        if session_factory is None:
+            from app.database import get_async_session_factory
+            session_factory = get_async_session_factory()
+        super().__init__(transport=transport, session_factory=session_factory)
+        self.concurrency = max(1, concurrency)
+        self.queue_size = queue_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._bridge: Optional[_PahoAsyncioBridge] = None
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+
+    # ----------- ciclo de vida -----------
+    def start(self):
+        """Debe llamarse desde el event loop (p. ej. el evento startup de FastAPI)."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.concurrency)]
+        self._tasks = [self._loop.create_task(self._consume(q)) for q in self._queues]
+        self.outbox.start()
+        self.reorder.start()
+        # El volcado de presencia corre en su propio hilo con el motor síncrono
+        from app.database import SessionLocal
+        cache_sync.start(SessionLocal)
+        presence_tracker.start(SessionLocal)
+        dead_letters.start()
+        tag_read_log.start(SessionLocal)
+        self._start_liveness()
+
+        if isinstance(self.transport, PahoTransport):
+            self._bridge = _PahoAsyncioBridge(self._loop, self.transport.client)
+            log.info("mqtt_conectando", host=MQTT_HOST, port=MQTT_PORT, modo="asyncio")
+            self._bridge.start(MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE)
+        else:
+            # Transportes con hilo propio (p. ej. el broker en memoria): sus callbacks
+            # llegan desde otro hilo y se pasan al event loop en _on_message
+            self.transport.connect(MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE)
+            self.transport.loop_start()
+        self._running = True
+        log.info("mqtt_loop_iniciado", modo="asyncio", consumidores=self.concurrency)
+
+    def stop(self):
+        """Detiene sin esperar a los consumidores: lo que quede en sus colas se pierde (ver stop_async)."""
+        self._stop_input()
+        self._stop_consumers()
+
+    async def stop_async(self, timeout: float = 5.0):
+        """
+        Detención ordenada desde el event loop: corta la entrada (broker y buffer de
+        reorden, que entrega lo retenido), espera hasta `timeout` segundos a que los
+        consumidores vacíen sus colas y recién entonces los cancela.
+        """
+        self._stop_input()
+        if self._queues:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+            except asyncio.TimeoutError:
+                log.warning("colas_async_sin_vaciar", pendientes=sum(q.qsize() for q in self._queues))
+        self._stop_consumers()
+
+    def _stop_input(self):
+        self._running = False
+        self.liveness.stop()
+        try:
+            self.transport.disconnect()
+            log.info("mqtt_desconectado")
+        except Exception as e:
+            log.warning("error_cerrando_mqtt", error=str(e))
+        if self._bridge:
+            self._bridge.stop()
+        elif not isinstance(self.transport, PahoTransport):
+            self.transport.loop_stop()
+        self.reorder.stop()
+
+    def _stop_consumers(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        # Después de los consumidores: sus últimas publicaciones y dead letters salen
+        self.outbox.stop()
+        presence_tracker.stop()
+        dead_letters.stop()
+        tag_read_log.stop()
+        cache_sync.stop()
+
+    def _create_pool(self):
+        # Las colas asyncio de cada consumidor reemplazan al pool de hilos
+        return None
+
+    def _pool_stats(self) -> dict:
+        return {
+            "mode": "asyncio",
+            "consumers": self.concurrency,
+            "queue_depth": sum(q.qsize() for q in self._queues),
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+    # ----------- callbacks -----------
+    def _on_message(self, client, userdata, msg):
+        module_code = extract_module_code(msg.topic) or ""
+        mqtt_messages.inc(topic_suffix(msg.topic))
+        self._track_liveness(msg.topic, module_code)
+        self._route(msg.topic, module_code, bytes(msg.payload), bool(getattr(msg, "dup", False)))
+
+    def _dispatch(self, topic: str, payload_bytes: bytes, redelivered: bool = False):
+        self._submit((time.perf_counter(), topic, payload_bytes, redelivered))
+
+    def inject(self, topic: str, payload_bytes: bytes):
+        self._submit((time.perf_counter(), topic, payload_bytes, False))
+
+    def _submit(self, item: _Item):
+        if self._loop is None:
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._enqueue(item)
+        else:
+            self._loop.call_soon_threadsafe(self._enqueue, item)
+
+    def _enqueue(self, item: _Item):
+        module_code = extract_module_code(item[1]) or ""
+        queue = self._queues[zlib.crc32(module_code.encode("utf-8")) % len(self._queues)]
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # No se puede bloquear el event loop: se descarta como en el modo por hilos
+            self.dropped += 1
+            self._drop(module_code, item[1], item[2])
+
+    # ----------- consumo -----------
+    async def _consume(self, queue: asyncio.Queue):
+        while True:
+            enqueued_at, topic, payload_bytes, redelivered = await queue.get()
+            try:
+                await self._handle_message_async(topic, payload_bytes, redelivered)
+            finally:
+                queue.task_done()
+                self.processed += 1
+                mqtt_ingest_latency_seconds.observe(time.perf_counter() - enqueued_at)
+
+    async def _handle_message_async(self, topic: str, payload_bytes: bytes, redelivered: bool = False):
+        try:
+            async with self.session_factory() as session:
+                try:
+                    await session.run_sync(self._process_message, topic, payload_bytes, redelivered)
+                finally:
+                    tx_stats.record_message(session.sync_session)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.errors += 1
+            log.exception("error_procesando_mensaje", topic=topic, error=str(e))
+            dead_letters.record(topic, payload_bytes, e)
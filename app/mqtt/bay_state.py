@@ -0,0 +1,294 @@
+# app/mqtt/bay_state.py
+import itertools
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, aliased
+
+from app import models
+from app.logger import get_logger
+from .config import BAY_STATE_REFRESH_SECONDS
+from .presence import presence_tracker
+
+log = get_logger(__name__)
+
+
+def format_time(dt: Optional[datetime]) -> str:
+    return dt.strftime("%H:%M:%S %d-%m-%Y") if dt else "-"
+
+
+def overview_query():
+    """
+    Una fila por bahía con su mantenimiento más reciente (o activo) y las alertas sin
+    resolver de ese mantenimiento, en una sola consulta: subconsultas correlacionadas
+    sobre ix_maintenance_bahia_start y ix_alerts_maintenance_resolved.
+    """
+    Bahia, Maintenance, Alert = models.Bahia, models.Maintenance, models.Alert
+    latest = aliased(Maintenance)
+    latest_id = (
+        select(latest.id)
+        .where(latest.id_bahias == Bahia.id)
+        .order_by(latest.start_time.desc(), latest.id.desc())
+        .limit(1)
+        .correlate(Bahia)
+        .scalar_subquery()
+    )
+    active_alerts = (
+        select(func.count(Alert.id))
+        .where(Alert.id_maintenance == Maintenance.id, Alert.resolved == False)
+        .correlate(Maintenance)
+        .scalar_subquery()
+    )
+    return (
+        select(
+            Bahia.id, Bahia.name, Bahia.module_loto_code, Bahia.sort_key, Bahia.id_headquarters,
+            Bahia.module_loto_status, Maintenance.id.label("maintenance_id"),
+            Maintenance.start_time, Maintenance.end_time, active_alerts.label("active_alerts"),
+        )
+        .outerjoin(Maintenance, Maintenance.id == latest_id)
+        .order_by(Bahia.sort_key, Bahia.id)
+    )
+
+
+class BayRow(NamedTuple):
+    """Fila de GET /api/bahias con las claves para filtrar y paginar."""
+    sort_key: int
+    id: int
+    headquarters: Optional[int]
+    status: str
+    data: dict
+
+
+class _Bay:
+    __slots__ = (
+        "id", "name", "code", "sort_key", "headquarters", "module_status",
+        "maintenance_id", "start_time", "end_time", "active_alerts", "version",
+    )
+
+    def __init__(self, row, version: int):
+        self.id = row.id
+        self.name = row.name
+        self.code = row.module_loto_code
+        self.sort_key = row.sort_key
+        self.headquarters = row.id_headquarters
+        self.module_status = presence_tracker.status(row.module_loto_code, row.module_loto_status)
+        self.maintenance_id = row.maintenance_id
+        self.start_time = row.start_time
+        self.end_time = row.end_time
+        self.active_alerts = row.active_alerts or 0
+        self.version = version  # cambia con cualquier dato de la bahía (también personas)
+
+    @property
+    def status(self) -> str:
+        # moduleDisconnected → inManteinance → alert → available
+        if self.module_status == "offline":
+            return "moduleDisconnected"
+        if self.maintenance_id is not None and self.end_time is None:
+            return "inManteinance"
+        if self.active_alerts > 0:
+            return "alert"
+        return "available"
+
+    def row(self) -> BayRow:
+        status = self.status
+        return BayRow(self.sort_key, self.id, self.headquarters, status, {
+            "id": self.id,
+            "name": self.name,
+            "status": status,
+            "code": self.code,
+            "start_time": format_time(self.start_time),
+            "end_time": format_time(self.end_time),
+            "icon": "warning" if status in ("alert", "inManteinance") else "check",
+        })
+
+
+class BayStateView:
+    """
+    Estado materializado de las bahías para los endpoints del dashboard.
+    - rebuild() lo carga desde la BD con una consulta (al arrancar y cada refresh_interval,
+      para recoger lo que cambien otras réplicas o la API). La API que escribe lo que la
+      ingesta no ve (p. ej. resolver una alerta) llama a invalidate(): reconstruye en la
+      próxima lectura.
+    - La ingesta lo actualiza con cada transición que ya conoce: presencia (LWT/TAGS),
+      mantenimiento iniciado/finalizado y alertas nuevas, sólo después del COMMIT.
+    - version cambia sólo con cambios visibles en la lista (un rebuild que no cambia
+      ninguna fila la conserva, así el ETag sigue sirviendo); cada bahía tiene además su
+      propia versión (incluye cambios de personas, que la lista no ve: se renueva en cada
+      rebuild) que indexa el detalle cacheado.
+    - Si la ingesta lo modificó durante un rebuild(), el resultado puede no incluir ese
+      cambio: se marca vencido y la próxima lectura vuelve a reconstruir.
+    """
+
+    def __init__(self, refresh_interval: float = BAY_STATE_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self.version = 0
+        self.epoch = int(time.time())  # distingue versiones de procesos distintos (ETag)
+        self._bays: Dict[int, _Bay] = {}
+        self._by_code: Dict[str, int] = {}
+        self._rows: Optional[List[BayRow]] = None
+        self._details: Dict[int, Tuple[int, dict]] = {}
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._built_at: Optional[float] = None
+        self._outdated = False
+        self.rebuilds = 0
+        self.updates = 0
+        self.detail_hits = 0
+        self.detail_misses = 0
+
+    # ----------- carga desde BD -----------
+    @property
+    def loaded(self) -> bool:
+        return self._built_at is not None
+
+    def rebuild(self, db: Session) -> int:
+        with self._lock:
+            version = self.version
+        rows = db.execute(overview_query()).all()
+        with self._lock:
+            previous = self._rows if self._rows is not None else self._sorted_rows()
+            self._bays = {row.id: _Bay(row, next(self._seq)) for row in rows}
+            self._by_code = {b.code: b.id for b in self._bays.values() if b.code}
+            self._details.clear()
+            # Cambios de la ingesta mientras consultábamos: quizá no estén en rows
+            self._built_at = time.monotonic()
+            self._outdated = version != self.version
+            current = self._sorted_rows()
+            if current != previous:
+                self._changed()
+            self._rows = current
+            self.rebuilds += 1
+            size = len(self._bays)
+        log.info("vista_bahias_cargada", bahias=size, version=self.version)
+        return size
+
+    def refresh(self, db: Session) -> bool:
+        """Reconstruye si no está cargada o venció refresh_interval. Retorna True si reconstruyó."""
+        if not self._stale():
+            return False
+        with self._rebuild_lock:
+            # Otro hilo pudo reconstruir mientras esperábamos
+            if not self._stale():
+                return False
+            self.rebuild(db)
+        return True
+
+    def invalidate(self):
+        """Marca la vista vencida: la próxima lectura la reconstruye (escrituras de la API)."""
+        with self._lock:
+            self._outdated = True
+
+    def _stale(self) -> bool:
+        built_at = self._built_at
+        if built_at is None or self._outdated:
+            return True
+        return self.refresh_interval > 0 and time.monotonic() - built_at > self.refresh_interval
+
+    # ----------- lecturas (endpoints) -----------
+    def rows(self) -> Tuple[int, List[BayRow]]:
+        """(version, filas ordenadas por sort_key, id); la lista se arma una vez por versión."""
+        with self._lock:
+            if self._rows is None:
+                self._rows = self._sorted_rows()
+            return self.version, self._rows
+
+    def _sorted_rows(self) -> List[BayRow]:
+        return sorted((b.row() for b in self._bays.values()), key=lambda r: (r.sort_key, r.id))
+
+    def bay_version(self, bay_id: int) -> Optional[int]:
+        with self._lock:
+            bay = self._bays.get(bay_id)
+            return bay.version if bay is not None else None
+
+    def detail(self, bay_id: int) -> Optional[dict]:
+        """Detalle cacheado si sigue vigente para la versión actual de la bahía."""
+        with self._lock:
+            bay = self._bays.get(bay_id)
+            cached = self._details.get(bay_id)
+            if bay is not None and cached is not None and cached[0] == bay.version:
+                self.detail_hits += 1
+                return cached[1]
+            self.detail_misses += 1
+            return None
+
+    def store_detail(self, bay_id: int, version: int, payload: dict):
+        """Cachea un detalle calculado con la bahía en `version` (no si cambió mientras tanto)."""
+        with self._lock:
+            bay = self._bays.get(bay_id)
+            if bay is not None and bay.version == version:
+                self._details[bay_id] = (version, payload)
+
+    # ----------- transiciones (ingesta, después del COMMIT) -----------
+    def module_status(self, module_code: str, status: str):
+        with self._lock:
+            bay = self._bays.get(self._by_code.get(module_code))
+            if bay is None or bay.module_status == status:
+                return
+            bay.module_status = status
+            self._touch(bay)
+            self._changed()
+
+    def maintenance(self, bay_id: int, maintenance_id: int, start_time: datetime, end_time: Optional[datetime]):
+        """Mantenimiento iniciado, en curso o finalizado en la bahía (los ids crecen con start_time)."""
+        with self._lock:
+            bay = self._bays.get(bay_id)
+            if bay is None:
+                return
+            self._touch(bay)  # personas del mantenimiento pudieron cambiar
+            if bay.maintenance_id is not None and maintenance_id < bay.maintenance_id:
+                return
+            if maintenance_id != bay.maintenance_id:
+                bay.maintenance_id = maintenance_id
+                bay.start_time = start_time
+                bay.active_alerts = 0
+            elif bay.end_time == end_time:
+                return
+            bay.end_time = end_time
+            self._changed()
+
+    def alerts_raised(self, bay_id: int, maintenance_id: int, count: int):
+        with self._lock:
+            bay = self._bays.get(bay_id)
+            if bay is None:
+                return
+            self._touch(bay)
+            if maintenance_id == bay.maintenance_id and count:
+                bay.active_alerts += count
+                self._changed()
+
+    def invalidate_details(self):
+        """Descarta los detalles cacheados (p. ej. cambios de personas hechos por la API)."""
+        with self._lock:
+            for bay in self._bays.values():
+                self._touch(bay)
+            self._details.clear()
+
+    def _touch(self, bay: _Bay):
+        bay.version = next(self._seq)
+        self._details.pop(bay.id, None)
+        self.updates += 1
+
+    def _changed(self):
+        self.version += 1
+        self._rows = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "bays": len(self._bays),
+                "version": self.version,
+                "rebuilds": self.rebuilds,
+                "updates": self.updates,
+                "details_cached": len(self._details),
+                "detail_hits": self.detail_hits,
+                "detail_misses": self.detail_misses,
+            }
+
+
+# Instancia global del proceso
+bay_state_view = BayStateView()
@@ -0,0 +1,250 @@
+# app/mqtt/cache_sync.py
+import json
+import os
+import select
+import socket
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from app.logger import get_logger
+from .alert_index import alert_index
+from .bay_state import bay_state_view
+from .config import CACHE_SYNC_CHANNEL, CACHE_SYNC_ENABLED
+from .presence import presence_tracker
+from .registry import tag_registry
+from .snapshots import snapshot_store
+
+log = get_logger(__name__)
+
+# NOTIFY admite payloads de hasta 8000 bytes: los avisos grandes se parten
+_MAX_PAYLOAD_BYTES = 7500
+
+
+class CacheSync:
+    """
+    Invalidación de los cachés en memoria entre réplicas (LISTEN/NOTIFY de PostgreSQL).
+    - notify(db, tipo, clave) anota un aviso en la sesión; antes del COMMIT se emite con
+      pg_notify dentro de la misma transacción, así PostgreSQL lo entrega sólo si se
+      confirma y en el orden de los COMMIT. Un ROLLBACK lo descarta.
+    - Un hilo escucha el canal con una conexión propia (autocommit) y aplica los avisos
+      de las demás réplicas: tag_registry, alert_index, snapshot_store, presence_tracker
+      y bay_state_view. Los propios se ignoran (origin).
+    - Si se pierde la conexión de escucha, los avisos de ese lapso no se recuperan: al
+      reconectar se descartan los cachés completos y el índice de alertas se reconstruye.
+    - Sin `enabled` o fuera de PostgreSQL no hace nada (una sola réplica).
+    """
+
+    def __init__(
+        self,
+        channel: str = CACHE_SYNC_CHANNEL,
+        enabled: bool = CACHE_SYNC_ENABLED,
+        origin: Optional[str] = None,
+        reconnect_delay: float = 5.0,
+    ):
+        self.channel = channel
+        self.enabled = enabled
+        self.origin = origin or f"{socket.gethostname()}-{os.getpid()}"
+        self.reconnect_delay = reconnect_delay
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._engine = None
+        self._session_factory: Optional[Callable[[], Session]] = None
+        self._handlers: Dict[str, Callable[[Any], None]] = {
+            "tag": tag_registry.invalidate,
+            "user": tag_registry.invalidate_user,
+            "tags": lambda _key: tag_registry.clear(),
+            "alert": self._alert_created,
+            "alert_resolved": self._alert_resolved,
+            "bay": self._bay_changed,
+            "details": lambda _key: bay_state_view.invalidate_details(),
+            "presence": self._presence_changed,
+        }
+        self.sent = 0
+        self.received = 0
+        self.applied = 0
+        self.reconnects = 0
+        self.errors = 0
+
+    # ----------- emisión (dentro de la transacción) -----------
+    def notify(self, db: Session, kind: str, key: Any = None):
+        """Anota un aviso para las demás réplicas; sale con el COMMIT de `db`."""
+        if self.enabled:
+            db.info.setdefault("cache_sync", []).append([kind, key])
+
+    def _send_pending(self, db: Session):
+        events = db.info.pop("cache_sync", None)
+        if not events or db.get_bind().dialect.name != "postgresql":
+            return
+        for payload in self._payloads(events):
+            db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": self.channel, "payload": payload})
+        with self._lock:
+            self.sent += len(events)
+
+    def _payloads(self, events: List[list]) -> List[str]:
+        payload = json.dumps({"origin": self.origin, "events": events}, separators=(",", ":"), default=str)
+        if len(payload.encode("utf-8")) <= _MAX_PAYLOAD_BYTES or len(events) == 1:
+            return [payload]
+        half = len(events) // 2
+        return self._payloads(events[:half]) + self._payloads(events[half:])
+
+    def _presence_flushed(self, db: Session, by_status: Dict[str, List[str]]):
+        for status, codes in by_status.items():
+            for code in codes:
+                self.notify(db, "presence", [code, status])
+
+    # ----------- recepción -----------
+    def apply(self, payload: str) -> int:
+        """Aplica un aviso recibido. Retorna cuántos eventos se aplicaron (0 si es propio)."""
+        message = json.loads(payload)
+        if message.get("origin") == self.origin:
+            return 0
+        applied = 0
+        for kind, key in message.get("events", []):
+            handler = self._handlers.get(kind)
+            if handler is None:
+                log.warning("cache_sync_evento_desconocido", tipo=kind)
+                continue
+            handler(key)
+            applied += 1
+        with self._lock:
+            self.received += 1
+            self.applied += applied
+        return applied
+
+    def _alert_created(self, key: list):
+        alert_index.mark(tuple(key), datetime.now(timezone.utc))
+
+    def _alert_resolved(self, key: list):
+        alert_index.release([tuple(key)])
+        bay_state_view.invalidate()
+
+    def _bay_changed(self, module_code: Optional[str]):
+        if module_code:
+            snapshot_store.invalidate(module_code)
+        bay_state_view.invalidate()
+
+    def _presence_changed(self, key: list):
+        module_code, status = key
+        if presence_tracker.adopt(module_code, status):
+            bay_state_view.module_status(module_code, status)
+            snapshot_store.invalidate(module_code)
+
+    def reset(self):
+        """Descarta los cachés completos (avisos posiblemente perdidos)."""
+        tag_registry.clear()
+        snapshot_store.clear()
+        bay_state_view.invalidate()
+        if self._session_factory is not None:
+            db = self._session_factory()
+            try:
+                alert_index.rebuild(db)
+            finally:
+                db.close()
+        log.info("cache_sync_caches_descartados")
+
+    # ----------- ciclo de vida -----------
+    def start(self, session_factory: Callable[[], Session]):
+        if not self.enabled or self._thread is not None:
+            return
+        db = session_factory()
+        try:
+            engine = db.get_bind()
+        finally:
+            db.close()
+        if engine.dialect.name != "postgresql":
+            log.info("cache_sync_desactivado", motivo="requiere PostgreSQL", dialecto=engine.dialect.name)
+            return
+        self._engine = engine
+        self._session_factory = session_factory
+        presence_tracker.on_flush = self._presence_flushed
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-sync", daemon=True)
+        self._thread.start()
+        log.info("cache_sync_iniciado", canal=self.channel, origin=self.origin)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        presence_tracker.on_flush = None
+
+    def _run(self):
+        connected_before = False
+        while not self._stop.is_set():
+            raw = None
+            try:
+                raw = self._listen()
+                if connected_before:
+                    with self._lock:
+                        self.reconnects += 1
+                    self.reset()
+                connected_before = True
+                conn = raw.driver_connection
+                while not self._stop.is_set():
+                    if not select.select([conn], [], [], 1.0)[0]:
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notification = conn.notifies.pop(0)
+                        try:
+                            self.apply(notification.payload)
+                        except Exception as e:
+                            with self._lock:
+                                self.errors += 1
+                            log.warning("cache_sync_aviso_invalido", error=str(e))
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                log.warning("cache_sync_desconectado", error=str(e), reintento_s=self.reconnect_delay)
+                self._stop.wait(self.reconnect_delay)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+
+    def _listen(self):
+        # Conexión fuera del pool: queda ocupada escuchando mientras viva el hilo
+        raw = self._engine.raw_connection()
+        raw.detach()
+        conn = raw.driver_connection
+        conn.rollback()  # el pre-ping del pool pudo abrir una transacción
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN "{self.channel}"')
+        return raw
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "listening": self._thread is not None,
+                "sent": self.sent,
+                "received": self.received,
+                "applied": self.applied,
+                "reconnects": self.reconnects,
+                "errors": self.errors,
+            }
+
+
+# Instancia global del proceso
+cache_sync = CacheSync()
+
+
+@event.listens_for(Session, "before_commit")
+def _send_cache_sync(session: Session):
+    # pg_notify dentro de la transacción: se entrega sólo si el COMMIT se confirma
+    cache_sync._send_pending(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_cache_sync(session: Session):
+    session.info.pop("cache_sync", None)
@@ -1,155 +1,423 @@
 # app/mqtt/client.py
 import json
+import logging
 import threading
-import ssl
 import os
+from typing import Callable
 from dotenv import load_dotenv
-import paho.mqtt.client as mqtt
 from sqlalchemy.orm import Session
 from app.database import SessionLocal
-from .config import MQTT_CLIENT_ID, MQTT_HOST, MQTT_PORT, MQTT_USER, MQTT_PASSWORD, MQTT_KEEPALIVE, MQTT_QOS, MQTT_CA_CERT
-from .topics import SUBSCRIBE_TAGS_ALL, SUBSCRIBE_LWT_ALL, SUBSCRIBE_ONLINE_ALL, extract_module_code, topic_status
-from .payloads import TagsPayload
-from .logic import process_tags_payload, process_lwt_message
+from .config import MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE, MQTT_QOS, MQTT_PUBLISH_RETAIN
+from .config import MQTT_PUBLISH_QUEUE_SIZE, MQTT_PUBLISH_MAX_INFLIGHT, MQTT_PUBLISH_ACK_TIMEOUT
+from .config import MQTT_WORKERS, MQTT_WORKER_QUEUE_SIZE
+from .config import MQTT_BATCH_ENABLED, MQTT_BATCH_MAX_MESSAGES, MQTT_BATCH_MAX_DELAY_MS
+from .config import MQTT_SHARED_GROUP, LIVENESS_TIMEOUT_SECONDS, MQTT_REORDER_ENABLED, MQTT_REORDER_WINDOW_MS
+from .topics import SUBSCRIPTIONS, extract_module_code, topic_lwt, topic_status, topic_suffix
+from .payloads import TagsPayload, decode_json, decode_tags_payload
+from .logic import process_tags_payload, process_tags_batch, process_lwt_message
+from .workers import ShardedWorkerPool
+from .registry import tag_registry
+from .snapshots import snapshot_store
+from .unit_of_work import tx_stats
+from .alert_index import alert_index
+from .presence import presence_tracker
+from .bay_state import bay_state_view
+from .liveness import LivenessMonitor
+from .dead_letter import QueueFullError, UnknownModuleError, dead_letters
+from .idempotency import message_key, recent_messages
+from .tag_log import tag_read_log
+from .cache_sync import cache_sync
+from .reorder import ReorderBuffer, StaleSnapshotError, snapshot_reads
+from .transport import Transport, create_transport
+from .publisher import PublishDeduplicator, PublishQueue, payload_digest, publish_dedup
+from app.logger import get_logger, payload_sampler
+from app.metrics import mqtt_ingest_latency_seconds, mqtt_messages, mqtt_parse_failures, mqtt_publish_suppressed, mqtt_duplicates, mqtt_stage_seconds
+
+log = get_logger(__name__)
 
 class MqttService:
-    def __init__(self):
-        self.client = mqtt.Client(client_id=MQTT_CLIENT_ID, clean_session=True)
+    instance: "MqttService | None" = None
+
+    def __init__(
+        self,
+        transport: Transport | None = None,
+        session_factory: Callable[[], Session] = SessionLocal,
+        dedup: PublishDeduplicator | None = None,
+    ):
+        """
+        transport: conexión MQTT (por defecto la indicada por MQTT_TRANSPORT: paho
+        hacia MQTT_HOST o el broker en memoria para pruebas y benchmarks sin red).
+        session_factory: crea la sesión de BD de cada mensaje (por defecto SessionLocal).
+        dedup: huellas de lo último publicado por tópico (por defecto publish_dedup).
+        """
+        self.session_factory = session_factory
         MqttService.instance = self
-        self._last_status: dict[str, str] = {}
-        if MQTT_USER:
-            print(f"👤 Autenticando con usuario MQTT: {MQTT_USER}")
-            self.client.username_pw_set(MQTT_USER, MQTT_PASSWORD or None)
-
-        # Configurar TLS si existe CA_CERT
-        if MQTT_CA_CERT:
-            self.client.tls_set(
-                ca_certs=MQTT_CA_CERT,
-                certfile=None,
-                keyfile=None,
-                cert_reqs=ssl.CERT_REQUIRED,
-                tls_version=ssl.PROTOCOL_TLSv1_2
-            )
-            print(f"🔒 TLS habilitado usando CA: {MQTT_CA_CERT}")
-        else:
-            print("🔓 Conexión MQTT sin TLS")
+        self.dedup = dedup if dedup is not None else publish_dedup
+        self.pool = self._create_pool()
+        self.transport = transport if transport is not None else create_transport()
+        # Cola de salida: la ingesta sólo encola; un hilo propio publica y sigue los PUBACK
+        self.outbox = PublishQueue(
+            publish=lambda topic, payload, qos, retain: self.transport.publish(topic, payload=payload, qos=qos, retain=retain),
+            max_pending=MQTT_PUBLISH_QUEUE_SIZE,
+            max_inflight=MQTT_PUBLISH_MAX_INFLIGHT,
+            ack_timeout=MQTT_PUBLISH_ACK_TIMEOUT,
+            on_failure=self.dedup.forget,
+        )
+        # Módulos que dejan de reportar sin LWT → offline por el mismo camino que un LWT.
+        # Con suscripción compartida cada réplica ve sólo su parte: el silencio local no
+        # significa silencio del módulo, así que el monitor queda desactivado.
+        self.liveness = LivenessMonitor(
+            timeout=0 if MQTT_SHARED_GROUP else LIVENESS_TIMEOUT_SECONDS,
+            on_expire=self._on_module_silent,
+        )
+        # TAGS de cada módulo en orden de timestamp del lector (descarta los atrasados)
+        self.reorder = ReorderBuffer(
+            window=MQTT_REORDER_WINDOW_MS / 1000.0,
+            on_release=lambda module_code, item: self._dispatch(*item),
+            enabled=MQTT_REORDER_ENABLED,
+        )
         # Callbacks
-        self.client.on_connect = self._on_connect
-        self.client.on_disconnect = self._on_disconnect
-        self.client.on_message = self._on_message
+        self.transport.on_connect = self._on_connect
+        self.transport.on_disconnect = self._on_disconnect
+        self.transport.on_message = self._on_message
+        self.transport.on_publish = self.outbox.on_publish
 
         # Hilo para loop
         self._thread = None
         self._running = False
 
+    def _create_pool(self) -> ShardedWorkerPool | None:
+        """Pool de workers: el hilo de paho sólo encola, la BD se toca en los workers."""
+        return ShardedWorkerPool(
+            workers=MQTT_WORKERS,
+            queue_size=MQTT_WORKER_QUEUE_SIZE,
+            batch_handler=self._handle_tags_batch if MQTT_BATCH_ENABLED else None,
+            batch_max_size=MQTT_BATCH_MAX_MESSAGES,
+            batch_max_delay=MQTT_BATCH_MAX_DELAY_MS / 1000.0,
+            latency_observer=mqtt_ingest_latency_seconds.observe,
+        )
+
     # ----------- ciclo de vida -----------
     def start(self):
-        print(f"🚀 Conectando a MQTT broker {MQTT_HOST}:{MQTT_PORT} ...")
-        self.client.connect(MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE)
+        self.pool.start()
+        self.outbox.start()
+        self.reorder.start()
+        cache_sync.start(self.session_factory)
+        presence_tracker.start(self.session_factory)
+        dead_letters.start()
+        tag_read_log.start(self.session_factory)
+        self._start_liveness()
+        log.info("mqtt_conectando", host=MQTT_HOST, port=MQTT_PORT)
+        self.transport.connect(MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE)
         self._running = True
-        self._thread = threading.Thread(target=self.client.loop_forever, daemon=True)
+        self._thread = threading.Thread(target=self.transport.loop_forever, daemon=True)
         self._thread.start()
-        print("✅ Loop MQTT iniciado en thread separado")
+        log.info("mqtt_loop_iniciado")
 
     def stop(self):
         self._running = False
+        # Terminar lo encolado y vaciar la cola de salida antes de cerrar la conexión
+        self.liveness.stop()
+        self.reorder.stop()
+        self.pool.stop()
+        self.outbox.stop()
+        presence_tracker.stop()
+        dead_letters.stop()
+        tag_read_log.stop()
+        cache_sync.stop()
         try:
-            self.client.disconnect()
-            print("🛑 Conexión MQTT cerrada correctamente")
-        except:
-            print("⚠️ Error cerrando conexión MQTT")
-            pass
-    
+            self.transport.disconnect()
+            log.info("mqtt_desconectado")
+        except Exception as e:
+            log.warning("error_cerrando_mqtt", error=str(e))
+
+    def stats(self) -> dict:
+        return {
+            "pool": self._pool_stats(),
+            "tag_registry": tag_registry.stats(),
+            "snapshots": snapshot_store.stats(),
+            "transactions": tx_stats.stats(),
+            "alerts": alert_index.stats(),
+            "presence": presence_tracker.stats(),
+            "bay_state": bay_state_view.stats(),
+            "liveness": self.liveness.stats(),
+            "reorder": self.reorder.stats(),
+            "publish_dedup": self.dedup.stats(),
+            "publish_queue": self.outbox.stats(),
+            "dead_letters": dead_letters.stats(),
+            "tag_reads": tag_read_log.stats(),
+            "duplicates": recent_messages.stats(),
+            "cache_sync": cache_sync.stats(),
+        }
+
+    def _pool_stats(self) -> dict:
+        return self.pool.stats()
+
     # ----------- callbacks -----------
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            print("✅ MQTT conectado al broker")
-            print("📡 Suscribiéndose a tópicos...")
-            client.subscribe(SUBSCRIBE_TAGS_ALL, qos=MQTT_QOS)
-            client.subscribe(SUBSCRIBE_LWT_ALL, qos=MQTT_QOS)
-            client.subscribe(SUBSCRIBE_ONLINE_ALL, qos=MQTT_QOS)
-            print(f"   ✔ Suscrito a: {SUBSCRIBE_TAGS_ALL}")
-            print(f"   ✔ Suscrito a: {SUBSCRIBE_LWT_ALL}")
-            print(f"   ✔ Suscrito a: {SUBSCRIBE_ONLINE_ALL}")
+            for topic_filter in SUBSCRIPTIONS:
+                client.subscribe(topic_filter, qos=MQTT_QOS)
+            log.info("mqtt_conectado", topics=SUBSCRIPTIONS)
         else:
-            print(f"❌ Error de conexión MQTT: rc={rc}")
+            log.error("mqtt_error_conexion", rc=rc)
 
     def _on_disconnect(self, client, userdata, rc):
-        print(f"⚠️ MQTT desconectado (rc={rc})")
+        log.warning("mqtt_desconexion", rc=rc)
 
     def _on_message(self, client, userdata, msg):
-        try:
-            # Abrir sesión por mensaje (thread-safe)
-            db: Session = SessionLocal()
+        # Hilo de red de paho: sólo encolar en el shard del módulo (orden por módulo)
+        topic = msg.topic
+        payload_bytes = bytes(msg.payload)
+        module_code = extract_module_code(topic) or ""
+        mqtt_messages.inc(topic_suffix(topic))
+        self._track_liveness(topic, module_code)
+        self._route(topic, module_code, payload_bytes, bool(getattr(msg, "dup", False)))
+
+    def _route(self, topic: str, module_code: str, payload_bytes: bytes, redelivered: bool = False):
+        # Los TAGS pasan por el buffer de reorden; el resto va directo a procesarse.
+        # redelivered: flag DUP de MQTT (reenvío QoS 1 de un mensaje ya entregado)
+        if self.reorder.enabled and topic.endswith("/TAGS"):
+            self.reorder.offer(module_code, snapshot_reads(payload_bytes), (topic, payload_bytes, redelivered))
+            return
+        if topic.endswith("/LWT") or topic.endswith("/ONLINE"):
+            # El módulo se reinició o reconectó: su reloj pudo retroceder
+            self.reorder.reset(module_code)
+        self._dispatch(topic, payload_bytes, redelivered)
+
+    def _dispatch(self, topic: str, payload_bytes: bytes, redelivered: bool = False):
+        module_code = extract_module_code(topic) or ""
+        if MQTT_BATCH_ENABLED and topic.endswith("/TAGS"):
+            submitted = self.pool.submit_batch_item(module_code, (topic, payload_bytes, redelivered))
+        else:
+            submitted = self.pool.submit(module_code, lambda: self._handle_message(topic, payload_bytes, redelivered))
+        if not submitted:
+            self._drop(module_code, topic, payload_bytes)
+
+    @staticmethod
+    def _drop(module_code: str, topic: str, payload_bytes: bytes):
+        # Cola del shard llena: a dead letters para reinyectarlo cuando baje la carga
+        log.warning("mensaje_descartado_cola_llena", module=module_code, topic=topic)
+        dead_letters.record(topic, payload_bytes, QueueFullError(module_code))
+
+    def _track_liveness(self, topic: str, module_code: str):
+        if topic.endswith("/LWT"):
+            self.liveness.forget(module_code)
+        elif topic.endswith("/TAGS") or topic.endswith("/ONLINE"):
+            self.liveness.touch(module_code)
+
+    def _start_liveness(self):
+        # Los módulos online al arrancar también deben reportar dentro del plazo
+        for module_code in presence_tracker.online_modules():
+            self.liveness.touch(module_code)
+        self.liveness.start()
+
+    def _on_module_silent(self, module_code: str):
+        # Hilo de liveness: un LWT sintético en el shard del módulo (orden por módulo)
+        self.reorder.reset(module_code)
+        self.inject(topic_lwt(module_code), b"offline")
+
+    def replay(self, topic: str, payload_bytes: bytes):
+        """
+        Reinyecta un dead letter por el camino de un mensaje del broker: un TAGS pasa por el
+        buffer de reorden, que descarta el anterior a lo ya aplicado del módulo (no se
+        reabren PeopleInMaintenance ya cerradas). Se reprocesa completo, sin snapshot.
+        """
+        module_code = extract_module_code(topic) or ""
+        if topic.endswith("/TAGS"):
+            snapshot_store.invalidate(module_code)
+        self._route(topic, module_code, payload_bytes)
+
+    def inject(self, topic: str, payload_bytes: bytes):
+        """
+        Procesa un mensaje generado por el propio backend (LWT por silencio) en el shard
+        de su módulo, sin pasar por el buffer de reorden.
+        """
+        module_code = extract_module_code(topic) or ""
+        if not self.pool.submit(module_code, lambda: self._handle_message(topic, payload_bytes)):
+            self._drop(module_code, topic, payload_bytes)
+
+    def _handle_tags_batch(self, items: list[tuple[str, bytes, bool]]):
+        # Modo lote: varios TAGS (de distintos módulos) en una sola transacción
+        payloads: list[TagsPayload] = []
+        raw: list[tuple[str, bytes]] = []
+        keys: list[bytes | None] = []
+        for topic, payload_bytes, redelivered in items:
             try:
-                topic = msg.topic
-                payload_raw = msg.payload.decode("utf-8", errors="ignore").strip()
-                print(f"\n📩 [MQTT] Mensaje recibido")
-                print(f"   📌 Topic: {topic}")
-                print(f"   📦 Payload crudo: {payload_raw}")
-                # Ruteo por sufijo
-                if topic.endswith("/TAGS"):
-                    # Parsear JSON
-                    data = json.loads(payload_raw)
-                    payload = TagsPayload(**data)
-                    print(f"   ✅ Payload TAGS parseado correctamente")
-                    print(f"   🧑‍💻 Módulo: {payload.module_loto_code}")
-                    print(f"   👥 Cantidad CARD: {len(payload.tags.get('CARD', []))}")
-                    print(f"   🔒 Cantidad LOTO: {len(payload.tags.get('LOTO', []))}")
+                with mqtt_stage_seconds.time("parse"):
+                    payload = decode_tags_payload(payload_bytes)
+            except Exception as e:
+                mqtt_parse_failures.inc("TAGS")
+                log.warning("error_parseando_tags", topic=topic, error=str(e))
+                dead_letters.record(topic, payload_bytes, e)
+                continue
+            duplicate, key = self._reserve(payload, redelivered)
+            if duplicate:
+                continue
+            tag_read_log.record(payload)
+            payloads.append(payload)
+            raw.append((topic, payload_bytes))
+            keys.append(key)
+        if not payloads:
+            return
 
-                    status_payload, publish_topic = process_tags_payload(db, payload)
-                    print(f"   📊 Resultado de lógica → Status: {status_payload.status}")
-
-                    if status_payload.status == "alert":
-                        for alert in status_payload.alerts:
-                            print(f"      🚨 Alerta: {alert.alert_code} - {alert.name} {alert.lastname} → {alert.message}")
-
-                    # Publicar STATUS
-                    self.publish_status_if_changed(payload.module_loto_code, status_payload.dict())
-                    print(f"   📤 STATUS publicado en {publish_topic}: {status_payload.dict()}")
-
-                # --------- Procesar LWT ---------
-                elif topic.endswith("/LWT"):
-                    module_code = extract_module_code(topic) or ""
-                    # LWT puede ser 'offline' simple
-                    status_text = payload_raw.replace('"', '').strip().lower()
-                    print(f"   🔌 LWT recibido → módulo {module_code}, estado={status_text}")
-                    process_lwt_message(db, module_code, status_text)
-                
-                # --------- Procesar ONLINE ---------
-                elif topic.endswith("/ONLINE"):
-                    module_code = extract_module_code(topic) or ""
-                    # payload típico: {"module_loto_code":"X","status":"ONLINE"}
-                    try:
-                        data = json.loads(payload_raw)
-                        status_text = str(data.get("status", "ONLINE"))
-                    except Exception:
-                        status_text = payload_raw
-                    print(f"   📡 ONLINE recibido → módulo {module_code}, estado={status_text}")
-                    process_lwt_message(db, module_code, status_text)  # reutilizamos el mapeo online/offline
-                    
-                else:
-                    # otros posibles tópicos futuros
-                    print("   ❔ Tópico no reconocido")
-                    pass
+        db: Session = self.session_factory()
+        try:
+            try:
+                results = process_tags_batch(db, payloads)
+            except Exception:
+                recent_messages.release(keys)
+                raise
+            for payload, (topic, payload_bytes), key, result in zip(payloads, raw, keys, results):
+                if isinstance(result, StaleSnapshotError):
+                    continue
+                if isinstance(result, Exception):
+                    # Sólo este mensaje falló: a dead letters, sin perder el resto del lote
+                    recent_messages.release([key])
+                    dead_letters.record(topic, payload_bytes, result)
+                    continue
+                status_payload, publish_topic = result
+                self._check_routed(topic, payload_bytes, payload.module_loto_code, status_payload, key)
+                self.publish_status_if_changed(payload.module_loto_code, status_payload.dict())
+        finally:
+            tx_stats.record_message(db)
+            db.close()
 
+    def _handle_message(self, topic: str, payload_bytes: bytes, redelivered: bool = False):
+        # Se ejecuta en un worker del pool
+        try:
+            # Abrir sesión por mensaje (thread-safe)
+            db: Session = self.session_factory()
+            try:
+                self._process_message(db, topic, payload_bytes, redelivered)
             finally:
+                tx_stats.record_message(db)
                 db.close()
         except Exception as e:
-            print(f"❌ Error procesando mensaje MQTT: {e}")
+            log.exception("error_procesando_mensaje", topic=topic, error=str(e))
+            dead_letters.record(topic, payload_bytes, e)
 
-    def publish_status_if_changed(self, module_code: str, payload_obj: dict):
-        last = self._last_status.get(module_code)
-        current = payload_obj.get("status")
-        if current != last:
-            print(f"   🔄 Cambio de estado detectado: {last} → {current}")
-            self.publish_json(topic_status(module_code), payload_obj)
-            self._last_status[module_code] = current
+    def _process_message(self, db: Session, topic: str, payload_bytes: bytes, redelivered: bool = False):
+        """Procesa un mensaje con la sesión dada (hilo del pool o AsyncSession.run_sync)."""
+        log.debug("mensaje_recibido", topic=topic, bytes=len(payload_bytes))
+        # Ruteo por sufijo
+        if topic.endswith("/TAGS"):
+            # Validar bytes crudos directamente en TagsPayload
+            try:
+                with mqtt_stage_seconds.time("parse"):
+                    payload = decode_tags_payload(payload_bytes)
+            except Exception as e:
+                mqtt_parse_failures.inc("TAGS")
+                log.warning("error_parseando_tags", topic=topic, error=str(e))
+                dead_letters.record(topic, payload_bytes, e)
+                return
+            # Volcado completo sólo en DEBUG y muestreado por módulo
+            if log.isEnabledFor(logging.DEBUG) and payload_sampler.should_sample(payload.module_loto_code):
+                log.debug("payload_tags", module=payload.module_loto_code, payload=payload_bytes.decode("utf-8", errors="replace"))
+
+            # Redelivery QoS 1 ya procesada: se confirma y se descarta sin tocar la BD
+            duplicate, key = self._reserve(payload, redelivered)
+            if duplicate:
+                return
+            tag_read_log.record(payload)
+            try:
+                with mqtt_stage_seconds.time("total"):
+                    status_payload, publish_topic = process_tags_payload(db, payload)
+            except StaleSnapshotError:
+                return  # otra réplica ya aplicó un TAGS más nuevo: nada que publicar
+            except Exception:
+                recent_messages.release([key])
+                raise
+            log.debug(
+                "tags_procesado", module=payload.module_loto_code, status=status_payload.status,
+                cards=len(payload.tags.get("CARD", [])), lotos=len(payload.tags.get("LOTO", [])),
+            )
+
+            self._check_routed(topic, payload_bytes, payload.module_loto_code, status_payload, key)
+            # Publicar STATUS
+            self.publish_status_if_changed(payload.module_loto_code, status_payload.dict())
+
+        # --------- Procesar LWT ---------
+        elif topic.endswith("/LWT"):
+            module_code = extract_module_code(topic) or ""
+            payload_raw = payload_bytes.decode("utf-8", errors="ignore").strip()
+            # LWT puede ser 'offline' simple
+            status_text = payload_raw.replace('"', '').strip().lower()
+            log.debug("lwt_recibido", module=module_code, status=status_text)
+            process_lwt_message(module_code, status_text)
+        
+        # --------- Procesar ONLINE ---------
+        elif topic.endswith("/ONLINE"):
+            module_code = extract_module_code(topic) or ""
+            # payload típico: {"module_loto_code":"X","status":"ONLINE"}
+            try:
+                data = decode_json(payload_bytes)
+                status_text = str(data.get("status", "ONLINE"))
+            except Exception:
+                mqtt_parse_failures.inc("ONLINE")
+                status_text = payload_bytes.decode("utf-8", errors="ignore").strip()
+            log.debug("online_recibido", module=module_code, status=status_text)
+            process_lwt_message(module_code, status_text)  # reutilizamos el mapeo online/offline
+            
         else:
-            print(f"   ⏸ Sin cambios de estado (se mantiene {current}), no se publica")
+            # otros posibles tópicos futuros
+            log.debug("topico_no_reconocido", topic=topic)
+
+    @staticmethod
+    def _reserve(payload: TagsPayload, redelivered: bool = False) -> tuple[bool, bytes | None]:
+        """
+        (es_duplicado, clave reservada). Un TAGS sin lecturas no tiene clave (None).
+        Sólo un reenvío (flag DUP) puede ser duplicado: un re-escaneo del lector repite las
+        mismas lecturas (timestamps de primera vista) y se procesa siempre; su clave queda
+        registrada para reconocer un reenvío posterior.
+        """
+        key = message_key(payload)
+        if key is None:
+            return False, None
+        if not redelivered:
+            recent_messages.add(key)
+            return False, key
+        if not recent_messages.reserve(key):
+            mqtt_duplicates.inc()
+            log.debug("tags_duplicado", module=payload.module_loto_code)
+            return True, None
+        return False, key
+
+    @staticmethod
+    def _check_routed(topic: str, payload_bytes: bytes, module_code: str, status_payload, key: bytes | None = None):
+        # status "error" sólo lo produce un module_loto_code sin bahía asignada
+        if status_payload.status == "error":
+            dead_letters.record(topic, payload_bytes, UnknownModuleError(module_code), key=key)
+            # Al reinyectarlo (p. ej. tras asignar la bahía) no debe contar como duplicado
+            recent_messages.release([key])
+
+    def publish_status_if_changed(self, module_code: str, payload_obj: dict):
+        # Se compara el payload completo: una lista de alertas nueva con el mismo
+        # status "alert" también es un cambio que el ESP32 debe recibir
+        if self.publish_if_changed(topic_status(module_code), payload_obj):
+            log.info("cambio_estado", module=module_code, actual=payload_obj.get("status"))
+
+    def publish_if_changed(self, topic: str, obj: dict, exclude: tuple[str, ...] = ()) -> bool:
+        """
+        Publica obj (retenido si MQTT_PUBLISH_RETAIN) sólo si su contenido difiere de lo
+        último publicado en el tópico. `exclude`: campos volátiles fuera de la comparación
+        (p. ej. "timestamp"). Retorna True si se publicó.
+        """
+        if not self.dedup.should_publish(topic, payload_digest(obj, exclude)):
+            mqtt_publish_suppressed.inc(topic_suffix(topic))
+            return False
+        try:
+            # Si la cola lo descarta, outbox.on_failure ya olvidó la huella
+            return self.publish_json(topic, obj, retain=MQTT_PUBLISH_RETAIN)
+        except Exception:
+            # No quedó encolado: el próximo mensaje debe volver a intentarlo
+            self.dedup.forget(topic)
+            raise
 
     # ----------- helpers -----------
-    def publish_json(self, topic: str, obj: dict):
+    def publish_json(self, topic: str, obj: dict, retain: bool = False) -> bool:
+        """Encola la publicación (no espera al broker). Retorna False si la cola la descartó."""
         payload = json.dumps(obj, ensure_ascii=False)
-        print(f"   📤 Publicando en topic={topic}, payload={payload}")
-        self.client.publish(topic, payload=payload, qos=MQTT_QOS, retain=False)
+        log.debug("publicando", topic=topic, bytes=len(payload), retain=retain)
+        with mqtt_stage_seconds.time("publish"):
+            return self.outbox.enqueue(topic, payload, qos=MQTT_QOS, retain=retain)
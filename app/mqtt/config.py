@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,5 +12,103 @@ MQTT_KEEPALIVE = int(os.getenv("MQTT_KEEPALIVE", "30"))
 MQTT_QOS = int(os.getenv("MQTT_QOS", "1"))
 MQTT_CA_CERT = os.getenv("MQTT_CA_CERT", "certs/ca.crt")
 
+# Escalado horizontal: con MQTT_SHARED_GROUP cada réplica se suscribe a
+# $share/<grupo>/... (el broker reparte los mensajes) y usa un client id único.
+# MQTT_SHARED_MAX_GAP_SECONDS: si una réplica no vio un módulo en ese lapso, otra
+# pudo procesar sus mensajes → su snapshot y su presencia locales se dan por obsoletos.
+MQTT_SHARED_GROUP = os.getenv("MQTT_SHARED_GROUP", "").strip()
+MQTT_SHARED_MAX_GAP_SECONDS = float(os.getenv("MQTT_SHARED_MAX_GAP_SECONDS", "30"))
+MQTT_INSTANCE_CLIENT_ID = (
+    f"{MQTT_CLIENT_ID}-{socket.gethostname()}-{os.getpid()}" if MQTT_SHARED_GROUP else MQTT_CLIENT_ID
+)
+# Sin suscripción compartida no hay otras réplicas: nada que invalidar por huecos
+SNAPSHOT_MAX_GAP_SECONDS = MQTT_SHARED_MAX_GAP_SECONDS if MQTT_SHARED_GROUP else 0.0
+# Invalidación de cachés entre réplicas (LISTEN/NOTIFY de PostgreSQL): activa por defecto
+# con suscripción compartida, donde otra réplica puede escribir lo que ésta tiene en memoria
+CACHE_SYNC_ENABLED = os.getenv("CACHE_SYNC_ENABLED", "true" if MQTT_SHARED_GROUP else "false").lower() in ("1", "true", "yes")
+CACHE_SYNC_CHANNEL = os.getenv("CACHE_SYNC_CHANNEL", "loto_cache")
+
+# Transporte MQTT: "paho" (broker real) o "memory" (broker en memoria, sin red)
+MQTT_TRANSPORT = os.getenv("MQTT_TRANSPORT", "paho").lower()
+
+# Publicación de STATUS/USERS: sólo si el contenido cambió (huella por tópico) y como
+# mensaje retenido, para que un ESP32 que se reconecta reciba el último estado
+MQTT_PUBLISH_RETAIN = os.getenv("MQTT_PUBLISH_RETAIN", "true").lower() in ("1", "true", "yes")
+MQTT_PUBLISH_DEDUP_MAX_TOPICS = int(os.getenv("MQTT_PUBLISH_DEDUP_MAX_TOPICS", "20000"))
+# Cola de publicación: pendientes (uno por tópico), ventana de mensajes sin PUBACK
+# y plazo para dar por fallido un mensaje sin confirmar
+MQTT_PUBLISH_QUEUE_SIZE = int(os.getenv("MQTT_PUBLISH_QUEUE_SIZE", "10000"))
+MQTT_PUBLISH_MAX_INFLIGHT = int(os.getenv("MQTT_PUBLISH_MAX_INFLIGHT", "100"))
+MQTT_PUBLISH_ACK_TIMEOUT = float(os.getenv("MQTT_PUBLISH_ACK_TIMEOUT", "30"))
+
 # Prefijo de todos los tópicos de tu app
 MQTT_APP_PREFIX = os.getenv("MQTT_APP_PREFIX", "APP/LOTO_RFID")
+
+# Modo de ingesta: "threaded" (loop de paho en un hilo + pool de workers) o
+# "asyncio" (paho sobre el event loop de la app + motor asíncrono de SQLAlchemy)
+MQTT_MODE = os.getenv("MQTT_MODE", "threaded").lower()
+# Modo asyncio: tareas consumidoras (particiones por módulo) procesando en paralelo
+MQTT_ASYNC_CONCURRENCY = int(os.getenv("MQTT_ASYNC_CONCURRENCY", "64"))
+
+# Pool de workers para el procesamiento de mensajes entrantes
+MQTT_WORKERS = int(os.getenv("MQTT_WORKERS", "8"))
+MQTT_WORKER_QUEUE_SIZE = int(os.getenv("MQTT_WORKER_QUEUE_SIZE", "1000"))
+
+# Presencia de módulos (LWT/ONLINE/TAGS): cada cuántos segundos se vuelcan los cambios a bahias
+PRESENCE_FLUSH_INTERVAL_SECONDS = float(os.getenv("PRESENCE_FLUSH_INTERVAL_SECONDS", "2"))
+
+# Liveness: segundos sin TAGS/ONLINE tras los que un módulo se marca offline (0 = desactivado,
+# por defecto: debe superar el intervalo de reporte de los lectores) y resolución (tick, > 0)
+# de la rueda de temporizadores
+LIVENESS_TIMEOUT_SECONDS = float(os.getenv("LIVENESS_TIMEOUT_SECONDS", "0"))
+LIVENESS_TICK_SECONDS = float(os.getenv("LIVENESS_TICK_SECONDS", "1"))
+
+# Dead letters: mensajes que no pudieron procesarse, en segmentos JSONL acotados
+DEAD_LETTER_DIR = os.getenv("DEAD_LETTER_DIR", "data/dead_letters")
+DEAD_LETTER_SEGMENT_BYTES = int(os.getenv("DEAD_LETTER_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+DEAD_LETTER_MAX_SEGMENTS = int(os.getenv("DEAD_LETTER_MAX_SEGMENTS", "16"))
+DEAD_LETTER_QUEUE_SIZE = int(os.getenv("DEAD_LETTER_QUEUE_SIZE", "10000"))
+DEAD_LETTER_FLUSH_SECONDS = float(os.getenv("DEAD_LETTER_FLUSH_SECONDS", "1"))
+
+# Idempotencia TAGS (redeliveries QoS 1): vigencia y tamaño máximo del índice de recientes
+MQTT_DEDUP_TTL_SECONDS = float(os.getenv("MQTT_DEDUP_TTL_SECONDS", "600"))
+MQTT_DEDUP_MAX_ENTRIES = int(os.getenv("MQTT_DEDUP_MAX_ENTRIES", "100000"))
+
+# Registro de lecturas (tabla tag_reads): volcado por lotes cada TAG_READS_FLUSH_SECONDS o
+# al juntar TAG_READS_FLUSH_ROWS filas; hasta TAG_READS_QUEUE_SIZE filas en memoria.
+# Retención en días (particiones diarias en PostgreSQL; 0 = sin borrar)
+TAG_READS_ENABLED = os.getenv("TAG_READS_ENABLED", "true").lower() in ("1", "true", "yes")
+TAG_READS_FLUSH_ROWS = int(os.getenv("TAG_READS_FLUSH_ROWS", "5000"))
+TAG_READS_FLUSH_SECONDS = float(os.getenv("TAG_READS_FLUSH_SECONDS", "2"))
+TAG_READS_QUEUE_SIZE = int(os.getenv("TAG_READS_QUEUE_SIZE", "200000"))
+TAG_READS_RETENTION_DAYS = int(os.getenv("TAG_READS_RETENTION_DAYS", "90"))
+
+# Snapshots TAGS: segundos tras los cuales se fuerza una reconciliación completa
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("SNAPSHOT_MAX_AGE_SECONDS", "300"))
+
+# Registro en memoria de tags (tag_code → usuario). 0 = sin límite
+TAG_REGISTRY_MAX_SIZE = int(os.getenv("TAG_REGISTRY_MAX_SIZE", "100000"))
+
+# Reorden de TAGS por timestamp del lector: los snapshots más viejos que el último aplicado
+# se descartan. Con MQTT_REORDER_WINDOW_MS > 0 además se retiene cada snapshot ese tiempo
+# para que uno anterior que llegue después se procese primero (suma la ventana a la
+# latencia de todos los TAGS; por defecto 0 = sin retener, sólo descartar atrasados)
+MQTT_REORDER_ENABLED = os.getenv("MQTT_REORDER_ENABLED", "true").lower() in ("1", "true", "yes")
+MQTT_REORDER_WINDOW_MS = int(os.getenv("MQTT_REORDER_WINDOW_MS", "0"))
+# Un snapshot más de MAX_REGRESSION segundos anterior al último aplicado es un reloj
+# reiniciado, no un atraso; tras MAX_IDLE segundos sin TAGS se olvida lo aplicado del módulo
+MQTT_REORDER_MAX_REGRESSION_SECONDS = float(os.getenv("MQTT_REORDER_MAX_REGRESSION_SECONDS", "300"))
+MQTT_REORDER_MAX_IDLE_SECONDS = float(os.getenv("MQTT_REORDER_MAX_IDLE_SECONDS", "120"))
+
+# Micro-lotes de mensajes TAGS (opcional)
+MQTT_BATCH_ENABLED = os.getenv("MQTT_BATCH_ENABLED", "false").lower() in ("1", "true", "yes")
+MQTT_BATCH_MAX_MESSAGES = int(os.getenv("MQTT_BATCH_MAX_MESSAGES", "50"))
+MQTT_BATCH_MAX_DELAY_MS = int(os.getenv("MQTT_BATCH_MAX_DELAY_MS", "20"))
+
+# Ventana (minutos) en la que infracciones repetidas se colapsan en una sola alerta
+ALERT_WINDOW_MINUTES = int(os.getenv("ALERT_WINDOW_MINUTES", "10"))
+ALERT_INDEX_MAX_ENTRIES = int(os.getenv("ALERT_INDEX_MAX_ENTRIES", "100000"))
+
+# Vista en memoria del estado de las bahías (GET /api/bahias): se reconstruye desde la BD
+# cada BAY_STATE_REFRESH_SECONDS para recoger cambios hechos fuera de esta réplica (0 = nunca)
+BAY_STATE_REFRESH_SECONDS = float(os.getenv("BAY_STATE_REFRESH_SECONDS", "60"))
@@ -0,0 +1,402 @@
+# app/mqtt/dead_letter.py
+import base64
+import json
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter as Tally, OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from app.logger import get_logger
+from app.metrics import mqtt_dead_letters
+from .config import (
+    DEAD_LETTER_DIR,
+    DEAD_LETTER_SEGMENT_BYTES,
+    DEAD_LETTER_MAX_SEGMENTS,
+    DEAD_LETTER_QUEUE_SIZE,
+    DEAD_LETTER_FLUSH_SECONDS,
+)
+
+log = get_logger(__name__)
+
+SEGMENT_SUFFIX = ".jsonl"
+REPLAYED_FILE = "replayed.txt"
+
+
+class UnknownModuleError(Exception):
+    """TAGS de un module_loto_code que no está asignado a ninguna bahía."""
+
+
+class QueueFullError(Exception):
+    """Mensaje descartado al llegar con la cola de su shard llena (se puede reinyectar)."""
+
+
+def error_name(error: BaseException | str) -> str:
+    return error if isinstance(error, str) else type(error).__name__
+
+
+class _Segment:
+    """Índice en memoria de un segmento: id, offset en bytes y error de cada línea."""
+    __slots__ = ("number", "ids", "offsets", "errors", "counts", "size")
+
+    def __init__(self, number: int):
+        self.number = number
+        self.ids = array("q")
+        self.offsets = array("q")
+        self.errors: List[str] = []
+        self.counts: Tally = Tally()
+        self.size = 0
+
+    def add(self, entry_id: int, offset: int, error: str):
+        self.ids.append(entry_id)
+        self.offsets.append(offset)
+        self.errors.append(error)
+        self.counts[error] += 1
+
+    def find(self, entry_id: int) -> Optional[int]:
+        i = bisect_left(self.ids, entry_id)
+        return i if i < len(self.ids) and self.ids[i] == entry_id else None
+
+
+class DeadLetterStore:
+    """
+    Mensajes MQTT que no pudieron procesarse (JSON inválido, validación de TagsPayload,
+    módulo desconocido, error de procesamiento), para medirlos y reinyectarlos.
+    - Archivo append-only en segmentos JSONL (00000001.jsonl, ...) de hasta segment_bytes;
+      al superar max_segments se borra el más antiguo → espacio en disco acotado.
+    - record() no hace E/S: encola en memoria (acotada, descarta si se llena) y un hilo
+      escribe por lotes cada flush_interval. Un lector enviando basura no frena la ingesta.
+    - Con `key` (idempotency.message_key) un mismo TAGS se registra una sola vez: un módulo
+      sin bahía repite su snapshot cada pocos segundos y sólo interesa cuando cambia.
+    - Los segmentos se leen una vez (start o primera consulta) para armar un índice en
+      memoria (id → segmento, offset) y los conteos por error: list/get/count sólo leen
+      del disco las líneas que devuelven.
+    - claim() marca las entradas como reinyectadas (replayed.txt en el mismo directorio):
+      un segundo replay no vuelve a inyectarlas salvo que se pida explícitamente.
+    Cada línea: {"id", "ts", "topic", "error", "detail", "payload_b64"}.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEAD_LETTER_DIR,
+        segment_bytes: int = DEAD_LETTER_SEGMENT_BYTES,
+        max_segments: int = DEAD_LETTER_MAX_SEGMENTS,
+        queue_size: int = DEAD_LETTER_QUEUE_SIZE,
+        flush_interval: float = DEAD_LETTER_FLUSH_SECONDS,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max(1, max_segments)
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self._pending: Deque[dict] = deque()
+        self._recent_keys: "OrderedDict[bytes, None]" = OrderedDict()  # LRU de hasta queue_size
+        self._lock = threading.Lock()        # cola en memoria y contadores
+        self._io_lock = threading.Lock()     # archivos de segmentos e índice
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loaded = False
+        self._segments: List[_Segment] = []  # segmentos en disco, ascendente
+        self._by_error: Tally = Tally()      # conteo de lo que hay en disco
+        self._replayed: Set[int] = set()
+        self._next_id = 1
+        self.dropped = 0
+        self.written = 0
+        self.repeated = 0
+
+    # ----------- registro (hilos de ingesta) -----------
+    def record(
+        self,
+        topic: str,
+        payload_bytes: bytes,
+        error: BaseException | str,
+        detail: str = "",
+        key: Optional[bytes] = None,
+    ):
+        """Encola el mensaje fallido. Nunca bloquea: si la cola está llena, se descarta."""
+        if key is not None:
+            with self._lock:
+                if key in self._recent_keys:
+                    self._recent_keys.move_to_end(key)
+                    self.repeated += 1
+                    return
+                self._recent_keys[key] = None
+                if len(self._recent_keys) > self.queue_size:
+                    self._recent_keys.popitem(last=False)
+        name = error_name(error)
+        mqtt_dead_letters.inc(name)
+        entry = {
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "topic": topic,
+            "error": name,
+            "detail": (detail or ("" if isinstance(error, str) else str(error)))[:500],
+            "payload_b64": base64.b64encode(payload_bytes).decode("ascii"),
+        }
+        with self._lock:
+            if len(self._pending) >= self.queue_size:
+                self.dropped += 1
+                return
+            self._pending.append(entry)
+
+    # ----------- segmentos -----------
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:08d}{SEGMENT_SUFFIX}")
+
+    def _replayed_path(self) -> str:
+        return os.path.join(self.directory, REPLAYED_FILE)
+
+    def _index_segment(self, number: int) -> _Segment:
+        segment = _Segment(number)
+        try:
+            with open(self._path(number), "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        segment.add(entry["id"], segment.size, entry.get("error", ""))
+                    except (ValueError, KeyError):
+                        pass  # línea truncada por un corte a mitad de escritura
+                    segment.size += len(line)
+        except FileNotFoundError:
+            pass
+        return segment
+
+    def _load(self):
+        """Con _io_lock: indexa los segmentos existentes (una sola vez; no crea el directorio)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.isdir(self.directory):
+            return
+        numbers = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[: -len(SEGMENT_SUFFIX)].isdigit()
+        )
+        for number in numbers:
+            segment = self._index_segment(number)
+            self._segments.append(segment)
+            self._by_error.update(segment.counts)
+            if segment.ids:
+                self._next_id = max(self._next_id, segment.ids[-1] + 1)
+        self._load_replayed()
+
+    def _load_replayed(self):
+        """Con _io_lock: ids ya reinyectados que siguen en disco; compacta el archivo."""
+        try:
+            with open(self._replayed_path(), "r", encoding="utf-8") as f:
+                ids = {int(line) for line in f if line.strip().isdigit()}
+        except FileNotFoundError:
+            return
+        self._replayed = {i for i in ids if self._locate(i) is not None}
+        if len(self._replayed) != len(ids):
+            self._write_replayed(sorted(self._replayed), "w")
+
+    def _write_replayed(self, ids: List[int], mode: str):
+        with open(self._replayed_path(), mode, encoding="utf-8") as f:
+            f.writelines(f"{i}\n" for i in ids)
+
+    def flush(self) -> int:
+        """Escribe lo encolado en el segmento actual (rotando si hace falta)."""
+        with self._lock:
+            batch = list(self._pending)
+            self._pending.clear()
+        with self._io_lock:
+            self._load()
+            if not batch:
+                return 0
+            if not self._segments:
+                self._segments.append(_Segment(1))
+            segment = self._segments[-1]
+            f = open(self._path(segment.number), "ab")
+            try:
+                for entry in batch:
+                    if segment.size >= self.segment_bytes:
+                        f.close()
+                        segment = self._rotate()
+                        f = open(self._path(segment.number), "ab")
+                    entry["id"] = self._next_id
+                    self._next_id += 1
+                    line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+                    f.write(line)
+                    segment.add(entry["id"], segment.size, entry["error"])
+                    segment.size += len(line)
+                    self._by_error[entry["error"]] += 1
+            finally:
+                f.close()
+        with self._lock:
+            self.written += len(batch)
+        log.debug("dead_letters_escritos", cantidad=len(batch), segmento=segment.number)
+        return len(batch)
+
+    def _rotate(self) -> _Segment:
+        """Con _io_lock: abre un segmento nuevo y borra los que exceden max_segments."""
+        segment = _Segment(self._segments[-1].number + 1)
+        self._segments.append(segment)
+        while len(self._segments) > self.max_segments:
+            oldest = self._segments.pop(0)
+            self._by_error.subtract(oldest.counts)
+            self._by_error += Tally()  # descarta los conteos en cero
+            self._replayed.difference_update(oldest.ids)
+            try:
+                os.remove(self._path(oldest.number))
+            except FileNotFoundError:
+                pass
+            log.info("dead_letters_segmento_eliminado", segmento=oldest.number)
+        return segment
+
+    # ----------- lectura -----------
+    def _locate(self, entry_id: int) -> Optional[Tuple[_Segment, int]]:
+        for segment in self._segments:
+            if segment.ids and segment.ids[0] <= entry_id <= segment.ids[-1]:
+                i = segment.find(entry_id)
+                return (segment, i) if i is not None else None
+        return None
+
+    def _read(self, picks: List[Tuple[_Segment, int]]) -> List[dict]:
+        """Con _io_lock: lee del disco sólo las líneas indicadas (segmento, posición)."""
+        entries = []
+        by_segment: Dict[int, List[int]] = {}
+        segments = {}
+        for segment, i in picks:
+            by_segment.setdefault(segment.number, []).append(i)
+            segments[segment.number] = segment
+        for number, positions in by_segment.items():
+            segment = segments[number]
+            try:
+                with open(self._path(number), "rb") as f:
+                    for i in positions:
+                        f.seek(segment.offsets[i])
+                        try:
+                            entry = json.loads(f.readline())
+                        except ValueError:
+                            continue
+                        entry["replayed"] = entry["id"] in self._replayed
+                        entries.append(entry)
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def _select(
+        self, limit: int, before_id: Optional[int], error: Optional[str], replayed: Optional[bool]
+    ) -> List[Tuple[_Segment, int]]:
+        """Con _io_lock: posiciones de las entradas que cumplen el filtro, de la más reciente a la más antigua."""
+        picks: List[Tuple[_Segment, int]] = []
+        for segment in reversed(self._segments):
+            end = bisect_left(segment.ids, before_id) if before_id is not None else len(segment.ids)
+            for i in range(end - 1, -1, -1):
+                if error and segment.errors[i] != error:
+                    continue
+                if replayed is not None and (segment.ids[i] in self._replayed) != replayed:
+                    continue
+                picks.append((segment, i))
+                if len(picks) >= limit:
+                    return picks
+        return picks
+
+    def list(
+        self,
+        limit: int = 100,
+        before_id: Optional[int] = None,
+        error: Optional[str] = None,
+        replayed: Optional[bool] = None,
+    ) -> List[dict]:
+        """Entradas escritas, de la más reciente a la más antigua (paginar con before_id)."""
+        with self._io_lock:
+            self._load()
+            return self._read(self._select(limit, before_id, error, replayed))
+
+    def get(self, ids: List[int]) -> List[dict]:
+        with self._io_lock:
+            self._load()
+            picks = [found for i in set(ids) if (found := self._locate(i)) is not None]
+            return sorted(self._read(picks), key=lambda e: e["id"])
+
+    def claim(
+        self,
+        ids: Optional[List[int]] = None,
+        limit: int = 100,
+        error: Optional[str] = None,
+        force: bool = False,
+    ) -> Tuple[List[dict], List[int]]:
+        """
+        Entradas a reinyectar (por ids, o las `limit` más recientes con `error`), que quedan
+        marcadas como reinyectadas. Sin force se omiten las ya reinyectadas: retorna
+        (entradas en orden de id, ids omitidos).
+        """
+        with self._io_lock:
+            self._load()
+            if ids:
+                entries = sorted(
+                    self._read([found for i in set(ids) if (found := self._locate(i)) is not None]),
+                    key=lambda e: e["id"],
+                )
+            else:
+                entries = self._read(self._select(limit, None, error, None if force else False))
+                entries.sort(key=lambda e: e["id"])
+            skipped = [] if force else [e["id"] for e in entries if e["replayed"]]
+            if skipped:
+                entries = [e for e in entries if not e["replayed"]]
+            new = [e["id"] for e in entries if e["id"] not in self._replayed]
+            if new:
+                self._replayed.update(new)
+                self._write_replayed(new, "a")
+        return entries, skipped
+
+    def count(self) -> dict:
+        with self._io_lock:
+            self._load()
+            by_error = dict(self._by_error)
+            replayed = len(self._replayed)
+        with self._lock:
+            pending = len(self._pending)
+        return {"total": sum(by_error.values()), "by_error": by_error, "replayed": replayed, "pending": pending}
+
+    @staticmethod
+    def payload(entry: dict) -> bytes:
+        return base64.b64decode(entry["payload_b64"])
+
+    # ----------- ciclo de vida -----------
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._io_lock:
+            self._load()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="dead-letters", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        self._thread = None
+        self._flush_safely()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush_safely()
+
+    def _flush_safely(self):
+        try:
+            self.flush()
+        except Exception as e:
+            log.warning("error_escribiendo_dead_letters", error=str(e))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "written": self.written,
+                "dropped": self.dropped,
+                "repeated": self.repeated,
+                "segments": len(self._segments),
+                "directory": self.directory,
+            }
+
+
+# Instancia global del proceso
+dead_letters = DeadLetterStore()
@@ -0,0 +1,109 @@
+# app/mqtt/idempotency.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from app.logger import get_logger
+from .config import MQTT_DEDUP_TTL_SECONDS, MQTT_DEDUP_MAX_ENTRIES
+from .payloads import TagsPayload
+
+log = get_logger(__name__)
+
+
+def message_key(payload: TagsPayload) -> Optional[bytes]:
+    """
+    Clave de idempotencia de un TAGS: módulo + (tipo, tag_code, timestamp) de cada lectura.
+    Una redelivery QoS 1 repite exactamente esas lecturas, pero también un re-escaneo
+    sin cambios (los timestamps son de primera vista): la clave sólo se usa para
+    descartar mensajes con flag DUP. Un TAGS vacío no tiene lecturas que lo distingan
+    → None (siempre se procesa).
+    """
+    reads = sorted(
+        (tag_type, read.tag_code, read.timestamp)
+        for tag_type, items in payload.tags.items()
+        for read in items
+    )
+    if not reads:
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    h.update(payload.module_loto_code.encode("utf-8"))
+    for tag_type, tag_code, timestamp in reads:
+        h.update(b"\x00" + tag_type.encode("utf-8") + b"\x1f" + tag_code.encode("utf-8") + b"\x1f" + timestamp.encode("utf-8"))
+    return h.digest()
+
+
+class RecentMessageIndex:
+    """
+    Índice de mensajes TAGS recientes para descartar redeliveries QoS 1 antes de tocar la BD.
+    - add() registra la clave de un mensaje nuevo (sin flag DUP): siempre se procesa.
+    - reserve() para un reenvío (flag DUP): si la clave ya estaba dentro del TTL es un duplicado.
+    - Si el procesamiento falla, release() la libera para que una redelivery se procese.
+    - Acotado por tiempo (ttl) y memoria (max_entries, LRU por inserción).
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.duplicates = 0
+
+    def reserve(self, key: bytes, now: Optional[float] = None) -> bool:
+        """True si el mensaje es nuevo (y queda registrado); False si es un duplicado."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._prune(now)
+            if key in self._entries:
+                self.duplicates += 1
+                return False
+            self._entries[key] = now
+            if self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.accepted += 1
+            return True
+
+    def add(self, key: bytes, now: Optional[float] = None):
+        """Registra (o renueva) la clave de un mensaje que se procesa sí o sí."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._prune(now)
+            self._entries[key] = now
+            self._entries.move_to_end(key)
+            if self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.accepted += 1
+
+    def release(self, keys: Iterable[Optional[bytes]]):
+        with self._lock:
+            for key in keys:
+                if key is not None:
+                    self._entries.pop(key, None)
+
+    def _prune(self, now: float):
+        limit = now - self.ttl
+        while self._entries:
+            key, seen_at = next(iter(self._entries.items()))
+            if seen_at >= limit:
+                break
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "accepted": self.accepted,
+                "duplicates": self.duplicates,
+            }
+
+
+# Instancia global del proceso
+recent_messages = RecentMessageIndex(ttl=MQTT_DEDUP_TTL_SECONDS, max_entries=MQTT_DEDUP_MAX_ENTRIES)
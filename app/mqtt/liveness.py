@@ -0,0 +1,182 @@
+# app/mqtt/liveness.py
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from app.logger import get_logger
+from .config import LIVENESS_TIMEOUT_SECONDS, LIVENESS_TICK_SECONDS
+
+log = get_logger(__name__)
+
+
+class HashedTimerWheel:
+    """
+    Rueda de temporizadores con hash: `slots` ranuras de `tick` segundos.
+    Una clave vence en la ranura int(deadline / tick) % slots; avanzar la rueda sólo
+    visita las ranuras de los ticks transcurridos, sin recorrer todas las claves.
+    Requiere que ningún plazo supere una vuelta (slots * tick).
+    """
+
+    def __init__(self, tick: float, slots: int, now: float):
+        if tick <= 0:
+            raise ValueError(f"tick debe ser > 0 (recibido {tick})")
+        self.tick = tick
+        self._slots: List[Set[str]] = [set() for _ in range(max(1, slots))]
+        self._slot_of: Dict[str, int] = {}
+        self._cursor = int(now / tick)  # próximo tick a procesar
+
+    @property
+    def span(self) -> float:
+        """Segundos que cubre una vuelta de la rueda."""
+        return len(self._slots) * self.tick
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._slot_of
+
+    def schedule(self, key: str, deadline: float):
+        """Programa (o reprograma) la clave; nunca en un tick ya procesado."""
+        self.cancel(key)
+        index = max(int(deadline / self.tick), self._cursor) % len(self._slots)
+        self._slots[index].add(key)
+        self._slot_of[key] = index
+
+    def cancel(self, key: str):
+        index = self._slot_of.pop(key, None)
+        if index is not None:
+            self._slots[index].discard(key)
+
+    def advance(self, now: float) -> List[str]:
+        """Vacía las ranuras de los ticks transcurridos hasta `now` y devuelve sus claves."""
+        due: List[str] = []
+        last = int(now / self.tick)
+        # Tras una pausa larga basta con una vuelta completa
+        start = max(self._cursor, last - len(self._slots) + 1)
+        for t in range(start, last + 1):
+            slot = self._slots[t % len(self._slots)]
+            for key in slot:
+                del self._slot_of[key]
+            due.extend(slot)
+            slot.clear()
+        self._cursor = max(self._cursor, last + 1)
+        return due
+
+
+class LivenessMonitor:
+    """
+    Detecta módulos que dejaron de reportar sin entregar su LWT (p. ej. sin energía).
+    - touch() registra la última llegada de TAGS/ONLINE: O(1), sólo guarda la hora y,
+      si el módulo no estaba programado, lo agenda en la rueda.
+    - Cada tick se revisan sólo las ranuras vencidas. Un módulo que siguió reportando
+      se reprograma a su nuevo plazo (reprogramación perezosa: a lo sumo una visita
+      por módulo y por `timeout`); uno en silencio durante `timeout` segundos se
+      entrega a on_expire y deja de seguirse hasta su próximo mensaje.
+    - Desactivado con timeout = 0 (por defecto): un módulo que reporta con menos
+      frecuencia que el timeout se marcaría offline, así que se habilita explícitamente.
+    """
+
+    def __init__(
+        self,
+        timeout: float = LIVENESS_TIMEOUT_SECONDS,
+        tick: float = LIVENESS_TICK_SECONDS,
+        on_expire: Optional[Callable[[str], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.timeout = timeout
+        self.tick = tick
+        self.on_expire = on_expire
+        self._clock = clock
+        self._wheel: Optional[HashedTimerWheel] = None
+        if self.enabled:
+            if tick <= 0:
+                raise ValueError(f"LIVENESS_TICK_SECONDS debe ser > 0 (recibido {tick})")
+            self._wheel = HashedTimerWheel(tick, math.ceil(timeout / tick) + 1, clock())
+            if self._wheel.span < timeout:
+                raise ValueError(f"la rueda cubre {self._wheel.span}s, menos que el timeout de {timeout}s")
+        self._last_seen: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.expired = 0
+        self.rescheduled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.timeout > 0
+
+    # ----------- llegadas -----------
+    def touch(self, module_code: str):
+        if not module_code or not self.enabled:
+            return
+        now = self._clock()
+        with self._lock:
+            self._last_seen[module_code] = now
+            if module_code not in self._wheel:
+                self._wheel.schedule(module_code, now + self.timeout)
+
+    def forget(self, module_code: str):
+        """Deja de seguir el módulo (p. ej. llegó su LWT: ya está offline)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._last_seen.pop(module_code, None)
+            self._wheel.cancel(module_code)
+
+    # ----------- ticks -----------
+    def check(self) -> List[str]:
+        """Avanza la rueda hasta ahora; devuelve (y notifica) los módulos vencidos."""
+        if not self.enabled:
+            return []
+        now = self._clock()
+        expired: List[str] = []
+        with self._lock:
+            for module_code in self._wheel.advance(now):
+                deadline = self._last_seen[module_code] + self.timeout
+                if deadline > now:
+                    self._wheel.schedule(module_code, deadline)
+                    self.rescheduled += 1
+                else:
+                    del self._last_seen[module_code]
+                    expired.append(module_code)
+            self.expired += len(expired)
+        for module_code in expired:
+            log.warning("modulo_sin_reportar", module=module_code, silencio_s=self.timeout)
+            if self.on_expire is not None:
+                try:
+                    self.on_expire(module_code)
+                except Exception as e:
+                    log.exception("error_liveness", module=module_code, error=str(e))
+        return expired
+
+    # ----------- ciclo de vida -----------
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="liveness", daemon=True)
+        self._thread.start()
+        log.info("liveness_iniciado", timeout_s=self.timeout, tick_s=self.tick)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=self.tick + 1)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            self.check()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "timeout_s": self.timeout,
+                "tracked": len(self._last_seen),
+                "expired": self.expired,
+                "rescheduled": self.rescheduled,
+            }
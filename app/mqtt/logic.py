@@ -1,109 +1,182 @@
 # app/mqtt/logic.py
 
+from sqlalchemy import func, insert, text, update
 from sqlalchemy.orm import Session
-from typing import List, Tuple
+from sqlalchemy.orm.attributes import set_committed_value
+from typing import Dict, Iterable, List, Tuple
 from app import models
-from .payloads import TagsPayload, StatusPayload, StatusAlertItem
-from .topics import topic_status
-from .config import MQTT_QOS
+from .payloads import TagsPayload, StatusPayload, StatusAlertItem, parse_timestamp
+from .topics import topic_status, topic_users
+from .config import MQTT_QOS, MQTT_SHARED_GROUP, ALERT_WINDOW_MINUTES
+from .snapshots import Snapshot, SnapshotDiff, SnapshotStore, snapshot_store
+from .registry import UserRef, tag_registry
+from .unit_of_work import on_commit, on_rollback, unit_of_work
+from .alert_index import alert_index
+from .presence import normalize_status, presence_tracker
+from .bay_state import bay_state_view
+from .cache_sync import cache_sync
+from .reorder import StaleSnapshotError, advance, dump_watermark, load_watermark, payload_reads
+from app.logger import get_logger
+from app.metrics import mqtt_stage_seconds, mqtt_stale_snapshots
 import json
 from datetime import datetime, timedelta, timezone
 import random
 import string
 
-WINDOW_MINUTES = 10
+WINDOW_MINUTES = ALERT_WINDOW_MINUTES
 
-def _get_users_by_tags(db: Session, tag_codes: List[str], required_type: str) -> List[models.User]:
+# Espacio de claves de los advisory locks por bahía (pg_advisory_xact_lock(espacio, id_bahía))
+BAY_LOCK_NAMESPACE = 0x4C4F  # "LO"
+
+log = get_logger(__name__)
+
+
+def _lock_bays(db: Session, bay_ids: Iterable[int]):
+    """
+    Serializa el procesamiento por bahía entre workers y réplicas: toma un advisory lock
+    de Postgres por bahía, liberado al terminar la transacción (COMMIT o ROLLBACK).
+    Sólo compiten mensajes de la misma bahía. Se toman en orden ascendente para que
+    dos lotes con bahías en común no se bloqueen mutuamente.
+    En otros motores no hace nada (el índice único parcial sigue protegiendo).
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    with mqtt_stage_seconds.time("bay_lock"):
+        for bay_id in sorted(set(bay_ids)):
+            db.execute(
+                text("SELECT pg_advisory_xact_lock(:namespace, :bay_id)"),
+                {"namespace": BAY_LOCK_NAMESPACE, "bay_id": bay_id},
+            )
+
+
+def _load_watermarks(db: Session, bahias: Iterable[models.Bahia]):
+    """Con las bahías bloqueadas: relee bahias.last_reads, que otra réplica pudo escribir."""
+    by_id = {b.id: b for b in bahias}
+    rows = db.query(models.Bahia.id, models.Bahia.last_reads).filter(models.Bahia.id.in_(by_id)).all()
+    for bay_id, data in rows:
+        set_committed_value(by_id[bay_id], "last_reads", data)
+
+
+def _advance_watermark(bahia: models.Bahia, payload: TagsPayload, now: datetime) -> bool:
+    """
+    Suscripción compartida: tras un reparto del broker otra réplica pudo aplicar ya un TAGS
+    más nuevo del módulo, y el ReorderBuffer local no lo vio. Con la bahía bloqueada se
+    compara con las lecturas del último TAGS aplicado (bahias.last_reads, mismas reglas que
+    el ReorderBuffer) y se reemplazan. Retorna False si el TAGS es anterior: no se aplica.
+    """
+    applied = advance(payload_reads(payload), load_watermark(bahia.last_reads, now))
+    if applied is None:
+        mqtt_stale_snapshots.inc()
+        log.info("tags_atrasado_omitido", module=bahia.module_loto_code)
+        return False
+    bahia.last_reads = dump_watermark(*applied, now)
+    return True
+
+
+def _get_users_by_tags(db: Session, tag_codes: List[str], required_type: str) -> List[UserRef]:
     """
     Devuelve usuarios que poseen tags (tags.tag_code IN tag_codes) y cuyo TypeTag.name == required_type.
     required_type: "CARD" o "LOTO".
+    Se resuelve contra el registro en memoria (tag_registry); sólo los fallos van a la BD.
     """
     if not tag_codes:
         return []
 
-    users = (
-        db.query(models.User)
-        .join(models.Tag, models.Tag.id_users == models.User.id)
-        .join(models.TypeTag, models.TypeTag.id == models.Tag.id_type_tag)
-        .filter(models.Tag.tag_code.in_(tag_codes))
-        .filter(models.TypeTag.name == required_type)
-        .all()
-    )
-    print(f"🔎 _get_users_by_tags → type={required_type}, encontrados={len(users)}")
-    for u in users:
-        print(f"   👤 {u.id} - {u.name} {u.lastname} (tag_type={required_type})")
+    users: Dict[int, UserRef] = {}
+    for info in tag_registry.lookup(db, tag_codes).values():
+        if info and info.type_name == required_type and info.user_id not in users:
+            users[info.user_id] = UserRef(info.user_id, info.name, info.lastname)
+    log.debug("usuarios_por_tags", tag_type=required_type, encontrados=len(users), user_ids=list(users))
 
-    # Join: Tag -> TypeTag -> User
-    return users
+    return list(users.values())
 
 def _upsert_type_alert(db: Session, name: str) -> models.TypeAlert:
     ta = db.query(models.TypeAlert).filter(models.TypeAlert.name == name).first()
     if not ta:
         ta = models.TypeAlert(name=name)
         db.add(ta)
-        db.commit()
-        db.refresh(ta)
-        print(f"🆕 Creado nuevo TypeAlert: {name}")
+        db.flush()  # se necesita su id para la inserción masiva de alertas
+        log.info("type_alert_creado", name=name)
     return ta
 
 def _create_alerts_for_violators(
     db: Session,
-    violators: List[models.User],
+    violators: List[UserRef],
     bahia: models.Bahia,
+    maintenance: models.Maintenance | None,
     reason_type_alert_name: str = "Ingreso sin candado"
 ):
     """
-    Opcional: crear registros en 'alerts' para cada infractor, si hay un mantenimiento activo.
-    Si no quieres persistir, puedes omitir este bloque.
+    Opcional: crear registros en 'alerts' para cada infractor, asociados al mantenimiento
+    en curso de la bahía. No hace COMMIT: forma parte de la transacción del mensaje.
+    Si el infractor ya tiene una alerta abierta en la bahía dentro de WINDOW_MINUTES,
+    no se inserta una nueva.
     """
     if not violators:
         return
 
-    print(f"🚨 Creando {len(violators)} alertas en BD para bahía={bahia.id}, motivo={reason_type_alert_name}")
-    type_alert = _upsert_type_alert(db, reason_type_alert_name)
-
-    # Heurística simple: si hay maintenances en esa bahía, toma la última
-    maintenance = (
-        db.query(models.Maintenance)
-        .filter(models.Maintenance.id_bahias == bahia.id)
-        .order_by(models.Maintenance.id.desc())
-        .first()
-    )
     if not maintenance:
-        print("⚠️ No se encontró mantenimiento activo en esta bahía, no se registran alertas.")
+        log.warning("alertas_sin_mantenimiento", bahia=bahia.id, violadores=len(violators))
         return  # no hay mantenimiento asociado
 
+    type_alert = _upsert_type_alert(db, reason_type_alert_name)
+
+    # Infracciones repetidas dentro de la ventana se colapsan en la alerta abierta
     now_t = datetime.now(timezone.utc)
-    for user in violators:
-        # hallamos PeopleInMaintenance (si existe) para vincular; si no, lo omitimos
-        pim = (
-            db.query(models.PeopleInMaintenance)
-            .filter(
-                models.PeopleInMaintenance.id_users == user.id,
-                models.PeopleInMaintenance.id_maintenance == maintenance.id
-            )
-            .order_by(models.PeopleInMaintenance.id.desc())
-            .first()
+    new_alerts = [u for u in violators if alert_index.reserve((u.id, bahia.id, type_alert.id), now_t)]
+    if len(new_alerts) < len(violators):
+        log.debug(
+            "alertas_suprimidas", bahia=bahia.id, suprimidas=len(violators) - len(new_alerts),
+            ventana_min=WINDOW_MINUTES,
         )
-
-        db_alert = models.Alert(
-            alert_time=now_t,
-            id_maintenance=maintenance.id,
-            id_people_in_maintenance=pim.id if pim else None,
-            id_types_alerts=type_alert.id,
-            resolved=False,
+    if not new_alerts:
+        return
+    reserved = [(u.id, bahia.id, type_alert.id) for u in new_alerts]
+    on_rollback(db, lambda: alert_index.release(reserved))
+    # Las demás réplicas también colapsan estas infracciones (tras el COMMIT)
+    for key in reserved:
+        cache_sync.notify(db, "alert", key)
+
+    # Último PeopleInMaintenance de cada infractor en una sola consulta (si existe, se vincula)
+    rows = (
+        db.query(models.PeopleInMaintenance.id_users, func.max(models.PeopleInMaintenance.id))
+        .filter(
+            models.PeopleInMaintenance.id_maintenance == maintenance.id,
+            models.PeopleInMaintenance.id_users.in_([u.id for u in new_alerts]),
         )
-        db.add(db_alert)
-        print(f"   ✅ Alerta registrada para {user.name} {user.lastname}, maintenance={maintenance.id}, pim_id={pim.id if pim else 'N/A'}")
-    db.commit()
+        .group_by(models.PeopleInMaintenance.id_users)
+        .all()
+    )
+    latest_pim: Dict[int, int] = dict(rows)
+
+    # INSERT masivo de alertas
+    db.execute(
+        insert(models.Alert),
+        [
+            {
+                "alert_time": now_t,
+                "id_maintenance": maintenance.id,
+                "id_people_in_maintenance": latest_pim.get(user.id),
+                "id_types_alerts": type_alert.id,
+                "id_users": user.id,
+                "resolved": False,
+            }
+            for user in new_alerts
+        ],
+    )
+    log.info(
+        "alertas_registradas", bahia=bahia.id, maintenance=maintenance.id,
+        motivo=reason_type_alert_name, user_ids=[u.id for u in new_alerts],
+    )
+    bay_id, maintenance_id, count = bahia.id, maintenance.id, len(new_alerts)
+    on_commit(db, lambda: bay_state_view.alerts_raised(bay_id, maintenance_id, count))
 
 def _parse_ts(ts: str) -> datetime | None:
-    try:
-        # "2025-09-07T12:34:56Z"
-        return datetime.fromisoformat(ts.replace("Z","+00:00"))
-    except Exception as e:
-        print(f"⚠️ Error parseando timestamp {ts}: {e}")
-        return None
+    # "2025-09-07T12:34:56Z"
+    value = parse_timestamp(ts)
+    if value is None:
+        log.warning("timestamp_invalido", ts=ts)
+    return value
 
 def _get_tag_user_info(db: Session, tag_codes: List[str]) -> List[dict]:
     """
@@ -116,37 +189,24 @@ def _get_tag_user_info(db: Session, tag_codes: List[str]) -> List[dict]:
     if not tag_codes:
         return []
 
-    # Buscar tags registrados con sus usuarios y tipos
-    results = (
-        db.query(
-            models.Tag.tag_code,
-            models.TypeTag.name.label("type_name"),
-            models.User.name.label("user_name"),
-            models.User.lastname.label("user_lastname")
-        )
-        .join(models.TypeTag, models.TypeTag.id == models.Tag.id_type_tag)
-        .join(models.User, models.User.id == models.Tag.id_users)
-        .filter(models.Tag.tag_code.in_(tag_codes))
-        .distinct()
-        .all()
-    )
-
-    found_tag_codes = {r.tag_code for r in results}
+    # Buscar tags registrados con sus usuarios y tipos (registro en memoria)
+    results = tag_registry.lookup(db, tag_codes)
 
     # Armar lista para tags conocidos
     info = []
-    for tag_code, type_name, user_name, user_lastname in results:
-        info.append({
-            "tag_code": tag_code,
-            "type": type_name,
-            "user_name": user_name,
-            "user_lastname": user_lastname,
-            "registered": True
-        })
+    for tag_code, found in results.items():
+        if found:
+            info.append({
+                "tag_code": tag_code,
+                "type": found.type_name,
+                "user_name": found.name,
+                "user_lastname": found.lastname,
+                "registered": True
+            })
 
     # Agregar los tags no registrados
-    for tag_code in tag_codes:
-        if tag_code not in found_tag_codes:
+    for tag_code, found in results.items():
+        if not found:
             info.append({
                 "tag_code": tag_code,
                 "type": None,
@@ -158,87 +218,56 @@ def _get_tag_user_info(db: Session, tag_codes: List[str]) -> List[dict]:
     return info
 
 
+def _extract_codes(payload: TagsPayload) -> Tuple[List[str], List[str]]:
+    card_codes = [t.tag_code for t in payload.tags.get("CARD", [])]
+    loto_codes = [t.tag_code for t in payload.tags.get("LOTO", [])]
+    return card_codes, loto_codes
 
 
-def process_tags_payload(db: Session, payload: TagsPayload) -> Tuple[StatusPayload, str]:
-    """
-    Procesa un payload TAGS:
-    - Actualiza bahía (online).
-    - Gestiona mantenimiento según LOTOs detectados.
-    - Determina infractores (CARD sin LOTO).
-    - Publica STATUS con resultado.
-    Retorna (status_payload, topic_de_publicacion)
-    """
-    print(f"\n📥 Procesando TAGS payload para módulo={payload.module_loto_code}")
-
-    # 1) Ubicar la bahía
-    bahia = (
-        db.query(models.Bahia)
-        .filter(models.Bahia.module_loto_code == payload.module_loto_code)
-        .first()
+def _unknown_module_status(module_code: str) -> StatusPayload:
+    log.warning("bahia_no_encontrada", module=module_code)
+    return StatusPayload(
+        module_loto_code=module_code,
+        status="error",
+        message="module_loto_code no asignado a ninguna bahía"
     )
-    if not bahia:
-        print(f"❌ No se encontró bahía con module_loto_code={payload.module_loto_code}")
-        status = StatusPayload(
-            module_loto_code=payload.module_loto_code,
-            status="error",
-            message="module_loto_code no asignado a ninguna bahía"
-        )
-        return status, topic_status(payload.module_loto_code)
 
-    # 2) Marcar módulo online
-    bahia.module_loto_status = "online"
-    db.commit()
-    print(f"   ✅ Bahía {bahia.id} marcada como ONLINE")
-
-    # 3) Extraer tags
-    card_codes = [t.tag_code for t in payload.tags.get("CARD", [])]
-    loto_codes = [t.tag_code for t in payload.tags.get("LOTO", [])]
-    now = datetime.now(timezone.utc)
-
-    print(f"   👥 Cards detectados={len(card_codes)}, Lotos detectados={len(loto_codes)}")
 
+def _apply_tags(
+    db: Session,
+    payload: TagsPayload,
+    bahia: models.Bahia,
+    maintenance: models.Maintenance | None,
+    card_codes: List[str],
+    loto_codes: List[str],
+    diff: SnapshotDiff,
+    now: datetime,
+) -> Tuple[StatusPayload, List[dict], models.Maintenance | None]:
+    """
+    Aplica un snapshot TAGS sobre la bahía (pasos 2 a 8) dentro de la transacción en curso.
+    No hace COMMIT ni publica. Retorna (status, tags_info, mantenimiento_resultante).
+    """
+    # El snapshot y la vista de esta bahía quedan obsoletos en las demás réplicas
+    cache_sync.notify(db, "bay", payload.module_loto_code)
+    # 2) La presencia (online) la registra presence_tracker al recibir el TAGS
+    # 3) Tags detectados
     # 4) Obtener usuarios por tipo
-    card_users = _get_users_by_tags(db, card_codes, "CARD")
-    loto_users = _get_users_by_tags(db, loto_codes, "LOTO")
+    with mqtt_stage_seconds.time("user_resolution"):
+        card_users = _get_users_by_tags(db, card_codes, "CARD")
+        loto_users = _get_users_by_tags(db, loto_codes, "LOTO")
+        # 📦 Generar información de tags detectados
+        tags_info = _get_tag_user_info(db, card_codes + loto_codes)
 
     card_user_ids = {u.id for u in card_users}
     loto_user_ids = {u.id for u in loto_users}
-    print(f"   📊 card_user_ids={card_user_ids}, loto_user_ids={loto_user_ids}")
-
-    # 📦 Generar información de tags detectados
-    all_tags = card_codes + loto_codes
-    tags_info = _get_tag_user_info(db, all_tags)
-
-    # Publicar información de usuarios por tag
-    if tags_info:
-        user_info_payload = {
-            "module_loto_code": payload.module_loto_code,
-            "timestamp": now.isoformat(),
-            "tags_info": tags_info
-        }
-
-    topic_users = f"APP/LOTO_RFID/{payload.module_loto_code}/USERS"
-    print(f"📤 Publicando info de tags detectados en {topic_users}")
-    try:
-        from .client import MqttService
-        if MqttService.instance:
-            MqttService.instance.publish_json(topic_users, user_info_payload)
-            print("✅ Info de tags enviada correctamente al ESP32")
-        else:
-            print("⚠️ MqttService.instance no está inicializado")
-    except Exception as e:
-        print(f"⚠️ Error publicando tags_info: {e}")
-
-    # 5) Buscar mantenimiento activo
-    maintenance = (
-        db.query(models.Maintenance)
-        .filter(models.Maintenance.id_bahias == bahia.id, models.Maintenance.end_time.is_(None))
-        .first()
+    log.debug(
+        "tags_resueltos", bahia=bahia.id, cards=len(card_codes), lotos=len(loto_codes),
+        card_users=len(card_user_ids), loto_users=len(loto_user_ids),
     )
 
-    # 6) Si hay LOTOs y no hay mantenimiento → crear uno
-    if loto_users or card_codes and not maintenance: ####### CONSULTAR SI SE VA A CREAR EL MANTENIMIENTO CUANDO SE DETECTA EN ALGUNO DE LAS STATIONs
+    # 6) Si hay LOTOs (o CARDs) y no hay mantenimiento → crear uno
+    new_maintenance = False
+    if (loto_users or card_codes) and not maintenance: ####### CONSULTAR SI SE VA A CREAR EL MANTENIMIENTO CUANDO SE DETECTA EN ALGUNO DE LAS STATIONs
         maintenance = models.Maintenance(
             name=_generate_maintenance_name(),
             id_bahias=bahia.id,
@@ -246,54 +275,33 @@ def process_tags_payload(db: Session, payload: TagsPayload) -> Tuple[StatusPaylo
             status="active"
         )
         db.add(maintenance)
-        db.commit()
-        db.refresh(maintenance)
-        print(f"🛠️ Nuevo mantenimiento iniciado en bahía {bahia.id}")
+        db.flush()  # se necesita su id para las inserciones masivas siguientes
+        new_maintenance = True
+        log.info("mantenimiento_iniciado", bahia=bahia.id, maintenance=maintenance.id)
 
     # 7) Actualizar PeopleInMaintenance para usuarios con LOTO
     if maintenance:
-        # Insertar/asegurar entradas activas
-        for user in loto_users:
-            pim = (
-                db.query(models.PeopleInMaintenance)
-                .filter_by(id_users=user.id, id_maintenance=maintenance.id, exit_time=None)
-                .first()
-            )
-            if not pim:
-                db.add(models.PeopleInMaintenance(
-                    id_users=user.id,
-                    id_maintenance=maintenance.id,
-                    entry_time=now
-                ))
-                print(f"   🔒 {user.name} {user.lastname} agregó su candado")
-        
-        # Cerrar entradas de quienes ya no aparecen
-        current_ids = {u.id for u in loto_users}
-        active_pims = (
-            db.query(models.PeopleInMaintenance)
-            .filter_by(id_maintenance=maintenance.id, exit_time=None)
-            .all()
-        )
-        for pim in active_pims:
-            if pim.id_users not in current_ids:
-                pim.exit_time = now
-                print(f"   🔓 Usuario {pim.id_users} retiró su candado")
+        with mqtt_stage_seconds.time("reconciliation"):
+            _reconcile_people_in_maintenance(db, maintenance, loto_users, diff, now, new_maintenance)
 
         # Si no queda ningún LOTO → cerrar mantenimiento
         if not loto_users:
             maintenance.end_time = now
             maintenance.status = "finished"
-            print(f"✅ Mantenimiento finalizado en bahía {bahia.id}")
+            log.info("mantenimiento_finalizado", bahia=bahia.id, maintenance=maintenance.id)
 
-        db.commit()
+        # Vista del dashboard: mantenimiento iniciado/finalizado y personas (tras el COMMIT)
+        view_args = (bahia.id, maintenance.id, maintenance.start_time, maintenance.end_time)
+        on_commit(db, lambda: bay_state_view.maintenance(*view_args))
 
     # 8) Revisar infractores (CARD sin su LOTO)
     violator_ids = card_user_ids - loto_user_ids
     violators = [u for u in card_users if u.id in violator_ids]
 
     if violators:
-        print(f"🚨 {len(violators)} violadores detectados")
-        _create_alerts_for_violators(db, violators, bahia, reason_type_alert_name="Ingreso sin candado")
+        log.info("violadores_detectados", bahia=bahia.id, violadores=len(violators))
+        with mqtt_stage_seconds.time("alerts"):
+            _create_alerts_for_violators(db, violators, bahia, maintenance, reason_type_alert_name="Ingreso sin candado")
 
         alerts = [
             StatusAlertItem(
@@ -310,33 +318,294 @@ def process_tags_payload(db: Session, payload: TagsPayload) -> Tuple[StatusPaylo
             alerts=alerts
         )
     else:
-        print("✅ Todos los trabajadores tienen LOTO válido")
         status = StatusPayload(
             module_loto_code=payload.module_loto_code,
             status="ok",
             message="Todos los trabajadores con candado validado."
         )
 
-    return status, topic_status(payload.module_loto_code)
+    return status, tags_info, maintenance
 
 
-def process_lwt_message(db: Session, module_code: str, status_text: str):
+def _publish_tags_info(module_code: str, tags_info: List[dict], now: datetime):
     """
-    Procesa LWT/estado del módulo (por ejemplo 'offline').
+    Publica la información de usuarios por tag en APP/LOTO_RFID/{module}/USERS,
+    sólo si cambió respecto a lo último publicado (el timestamp no cuenta).
     """
-    print(f"\n🔌 Procesando LWT/ONLINE → módulo={module_code}, status_text={status_text}")
-    bahia = (
-        db.query(models.Bahia)
-        .filter(models.Bahia.module_loto_code == module_code)
-        .first()
-    )
+    if not tags_info:
+        return  # sin tags detectados no hay nada que publicar
+    user_info_payload = {
+        "module_loto_code": module_code,
+        "timestamp": now.isoformat(),
+        "tags_info": tags_info
+    }
+
+    topic = topic_users(module_code)
+    try:
+        from .client import MqttService
+        if MqttService.instance:
+            if MqttService.instance.publish_if_changed(topic, user_info_payload, exclude=("timestamp",)):
+                log.debug("tags_info_publicado", topic=topic, tags=len(tags_info))
+        else:
+            log.warning("mqtt_service_no_inicializado", topic=topic)
+    except Exception as e:
+        log.warning("error_publicando_tags_info", topic=topic, error=str(e))
+
+
+def _active_maintenance_id(maintenance: models.Maintenance | None) -> int | None:
+    return maintenance.id if maintenance and maintenance.end_time is None else None
+
+
+def process_tags_payload(db: Session, payload: TagsPayload) -> Tuple[StatusPayload, str]:
+    """
+    Procesa un payload TAGS:
+    - Marca el módulo online en presence_tracker (sin BD).
+    - Si el snapshot CARD/LOTO es idéntico al último procesado → camino rápido sin BD.
+    - Gestiona mantenimiento según LOTOs detectados.
+    - Determina infractores (CARD sin LOTO).
+    - Publica STATUS con resultado.
+    Todos los cambios en BD se aplican en una única transacción (un flush + un COMMIT).
+    Retorna (status_payload, topic_de_publicacion). Con suscripción compartida lanza
+    StaleSnapshotError si otra réplica ya aplicó un TAGS más nuevo de la bahía.
+    """
+    # 0) Un TAGS implica módulo online; extraer tags y comparar con el último snapshot
+    if presence_tracker.observe(payload.module_loto_code, "online"):
+        bay_state_view.module_status(payload.module_loto_code, "online")
+    card_codes, loto_codes = _extract_codes(payload)
+    registry_version = tag_registry.version
+    diff = snapshot_store.diff(payload.module_loto_code, card_codes, loto_codes, registry_version)
+    if diff.unchanged:
+        log.debug("snapshot_sin_cambios", module=payload.module_loto_code)
+        return diff.previous.status, topic_status(payload.module_loto_code)
+
+    # 1) Ubicar la bahía
+    with mqtt_stage_seconds.time("bay_lookup"):
+        bahia = (
+            db.query(models.Bahia)
+            .filter(models.Bahia.module_loto_code == payload.module_loto_code)
+            .first()
+        )
     if not bahia:
-        return
+        status = _unknown_module_status(payload.module_loto_code)
+        snapshot_store.commit(payload.module_loto_code, card_codes, loto_codes, None, status, registry_version)
+        return status, topic_status(payload.module_loto_code)
+
+    now = datetime.now(timezone.utc)
 
-    status_map = {"offline": "offline", "online": "online", "error": "error"}
-    bahia.module_loto_status = status_map.get(status_text.lower(), "offline")
-    db.commit()
-    print(f"   ✅ Estado de bahía {bahia.id} actualizado a {bahia.module_loto_status}")
+    with unit_of_work(db):
+        # 5) Buscar mantenimiento activo (con la bahía bloqueada: buscar y crear es atómico)
+        _lock_bays(db, [bahia.id])
+        if MQTT_SHARED_GROUP:
+            _load_watermarks(db, [bahia])
+            if not _advance_watermark(bahia, payload, now):
+                snapshot_store.invalidate(payload.module_loto_code)
+                raise StaleSnapshotError(payload.module_loto_code)
+        maintenance = (
+            db.query(models.Maintenance)
+            .filter(models.Maintenance.id_bahias == bahia.id, models.Maintenance.end_time.is_(None))
+            .first()
+        )
+        status, tags_info, maintenance = _apply_tags(
+            db, payload, bahia, maintenance, card_codes, loto_codes, diff, now
+        )
+
+    # Publicar información de usuarios por tag (después del COMMIT)
+    _publish_tags_info(payload.module_loto_code, tags_info, now)
+
+    snapshot_store.commit(
+        payload.module_loto_code, card_codes, loto_codes,
+        _active_maintenance_id(maintenance), status, registry_version,
+    )
+    return status, topic_status(payload.module_loto_code)
+
+
+def _process_isolated(db: Session, payload: TagsPayload) -> Tuple[StatusPayload, str] | Exception:
+    """process_tags_payload de un payload del lote; si falla retorna la excepción (el resto sigue)."""
+    try:
+        return process_tags_payload(db, payload)
+    except StaleSnapshotError as e:
+        return e
+    except Exception as e:
+        db.rollback()
+        log.warning("tags_fallido_en_lote", module=payload.module_loto_code, error=str(e))
+        return e
+
+
+def process_tags_batch(db: Session, payloads: List[TagsPayload]) -> List[Tuple[StatusPayload, str] | Exception]:
+    """
+    Procesa un lote de payloads TAGS (de uno o varios módulos) de una sola vez:
+    - Resuelve todos los tags, bahías y mantenimientos activos con una consulta cada uno.
+    - Aplica los cambios de cada módulo en orden de llegada dentro de una única transacción.
+    Retorna un (status_payload, topic) por payload, en el mismo orden, para publicar
+    el STATUS de cada módulo. Si la transacción del lote falla, se reprocesa cada
+    payload por separado con process_tags_payload: el que vuelva a fallar ocupa su
+    lugar con la excepción, sin afectar a los demás. Un TAGS atrasado respecto de su
+    bahía (suscripción compartida) ocupa su lugar con StaleSnapshotError.
+    """
+    log.debug("lote_tags", mensajes=len(payloads))
+    registry_version = tag_registry.version
+    results: List[Tuple[StatusPayload, str] | Exception | None] = [None] * len(payloads)
+    pending: Dict[str, Snapshot] = {}  # snapshots del lote, se guardan tras el COMMIT
+
+    codes = [_extract_codes(p) for p in payloads]
+    modules = {p.module_loto_code for p in payloads}
+    for module in modules:
+        if presence_tracker.observe(module, "online"):
+            bay_state_view.module_status(module, "online")
+
+    # 1) Prefetch: tags, bahías y mantenimientos activos (una consulta cada uno)
+    tag_registry.lookup(db, [c for cards, lotos in codes for c in cards + lotos])
+    with mqtt_stage_seconds.time("bay_lookup"):
+        bahias = {
+            b.module_loto_code: b
+            for b in db.query(models.Bahia).filter(models.Bahia.module_loto_code.in_(modules)).all()
+        }
+    maintenances: Dict[int, models.Maintenance] = {}
+    if bahias:
+        # Los locks se toman antes de leer los mantenimientos y duran hasta el COMMIT del lote
+        _lock_bays(db, [b.id for b in bahias.values()])
+        for m in (
+            db.query(models.Maintenance)
+            .filter(
+                models.Maintenance.id_bahias.in_([b.id for b in bahias.values()]),
+                models.Maintenance.end_time.is_(None),
+            )
+            .order_by(models.Maintenance.id)
+            .all()
+        ):
+            maintenances.setdefault(m.id_bahias, m)
+        if MQTT_SHARED_GROUP:
+            _load_watermarks(db, bahias.values())
+
+    now = datetime.now(timezone.utc)
+    to_publish: List[Tuple[str, List[dict]]] = []
+    stale_modules = set()
+
+    try:
+        with unit_of_work(db):
+            for i, payload in enumerate(payloads):
+                module = payload.module_loto_code
+                card_codes, loto_codes = codes[i]
+                diff = snapshot_store.diff(module, card_codes, loto_codes, registry_version, pending.get(module))
+                if diff.unchanged:
+                    results[i] = (diff.previous.status, topic_status(module))
+                    continue
+
+                bahia = bahias.get(module)
+                if not bahia:
+                    status = _unknown_module_status(module)
+                    maintenance = None
+                elif MQTT_SHARED_GROUP and not _advance_watermark(bahia, payload, now):
+                    results[i] = StaleSnapshotError(module)
+                    stale_modules.add(module)
+                    continue
+                else:
+                    status, tags_info, maintenance = _apply_tags(
+                        db, payload, bahia, maintenances.get(bahia.id), card_codes, loto_codes, diff, now
+                    )
+                    if maintenance is not None and maintenance.end_time is None:
+                        maintenances[bahia.id] = maintenance
+                    else:
+                        maintenances.pop(bahia.id, None)
+                    to_publish.append((module, tags_info))
+
+                pending[module] = SnapshotStore.build(
+                    card_codes, loto_codes, _active_maintenance_id(maintenance), status, registry_version
+                )
+                results[i] = (status, topic_status(module))
+    except Exception as e:
+        log.warning("lote_tags_fallido", mensajes=len(payloads), error=str(e))
+        for module in modules:
+            snapshot_store.invalidate(module)
+        return [_process_isolated(db, p) for p in payloads]
+
+    # Después del COMMIT: snapshots y publicaciones USERS
+    for module, snap in pending.items():
+        snapshot_store.put(module, snap)
+    for module in stale_modules - pending.keys():
+        snapshot_store.invalidate(module)
+    for module, tags_info in to_publish:
+        _publish_tags_info(module, tags_info, now)
+
+    return results
+
+
+def _reconcile_people_in_maintenance(
+    db: Session,
+    maintenance: models.Maintenance,
+    loto_users: List[UserRef],
+    diff: SnapshotDiff,
+    now: datetime,
+    new_maintenance: bool = False,
+):
+    """
+    Sincroniza PeopleInMaintenance con los LOTO detectados mediante operaciones de conjunto:
+    1 SELECT de filas activas → diff en memoria → INSERT masivo de entradas
+    + 1 UPDATE masivo de exit_time. El número de sentencias no depende del tamaño de la cuadrilla.
+    Si el snapshot previo corresponde al mismo mantenimiento, sólo se consideran
+    los códigos LOTO agregados/retirados; si no, reconciliación completa.
+    """
+    current_ids = {u.id for u in loto_users}
+    incremental = diff.previous is not None and diff.previous.maintenance_id == maintenance.id
+
+    if incremental:
+        if not diff.loto_changed:
+            return
+        candidate_ids = (
+            {u.id for u in _get_users_by_tags(db, list(diff.added_loto), "LOTO")}
+            | {u.id for u in _get_users_by_tags(db, list(diff.removed_loto), "LOTO")}
+        )
+    else:
+        candidate_ids = None  # todos los activos del mantenimiento
+
+    # 1) Filas activas (un mantenimiento recién creado no tiene ninguna)
+    active: Dict[int, int] = {}  # id_users → pim.id
+    if not new_maintenance and (candidate_ids is None or candidate_ids):
+        query = db.query(models.PeopleInMaintenance.id, models.PeopleInMaintenance.id_users).filter(
+            models.PeopleInMaintenance.id_maintenance == maintenance.id,
+            models.PeopleInMaintenance.exit_time.is_(None),
+        )
+        if candidate_ids is not None:
+            query = query.filter(models.PeopleInMaintenance.id_users.in_(candidate_ids))
+        active = {id_users: pim_id for pim_id, id_users in query.all()}
+
+    # 2) Diff en memoria
+    scope = current_ids if candidate_ids is None else current_ids & candidate_ids
+    to_insert = [u for u in loto_users if u.id in scope and u.id not in active]
+    to_close = [pim_id for id_users, pim_id in active.items() if id_users not in current_ids]
+
+    # 3) INSERT masivo de entradas
+    if to_insert:
+        db.execute(
+            insert(models.PeopleInMaintenance),
+            [{"id_users": u.id, "id_maintenance": maintenance.id, "entry_time": now} for u in to_insert],
+        )
+        log.info("candados_agregados", maintenance=maintenance.id, user_ids=[u.id for u in to_insert])
+
+    # 4) UPDATE masivo de salidas
+    if to_close:
+        db.execute(
+            update(models.PeopleInMaintenance)
+            .where(models.PeopleInMaintenance.id.in_(to_close))
+            .values(exit_time=now)
+            .execution_options(synchronize_session=False)
+        )
+        log.info("candados_retirados", maintenance=maintenance.id, cantidad=len(to_close))
+
+
+def process_lwt_message(module_code: str, status_text: str) -> bool:
+    """
+    Procesa LWT/estado del módulo (por ejemplo 'offline') sin tocar la BD:
+    presence_tracker registra la transición y la vuelca a bahias en su próximo lote.
+    Retorna True si el estado del módulo cambió.
+    """
+    new_status = normalize_status(status_text)
+    if not presence_tracker.observe(module_code, new_status):
+        return False
+    bay_state_view.module_status(module_code, new_status)
+    # Tras una transición el próximo TAGS se reprocesa completo
+    snapshot_store.invalidate(module_code)
+    return True
 
 
 def _generate_maintenance_name() -> str:
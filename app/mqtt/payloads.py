@@ -1,6 +1,13 @@
 # app/mqtt/payloads.py
-from pydantic import BaseModel, Field
-from typing import List, Dict, Literal, Optional
+import json
+from datetime import datetime, timezone
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, List, Dict, Literal, Optional
+
+try:  # JSON más rápido si está instalado (opcional)
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 class TagRead(BaseModel):
     tag_code: str = Field(..., min_length=1)
@@ -25,3 +32,34 @@ class StatusPayload(BaseModel):
 class LwtPayload(BaseModel):
     module_loto_code: str
     status: Literal["online", "offline", "error"]
+
+
+# ----------- decodificación rápida -----------
+def decode_tags_payload(raw: bytes) -> TagsPayload:
+    """
+    Valida los bytes crudos de msg.payload directamente en TagsPayload/TagRead
+    con el parser JSON de pydantic v2 (sin str ni dict intermedios).
+    """
+    try:
+        return TagsPayload.model_validate_json(raw)
+    except ValidationError as e:
+        if e.errors()[0]["type"] != "json_invalid":
+            raise
+        # Compatibilidad con la ruta anterior: se ignoraban bytes no UTF-8
+        return TagsPayload.model_validate_json(raw.decode("utf-8", errors="ignore").strip())
+
+
+def parse_timestamp(ts: str) -> Optional[datetime]:
+    """Timestamp ISO 8601 de un lector ("2025-09-07T12:34:56Z"); sin zona se asume UTC. None si es inválido."""
+    try:
+        value = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def decode_json(raw: bytes) -> Any:
+    """json.loads sobre bytes, usando orjson cuando está disponible."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
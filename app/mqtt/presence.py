@@ -0,0 +1,247 @@
+# app/mqtt/presence.py
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.logger import get_logger
+from .config import PRESENCE_FLUSH_INTERVAL_SECONDS, SNAPSHOT_MAX_GAP_SECONDS
+
+log = get_logger(__name__)
+
+STATUS_MAP = {"offline": "offline", "online": "online", "error": "error"}
+
+
+def normalize_status(status_text: str) -> str:
+    """Mapea el texto de LWT/ONLINE a un estado de bahía; lo desconocido cuenta como offline."""
+    return STATUS_MAP.get((status_text or "").strip().lower(), "offline")
+
+
+class _Presence:
+    __slots__ = ("status", "persisted", "since", "seen")
+
+    def __init__(self, status: str, persisted: Optional[str], since: datetime):
+        self.status = status        # estado actual (memoria)
+        self.persisted = persisted  # último estado escrito en bahias.module_loto_status
+        self.since = since          # momento de la última transición
+        self.seen = 0.0             # monotonic del último mensaje visto por esta réplica
+
+
+class PresenceTracker:
+    """
+    Presencia de módulos (online/offline/error) por module_loto_code, con escritura diferida.
+    - observe() registra la transición al instante en memoria, sin tocar la BD.
+    - Un hilo vuelca cada PRESENCE_FLUSH_INTERVAL_SECONDS sólo los módulos cuyo estado
+      difiere de lo persistido, con un UPDATE por estado distinto (a lo sumo tres).
+      Un offline → online entre dos volcados no escribe nada.
+    - Los endpoints HTTP leen el estado actual desde aquí (status/snapshot).
+    - max_gap (suscripción compartida): si esta réplica no vio el módulo en max_gap
+      segundos, otra pudo cambiar la columna; el estado persistido se da por
+      desconocido y el próximo mensaje se vuelve a escribir aunque no cambie.
+    - on_flush(db, por_estado) se llama antes del COMMIT de cada volcado (avisos a otras
+      réplicas, ver cache_sync); adopt() aplica lo que volcó otra réplica.
+    """
+
+    def __init__(self, flush_interval: float = PRESENCE_FLUSH_INTERVAL_SECONDS, max_gap: float = SNAPSHOT_MAX_GAP_SECONDS):
+        self.flush_interval = flush_interval
+        self.max_gap = max_gap
+        self._entries: Dict[str, _Presence] = {}
+        self._dirty: set = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._session_factory: Optional[Callable[[], Session]] = None
+        self.on_flush: Optional[Callable[[Session, Dict[str, List[str]]], None]] = None
+        self.transitions = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_errors = 0
+
+    # ----------- carga desde BD -----------
+    def load(self, db: Session) -> int:
+        """Carga el estado persistido de todas las bahías con módulo asignado."""
+        rows = (
+            db.query(models.Bahia.module_loto_code, models.Bahia.module_loto_status)
+            .filter(models.Bahia.module_loto_code.isnot(None))
+            .all()
+        )
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self._entries = {code: _Presence(status, status, now) for code, status in rows}
+            self._dirty.clear()
+        log.info("presencia_cargada", modulos=len(rows))
+        return len(rows)
+
+    # ----------- transiciones -----------
+    def observe(self, module_code: str, status: str) -> bool:
+        """Registra el estado del módulo. Retorna True si hubo transición."""
+        if not module_code:
+            return False
+        seen = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(module_code)
+            if entry is not None:
+                if self.max_gap > 0 and seen - entry.seen > self.max_gap:
+                    entry.persisted = None
+                    if entry.status == status:
+                        self._dirty.add(module_code)
+                entry.seen = seen
+                if entry.status == status:
+                    return False
+            now = datetime.now(timezone.utc)
+            if entry is None:
+                # Módulo no cargado (p. ej. bahía creada después del arranque)
+                entry = _Presence(status, None, now)
+                entry.seen = seen
+                self._entries[module_code] = entry
+            else:
+                entry.status = status
+                entry.since = now
+            if entry.status != entry.persisted:
+                self._dirty.add(module_code)
+            else:
+                self._dirty.discard(module_code)
+            self.transitions += 1
+        log.info("presencia_modulo", module=module_code, status=status)
+        return True
+
+    def adopt(self, module_code: str, status: str) -> bool:
+        """
+        Adopta un estado que otra réplica ya escribió en bahias: queda como actual y
+        persistido, sin volver a escribirlo. Retorna True si cambió el estado en memoria.
+        """
+        if not module_code:
+            return False
+        with self._lock:
+            entry = self._entries.get(module_code)
+            if entry is not None and entry.status == status:
+                entry.persisted = status
+                self._dirty.discard(module_code)
+                return False
+            now = datetime.now(timezone.utc)
+            if entry is None:
+                self._entries[module_code] = _Presence(status, status, now)
+            else:
+                entry.status = status
+                entry.persisted = status
+                entry.since = now
+                self._dirty.discard(module_code)
+            self.transitions += 1
+        return True
+
+    def status(self, module_code: str, default: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(module_code)
+            return entry.status if entry is not None else default
+
+    def online_modules(self) -> List[str]:
+        with self._lock:
+            return [code for code, e in self._entries.items() if e.status == "online"]
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {
+                code: {"status": e.status, "since": e.since.isoformat()}
+                for code, e in self._entries.items()
+            }
+
+    # ----------- volcado a BD -----------
+    def flush(self, db: Session) -> int:
+        """Escribe los estados pendientes en bahias. Retorna las filas actualizadas."""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            by_status: Dict[str, List[str]] = {}
+            for code in self._dirty:
+                by_status.setdefault(self._entries[code].status, []).append(code)
+            self._dirty.clear()
+
+        try:
+            written = 0
+            for status, codes in by_status.items():
+                result = db.execute(
+                    update(models.Bahia)
+                    .where(models.Bahia.module_loto_code.in_(codes))
+                    .values(module_loto_status=status)
+                    .execution_options(synchronize_session=False)
+                )
+                written += result.rowcount or 0
+            if self.on_flush is not None:
+                self.on_flush(db, by_status)
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                # Se reintenta en el próximo volcado (salvo lo que ya volvió a lo persistido)
+                for codes in by_status.values():
+                    for code in codes:
+                        entry = self._entries[code]
+                        if entry.status != entry.persisted:
+                            self._dirty.add(code)
+                self.flush_errors += 1
+            raise
+
+        with self._lock:
+            for status, codes in by_status.items():
+                for code in codes:
+                    entry = self._entries[code]
+                    entry.persisted = status
+                    # Cambió otra vez durante el UPDATE: queda para el próximo volcado
+                    if entry.status != status:
+                        self._dirty.add(code)
+            self.flushes += 1
+            self.rows_written += written
+        log.debug("presencia_volcada", filas=written, estados={s: len(c) for s, c in by_status.items()})
+        return written
+
+    def _flush_once(self):
+        db = self._session_factory()
+        try:
+            self.flush(db)
+        except Exception as e:
+            log.warning("error_volcando_presencia", error=str(e))
+        finally:
+            db.close()
+
+    # ----------- ciclo de vida -----------
+    def start(self, session_factory: Callable[[], Session]):
+        if self._thread is not None:
+            return
+        self._session_factory = session_factory
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="presence-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Detiene el hilo y hace un último volcado."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        self._thread = None
+        self._flush_once()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush_once()
+
+    def stats(self) -> dict:
+        with self._lock:
+            online = sum(1 for e in self._entries.values() if e.status == "online")
+            return {
+                "modules": len(self._entries),
+                "online": online,
+                "pending": len(self._dirty),
+                "transitions": self.transitions,
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+                "flush_errors": self.flush_errors,
+            }
+
+
+# Instancia global del proceso
+presence_tracker = PresenceTracker()
@@ -0,0 +1,273 @@
+# app/mqtt/publisher.py
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+
+from app.logger import get_logger
+from app.metrics import mqtt_publish_ack_seconds, mqtt_publish_failures, mqtt_publish_superseded, mqtt_publishes
+from .config import MQTT_PUBLISH_DEDUP_MAX_TOPICS
+from .topics import topic_suffix
+
+log = get_logger(__name__)
+
+
+def payload_digest(obj: dict, exclude: Iterable[str] = ()) -> bytes:
+    """
+    Huella del contenido de un payload JSON: blake2b de 16 bytes sobre la forma
+    canónica (claves ordenadas), sin los campos de primer nivel en `exclude`
+    (p. ej. el timestamp de USERS, que cambia en cada envío).
+    """
+    if exclude:
+        obj = {k: v for k, v in obj.items() if k not in exclude}
+    canonical = json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
+
+class PublishDeduplicator:
+    """
+    Última huella publicada por tópico, para publicar sólo cambios reales.
+    - LRU acotada por max_topics (0 = sin límite) y protegida con lock.
+    - Si un tópico se expulsa, su próximo mensaje se publica (nunca se pierde un cambio).
+    """
+
+    def __init__(self, max_topics: int = 0):
+        self.max_topics = max_topics
+        self._digests: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.suppressed = 0
+
+    def should_publish(self, topic: str, digest: bytes) -> bool:
+        """True si el contenido cambió (y lo registra como el último publicado)."""
+        with self._lock:
+            if self._digests.get(topic) == digest:
+                self._digests.move_to_end(topic)
+                self.suppressed += 1
+                return False
+            self._digests[topic] = digest
+            self._digests.move_to_end(topic)
+            if self.max_topics and len(self._digests) > self.max_topics:
+                self._digests.popitem(last=False)
+            self.published += 1
+            return True
+
+    def forget(self, topic: str):
+        """Olvida la huella: el próximo mensaje del tópico se publica aunque no cambie."""
+        with self._lock:
+            self._digests.pop(topic, None)
+
+    def clear(self):
+        with self._lock:
+            self._digests.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "topics": len(self._digests),
+                "max_topics": self.max_topics,
+                "published": self.published,
+                "suppressed": self.suppressed,
+            }
+
+
+class PublishQueue:
+    """
+    Publicación saliente desacoplada de la ingesta: quien publica sólo encola y un
+    hilo propio entrega al transporte.
+    - Cola acotada (max_pending) con un único mensaje pendiente por tópico: si el tópico
+      ya estaba en cola, el mensaje nuevo reemplaza al anterior (STATUS/USERS son estado,
+      el viejo quedó obsoleto). Si la cola está llena de tópicos distintos el mensaje se
+      descarta al instante: quien encola (ingesta, event loop) nunca espera al broker.
+    - Ventana de mensajes en vuelo (max_inflight): publicados y aún sin on_publish
+      (PUBACK en QoS 1). Con la ventana llena el hilo espera; la cola absorbe la espera.
+    - on_publish cierra cada mensaje en vuelo y mide la latencia de confirmación; lo que
+      no se confirma en ack_timeout, o que el transporte rechaza, cuenta como fallo.
+    on_failure(topic) se llama por cada mensaje descartado o fallido (p. ej. para olvidar
+    su huella en PublishDeduplicator y que el próximo mensaje se vuelva a publicar).
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[str, Any, int, bool], Any],
+        max_pending: int,
+        max_inflight: int,
+        ack_timeout: float = 30.0,
+        on_failure: Optional[Callable[[str], None]] = None,
+        name: str = "mqtt-publisher",
+    ):
+        self._publish = publish
+        self.max_pending = max(1, max_pending)
+        self.max_inflight = max(1, max_inflight)
+        self.ack_timeout = ack_timeout
+        self.on_failure = on_failure
+        self.name = name
+        # topic → (payload, qos, retain, encolado_en)
+        self._pending: "OrderedDict[str, Tuple[Any, int, bool, float]]" = OrderedDict()
+        # mid → (topic, publicado_en)
+        self._inflight: Dict[int, Tuple[str, float]] = {}
+        # on_publish que llegó antes de registrar el mid (el PUBACK puede ganarle al registro):
+        # mid → recibido_en. Un PUBACK tardío (tras ack_timeout) también cae aquí; se poda
+        self._early_acks: Dict[int, float] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self.enqueued = 0
+        self.superseded = 0
+        self.dropped = 0
+        self.sent = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+
+    # ----------- ciclo de vida -----------
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        """Intenta entregar lo pendiente durante `timeout` segundos y detiene el hilo."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending and self._running and time.monotonic() < deadline:
+                self._cond.wait(0.05)
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=max(0.0, deadline - time.monotonic()) + 0.5)
+            self._thread = None
+
+    # ----------- encolado -----------
+    def enqueue(self, topic: str, payload: Any, qos: int = 0, retain: bool = False) -> bool:
+        """No bloquea nunca. Retorna False si se descartó (cola llena)."""
+        now = time.perf_counter()
+        with self._cond:
+            if topic in self._pending:
+                # Coalescencia: el pendiente anterior del tópico queda obsoleto
+                self._pending[topic] = (payload, qos, retain, self._pending[topic][3])
+                self.superseded += 1
+                mqtt_publish_superseded.inc(topic_suffix(topic))
+                return True
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                log.warning("cola_publicacion_llena", topic=topic, pendientes=len(self._pending))
+                mqtt_publish_failures.inc(topic_suffix(topic), "dropped")
+                self._notify_failure(topic)
+                return False
+            self._pending[topic] = (payload, qos, retain, now)
+            self.enqueued += 1
+            self._cond.notify_all()
+            return True
+
+    # ----------- confirmaciones -----------
+    def on_publish(self, client, userdata, mid):
+        """Callback on_publish del transporte (hilo de red)."""
+        with self._cond:
+            entry = self._inflight.pop(mid, None)
+            if entry is None:
+                self._early_acks[mid] = time.perf_counter()
+                self._cond.notify_all()  # el hilo de envío lo poda si nadie lo reclama
+                return
+            self.completed += 1
+            self._cond.notify_all()
+        mqtt_publish_ack_seconds.observe(time.perf_counter() - entry[1])
+
+    # ----------- envío -----------
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    self._expire_inflight()
+                    if self._pending and len(self._inflight) < self.max_inflight:
+                        break
+                    self._cond.wait(1.0 if self._inflight or self._early_acks else None)
+                if not self._running:
+                    return
+                topic, (payload, qos, retain, _) = self._pending.popitem(last=False)
+                self._cond.notify_all()  # stop() espera a que se vacíe la cola
+            self._send(topic, payload, qos, retain)
+
+    def _send(self, topic: str, payload: Any, qos: int, retain: bool):
+        # Fuera del lock: paho llama a on_publish con su propio mutex tomado
+        sent_at = time.perf_counter()
+        try:
+            info = self._publish(topic, payload, qos, retain)
+            rc = getattr(info, "rc", mqtt.MQTT_ERR_SUCCESS)
+        except Exception as e:
+            log.warning("error_publicando", topic=topic, error=str(e))
+            rc = None
+        # Sin conexión paho conserva los mensajes QoS > 0 y los envía al reconectar
+        accepted = rc == mqtt.MQTT_ERR_SUCCESS or (rc == mqtt.MQTT_ERR_NO_CONN and qos > 0)
+        if not accepted:
+            with self._cond:
+                self.failed += 1
+            log.warning("publicacion_rechazada", topic=topic, rc=rc)
+            mqtt_publish_failures.inc(topic_suffix(topic), "rejected")
+            self._notify_failure(topic)
+            return
+        mqtt_publishes.inc(topic_suffix(topic))
+        mid = getattr(info, "mid", None)
+        with self._cond:
+            self.sent += 1
+            acked_at = self._early_acks.pop(mid, None) if mid is not None else None
+            if mid is None or (acked_at is not None and acked_at >= sent_at):
+                self.completed += 1
+            else:
+                # Un PUBACK anterior al envío era de un uso previo del mid (paho los recicla)
+                self._inflight[mid] = (topic, sent_at)
+
+    def _expire_inflight(self):
+        """
+        Con el lock tomado: da por fallidos los mensajes sin confirmar tras ack_timeout y
+        olvida los PUBACK sin mensaje de más de ack_timeout (tardíos de uno ya vencido).
+        """
+        limit = time.perf_counter() - self.ack_timeout
+        if self._early_acks:
+            for mid in [mid for mid, acked_at in self._early_acks.items() if acked_at < limit]:
+                del self._early_acks[mid]
+        if not self._inflight:
+            return
+        expired = [(mid, topic) for mid, (topic, sent_at) in self._inflight.items() if sent_at < limit]
+        for mid, topic in expired:
+            del self._inflight[mid]
+            self.timeouts += 1
+            log.warning("publicacion_sin_confirmar", topic=topic, mid=mid)
+            mqtt_publish_failures.inc(topic_suffix(topic), "timeout")
+            self._notify_failure(topic)
+
+    def _notify_failure(self, topic: str):
+        if self.on_failure is not None:
+            try:
+                self.on_failure(topic)
+            except Exception as e:
+                log.warning("error_callback_publicacion", topic=topic, error=str(e))
+
+    # ----------- métricas -----------
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "max_pending": self.max_pending,
+                "inflight": len(self._inflight),
+                "max_inflight": self.max_inflight,
+                "unmatched_acks": len(self._early_acks),
+                "enqueued": self.enqueued,
+                "superseded": self.superseded,
+                "dropped": self.dropped,
+                "sent": self.sent,
+                "completed": self.completed,
+                "failed": self.failed,
+                "timeouts": self.timeouts,
+            }
+
+
+# Instancia global del proceso
+publish_dedup = PublishDeduplicator(max_topics=MQTT_PUBLISH_DEDUP_MAX_TOPICS)
@@ -0,0 +1,155 @@
+# app/mqtt/registry.py
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from app import models
+from app.logger import get_logger
+from .config import TAG_REGISTRY_MAX_SIZE
+
+log = get_logger(__name__)
+
+
+class TagInfo(NamedTuple):
+    tag_code: str
+    user_id: int
+    name: str
+    lastname: str
+    type_name: str
+
+
+class UserRef(NamedTuple):
+    """Datos mínimos de un usuario resueltos desde el registro (sustituye a models.User)."""
+    id: int
+    name: str
+    lastname: str
+
+
+class TagRegistry:
+    """
+    Caché de proceso tag_code → (usuario, tipo de tag).
+    - Se carga completa al iniciar (load) y se completa bajo demanda en los fallos.
+    - Los códigos no registrados se guardan como None (caché negativa).
+    - LRU acotada por max_size (0 = sin límite).
+    - Los routers de tags/users/type_tags la invalidan al escribir; cada cambio
+      incrementa `version` para que otros cachés dependientes puedan descartarse.
+    """
+
+    def __init__(self, max_size: int = 0):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Optional[TagInfo]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ----------- carga desde BD -----------
+    @staticmethod
+    def _query(db: Session, tag_codes: Optional[List[str]] = None):
+        query = (
+            db.query(
+                models.Tag.tag_code,
+                models.User.id,
+                models.User.name,
+                models.User.lastname,
+                models.TypeTag.name,
+            )
+            .join(models.TypeTag, models.TypeTag.id == models.Tag.id_type_tag)
+            .join(models.User, models.User.id == models.Tag.id_users)
+        )
+        if tag_codes is not None:
+            query = query.filter(models.Tag.tag_code.in_(tag_codes))
+        return [TagInfo(*row) for row in query.all()]
+
+    def load(self, db: Session) -> int:
+        rows = self._query(db)
+        with self._lock:
+            self._entries.clear()
+            for info in rows:
+                self._store(info.tag_code, info)
+            self.version += 1
+            size = len(self._entries)
+        log.info("registro_tags_cargado", tags=size)
+        return size
+
+    # ----------- consultas -----------
+    def lookup(self, db: Session, tag_codes: Iterable[str]) -> Dict[str, Optional[TagInfo]]:
+        """Resuelve cada código; los fallos se consultan a la BD en una sola query."""
+        result: Dict[str, Optional[TagInfo]] = {}
+        missing: List[str] = []
+        with self._lock:
+            for code in tag_codes:
+                if code in result:
+                    continue
+                if code in self._entries:
+                    self._entries.move_to_end(code)
+                    result[code] = self._entries[code]
+                    self.hits += 1
+                else:
+                    # Marcado ya, así un código repetido en el payload se consulta una vez
+                    result[code] = None
+                    missing.append(code)
+                    self.misses += 1
+            version = self.version
+
+        if missing:
+            found = {info.tag_code: info for info in self._query(db, missing)}
+            with self._lock:
+                # Si hubo una invalidación mientras consultábamos, no cachear datos viejos
+                cache = version == self.version
+                for code in missing:
+                    info = found.get(code)
+                    result[code] = info
+                    if cache:
+                        self._store(code, info)
+        return result
+
+    def _store(self, code: str, info: Optional[TagInfo]):
+        self._entries[code] = info
+        self._entries.move_to_end(code)
+        if self.max_size and len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # ----------- invalidación -----------
+    def put(self, info: TagInfo):
+        with self._lock:
+            self._store(info.tag_code, info)
+            self.version += 1
+
+    def invalidate(self, tag_code: str):
+        with self._lock:
+            self._entries.pop(tag_code, None)
+            self.version += 1
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            codes = [c for c, info in self._entries.items() if info and info.user_id == user_id]
+            for code in codes:
+                del self._entries[code]
+            self.version += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.version += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "version": self.version,
+            }
+
+
+# Instancia global del proceso
+tag_registry = TagRegistry(max_size=TAG_REGISTRY_MAX_SIZE)
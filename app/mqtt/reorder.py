@@ -0,0 +1,383 @@
+# app/mqtt/reorder.py
+import heapq
+import itertools
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Callable, Deque, Dict, FrozenSet, List, Optional, Tuple
+
+from app.logger import get_logger
+from app.metrics import mqtt_stale_snapshots
+from .config import MQTT_REORDER_MAX_IDLE_SECONDS, MQTT_REORDER_MAX_REGRESSION_SECONDS
+from .payloads import parse_timestamp
+
+log = get_logger(__name__)
+
+# Orden de un snapshot: (timestamp efectivo, secuencia de llegada)
+_Key = Tuple[datetime, int]
+# Lecturas de un snapshot: (tag_code, timestamp del lector)
+Reads = FrozenSet[Tuple[bytes, datetime]]
+_EPOCH = datetime.min.replace(tzinfo=timezone.utc)
+
+# Cada TagRead es un objeto JSON sin objetos anidados: basta un escaneo de bytes.
+# Camino rápido para el orden habitual de los campos; si no, se busca campo por campo
+_READ_FAST_RE = re.compile(rb'"tag_code"\s*:\s*"([^"\\]*)"\s*,\s*"timestamp"\s*:\s*"([^"]*)"')
+_READ_RE = re.compile(rb"\{[^{}]*\}")
+_TAG_CODE_RE = re.compile(rb'"tag_code"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_TIMESTAMP_RE = re.compile(rb'"timestamp"\s*:\s*"([^"]*)"')
+
+
+@lru_cache(maxsize=65536)
+def _parse_ts(raw: bytes) -> Optional[datetime]:
+    # Un lector repite el mismo timestamp de "primera vista" en cada snapshot
+    return parse_timestamp(raw.decode("ascii", errors="replace"))
+
+
+def snapshot_reads(payload_bytes: bytes) -> Optional[Reads]:
+    """
+    Lecturas (tag_code, timestamp) de un TAGS crudo, sin decodificar el JSON: corre en
+    el hilo de red y la validación completa queda para el worker. Las lecturas sin
+    timestamp válido se ignoran; None si el payload no trae "tags" (se ordena por llegada).
+    """
+    if b'"tags"' not in payload_bytes:
+        return None
+    pairs = _READ_FAST_RE.findall(payload_bytes)
+    if len(pairs) != payload_bytes.count(b'"tag_code"'):
+        pairs = []
+        for match in _READ_RE.finditer(payload_bytes):
+            code = _TAG_CODE_RE.search(match.group())
+            stamp = _TIMESTAMP_RE.search(match.group())
+            if code and stamp:
+                pairs.append((code.group(1), stamp.group(1)))
+    reads = frozenset((code, _parse_ts(raw)) for code, raw in pairs)
+    if any(ts is None for _, ts in reads):
+        reads = frozenset(read for read in reads if read[1] is not None)
+    return reads
+
+
+def _newest(reads: Reads) -> Optional[datetime]:
+    return max((ts for _, ts in reads), default=None)
+
+
+def predates(reads: Reads, ref_reads: Reads, ref_time: Optional[datetime], max_regression: float = 0) -> bool:
+    """
+    True si el snapshot `reads` es anterior al de referencia, tomado no antes de ref_time.
+    Los timestamps son de "primera vista": una lectura ausente de la referencia pero vista
+    antes de ref_time ya se había retirado cuando se tomó la referencia. Un subconjunto
+    (alguien se retiró) no es anterior, aunque su timestamp más nuevo baje. Lecturas más
+    de max_regression segundos anteriores a ref_time se toman como reloj reiniciado.
+    """
+    if ref_time is None or ref_time == _EPOCH:
+        return False  # la referencia no tenía lecturas con timestamp
+    floor = ref_time - timedelta(seconds=max_regression) if max_regression > 0 else None
+    return any(ts <= ref_time and (floor is None or ts >= floor) for _, ts in reads - ref_reads)
+
+
+def payload_reads(payload) -> Reads:
+    """Lecturas (tag_code, timestamp) de un TagsPayload ya validado, como snapshot_reads."""
+    return frozenset(
+        (read.tag_code.encode(), ts)
+        for reads in payload.tags.values()
+        for read in reads
+        if (ts := _parse_ts(read.timestamp.encode())) is not None
+    )
+
+
+def advance(
+    reads: Reads,
+    ref: Optional[Tuple[Reads, datetime]],
+    max_regression: float = MQTT_REORDER_MAX_REGRESSION_SECONDS,
+) -> Optional[Tuple[Reads, datetime]]:
+    """
+    Referencia (lecturas, ts efectivo) tras aplicar `reads` sobre `ref`, con las mismas
+    reglas que ReorderBuffer; None si `reads` es anterior a ref y no debe aplicarse.
+    """
+    if ref is None:
+        return reads, _newest(reads) or _EPOCH
+    ref_reads, ref_time = ref
+    if predates(reads, ref_reads, ref_time, max_regression):
+        return None
+    newest = _newest(reads)
+    if newest is None:
+        return reads, ref_time  # sin lecturas (todos se retiraron): la referencia no retrocede
+    if max_regression > 0 and ref_time - newest > timedelta(seconds=max_regression):
+        return reads, newest  # reloj reiniciado
+    return reads, max(newest, ref_time)
+
+
+def dump_watermark(reads: Reads, effective: datetime, now: datetime) -> dict:
+    """Forma persistida (bahias.last_reads) de la referencia de orden de un módulo."""
+    return {
+        "at": effective.isoformat(),
+        "seen": now.isoformat(),
+        "reads": sorted([code.decode(errors="replace"), ts.isoformat()] for code, ts in reads),
+    }
+
+
+def load_watermark(
+    data: Optional[dict], now: datetime, max_idle: float = MQTT_REORDER_MAX_IDLE_SECONDS
+) -> Optional[Tuple[Reads, datetime]]:
+    """Referencia persistida por dump_watermark; None si no hay o tiene más de max_idle segundos."""
+    if not data:
+        return None
+    try:
+        seen = datetime.fromisoformat(data["seen"])
+        if max_idle > 0 and (now - seen).total_seconds() > max_idle:
+            return None
+        reads = frozenset((code.encode(), datetime.fromisoformat(ts)) for code, ts in data["reads"])
+        return reads, datetime.fromisoformat(data["at"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class StaleSnapshotError(Exception):
+    """TAGS anterior al último aplicado de su bahía (por cualquier réplica): no se aplica."""
+
+
+class _ModuleQueue:
+    __slots__ = ("heap", "applied", "last", "last_seq", "seen", "generation")
+
+    def __init__(self, generation: int):
+        self.heap: List[Tuple[_Key, Optional[Reads], Any]] = []
+        # (lecturas, ts efectivo) del último snapshot liberado y del más nuevo recibido.
+        # El ts efectivo es una cota inferior del momento del snapshot: nunca retrocede
+        self.applied: Optional[Tuple[Reads, datetime]] = None
+        self.last: Optional[Tuple[Reads, datetime]] = None
+        self.last_seq = -1                    # secuencia de llegada del último liberado
+        self.seen: Optional[float] = None     # clock() del último offer
+        self.generation = generation          # cambia en cada reset: invalida plazos viejos
+
+    def reset(self, generation: int):
+        self.applied = self.last = None
+        self.generation = generation
+
+
+class ReorderBuffer:
+    """
+    Reordena los TAGS de cada módulo por el timestamp de sus lecturas antes de procesarlos.
+    - offer() retiene el snapshot `window` segundos; al vencer se liberan, en orden, él y
+      todos los retenidos del módulo que van antes.
+    - El orden es el timestamp más nuevo de las lecturas, salvo que el snapshot no sea
+      anterior (predates) al más nuevo recibido: entonces va después de él. Así un
+      snapshot en que alguien se retiró (su timestamp más nuevo baja) no se adelanta.
+    - Un snapshot anterior al último liberado del módulo llega tarde (redelivery QoS 1,
+      reintento) y se descarta: aplicarlo cerraría PeopleInMaintenance que siguen vigentes.
+    - Un retroceso de más de max_regression segundos es un reloj reiniciado (corte de
+      energía, ajuste de NTP), no un atraso: se acepta. reset() (LWT/ONLINE, silencio) y
+      max_idle segundos sin TAGS olvidan lo aplicado del módulo; los módulos inactivos
+      sin nada retenido se descartan (cada max_idle segundos) para no crecer sin límite.
+    - Un TAGS sin lecturas (o ilegible) se ordena después de todo lo ya visto del módulo.
+    Con window = 0 no se retiene nada: sólo se descartan los atrasados.
+    on_release(module_code, item) lo llama un único hilo (el de offer() con window = 0,
+    el propio del buffer si no), así el orden de liberación es el de entrega al pool.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        on_release: Callable[[str, Any], None],
+        enabled: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+        max_regression: float = MQTT_REORDER_MAX_REGRESSION_SECONDS,
+        max_idle: float = MQTT_REORDER_MAX_IDLE_SECONDS,
+    ):
+        self.window = max(0.0, window)
+        self.on_release = on_release
+        self.enabled = enabled
+        self.max_regression = max_regression
+        self.max_idle = max_idle
+        self._clock = clock
+        self._modules: Dict[str, _ModuleQueue] = {}
+        # Plazos en orden de llegada (todos retienen lo mismo → FIFO): (plazo, módulo,
+        # generación del módulo, clave). Un plazo de otra generación (hubo reset) se ignora
+        self._deadlines: Deque[Tuple[float, str, int, _Key]] = deque()
+        # Liberados por un reset(): los entrega el hilo del buffer, antes que los vencidos
+        self._ready: Deque[Tuple[str, List[Any]]] = deque()
+        self._seq = itertools.count()
+        self._generations = itertools.count()
+        self._next_prune = clock() + max_idle
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self.offered = 0
+        self.released = 0
+        self.reordered = 0
+        self.stale = 0
+        self.resets = 0
+        self.pruned = 0
+
+    # ----------- entrada -----------
+    def offer(self, module_code: str, reads: Optional[Reads], item: Any) -> bool:
+        """Retiene (o libera) el snapshot. Retorna False si se descartó por atrasado."""
+        with self._cond:
+            now = self._clock()
+            if self.max_idle > 0 and now >= self._next_prune:
+                self._prune(now)
+            state = self._modules.get(module_code)
+            if state is None:
+                state = self._modules[module_code] = _ModuleQueue(next(self._generations))
+            flushed: List[Any] = []
+            if self.max_idle > 0 and state.seen is not None and now - state.seen > self.max_idle:
+                flushed = self._reset(module_code, state, "inactivo")
+            state.seen = now
+            newest = _newest(reads) if reads else None
+            if newest is not None and state.last is not None and self.max_regression > 0 \
+                    and state.last[1] - newest > timedelta(seconds=self.max_regression):
+                flushed += self._reset(module_code, state, "reloj_retrocedio")
+            if reads is not None and state.applied is not None and predates(
+                reads, *state.applied, max_regression=self.max_regression
+            ):
+                self.stale += 1
+                mqtt_stale_snapshots.inc()
+                log.debug("snapshot_atrasado", module=module_code, ref=state.applied[1].isoformat())
+                stale = True
+            else:
+                stale = False
+                flushed += self._hold(module_code, state, reads, item)
+        self._deliver(module_code, flushed)
+        return not stale
+
+    def _hold(self, module_code: str, state: _ModuleQueue, reads: Optional[Reads], item: Any) -> List[Any]:
+        """Con el lock tomado: encola el snapshot; retorna lo que hay que liberar ya (window = 0)."""
+        key = (self._effective(state, reads), next(self._seq))
+        heapq.heappush(state.heap, (key, reads, item))
+        self.offered += 1
+        if self.window > 0 and self._running:
+            self._deadlines.append((self._clock() + self.window, module_code, state.generation, key))
+            self._cond.notify()
+            return []
+        return self._pop_until(state, key)
+
+    def _effective(self, state: _ModuleQueue, reads: Optional[Reads]) -> datetime:
+        """Timestamp de orden del snapshot; actualiza el más nuevo recibido del módulo."""
+        last = state.last
+        if reads is None:
+            return last[1] if last else _EPOCH
+        newest = _newest(reads) or _EPOCH
+        if last is not None and predates(reads, *last, max_regression=self.max_regression):
+            return newest  # anterior al más nuevo recibido: se ordena antes que él
+        effective = max(newest, last[1]) if last else newest
+        state.last = (reads, effective)
+        return effective
+
+    def reset(self, module_code: str):
+        """Olvida lo aplicado del módulo (reconexión, LWT, silencio): su reloj pudo cambiar."""
+        with self._cond:
+            state = self._modules.get(module_code)
+            flushed = self._reset(module_code, state, "reconexion") if state is not None else []
+        self._deliver(module_code, flushed)
+
+    def _reset(self, module_code: str, state: _ModuleQueue, reason: str) -> List[Any]:
+        """Con el lock tomado: libera lo retenido (va antes que lo que llegue después) y olvida."""
+        if state.applied is None and state.last is None and not state.heap:
+            return []
+        flushed = self._pop_until(state, max(entry[0] for entry in state.heap)) if state.heap else []
+        state.reset(next(self._generations))
+        self.resets += 1
+        log.debug("reorden_reiniciado", module=module_code, motivo=reason)
+        if flushed and self._running:
+            # Con hilo propio sólo él entrega: así no se adelanta a lo que ya sacó
+            self._ready.append((module_code, flushed))
+            self._cond.notify()
+            return []
+        return flushed
+
+    def _prune(self, now: float):
+        """Con el lock tomado: descarta los módulos sin nada retenido ni TAGS en max_idle segundos."""
+        idle = [
+            code for code, state in self._modules.items()
+            if not state.heap and state.seen is not None and now - state.seen > self.max_idle
+        ]
+        for code in idle:
+            del self._modules[code]
+        self.pruned += len(idle)
+        self._next_prune = now + self.max_idle
+
+    # ----------- liberación -----------
+    def _pop_until(self, state: _ModuleQueue, key: _Key) -> List[Any]:
+        """Con el lock tomado: saca, en orden, los retenidos del módulo hasta `key` inclusive."""
+        items = []
+        while state.heap and state.heap[0][0] <= key:
+            item_key, reads, item = heapq.heappop(state.heap)
+            if item_key[1] < state.last_seq:
+                self.reordered += 1  # llegó antes que uno ya liberado, pero es anterior
+            state.last_seq = max(state.last_seq, item_key[1])
+            if reads is not None:
+                state.applied = (reads, item_key[0])
+            items.append(item)
+        self.released += len(items)
+        return items
+
+    def _deliver(self, module_code: str, items: List[Any]):
+        for item in items:
+            try:
+                self.on_release(module_code, item)
+            except Exception as e:
+                log.exception("error_liberando_snapshot", module=module_code, error=str(e))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._ready and (not self._deadlines or self._deadlines[0][0] > self._clock()):
+                    self._cond.wait(self._deadlines[0][0] - self._clock() if self._deadlines else None)
+                if not self._running:
+                    return
+                now = self._clock()
+                due = list(self._ready)
+                self._ready.clear()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    _, module_code, generation, key = self._deadlines.popleft()
+                    state = self._modules.get(module_code)
+                    if state is not None and state.generation == generation:
+                        due.append((module_code, self._pop_until(state, key)))
+            for module_code, items in due:
+                self._deliver(module_code, items)
+
+    # ----------- ciclo de vida -----------
+    def start(self):
+        if not self.enabled or self.window <= 0 or self._thread is not None:
+            return
+        with self._cond:
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="mqtt-reorder", daemon=True)
+        self._thread.start()
+        log.info("reorden_iniciado", ventana_ms=round(self.window * 1000))
+
+    def stop(self):
+        """Detiene el hilo y libera todo lo retenido, en orden."""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout=self.window + 1)
+        self._thread = None
+        with self._cond:
+            self._deadlines.clear()
+            pending = list(self._ready)
+            self._ready.clear()
+            pending += [
+                (module_code, self._pop_until(state, max(entry[0] for entry in state.heap)))
+                for module_code, state in self._modules.items()
+                if state.heap
+            ]
+        for module_code, items in pending:
+            self._deliver(module_code, items)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "enabled": self.enabled,
+                "window_ms": round(self.window * 1000),
+                "modules": len(self._modules),
+                "held": sum(len(state.heap) for state in self._modules.values()),
+                "offered": self.offered,
+                "released": self.released,
+                "reordered": self.reordered,
+                "stale": self.stale,
+                "resets": self.resets,
+                "pruned": self.pruned,
+            }
@@ -0,0 +1,170 @@
+# app/mqtt/snapshots.py
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, Optional
+
+from .config import SNAPSHOT_MAX_AGE_SECONDS, SNAPSHOT_MAX_GAP_SECONDS
+from .payloads import StatusPayload
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """Último conjunto de tags procesado para un módulo y su resultado."""
+    card_codes: FrozenSet[str]
+    loto_codes: FrozenSet[str]
+    maintenance_id: Optional[int]
+    status: StatusPayload
+    processed_at: float
+    # Versión del registro de tags usada; si cambió, el snapshot ya no es válido
+    registry_version: int = 0
+
+
+@dataclass(frozen=True)
+class SnapshotDiff:
+    previous: Optional[Snapshot]
+    added_card: FrozenSet[str]
+    removed_card: FrozenSet[str]
+    added_loto: FrozenSet[str]
+    removed_loto: FrozenSet[str]
+
+    @property
+    def unchanged(self) -> bool:
+        return self.previous is not None and not (
+            self.added_card or self.removed_card or self.added_loto or self.removed_loto
+        )
+
+    @property
+    def loto_changed(self) -> bool:
+        return bool(self.added_loto or self.removed_loto)
+
+
+class SnapshotStore:
+    """
+    Guarda por módulo el último snapshot CARD/LOTO procesado.
+    - diff(): compara el payload entrante con el último snapshot.
+    - Un snapshot expira tras max_age segundos para forzar una reconciliación
+      completa periódica (por si la BD cambió por fuera del flujo MQTT).
+    - max_gap (suscripción compartida): si entre dos mensajes de un módulo pasaron más
+      de max_gap segundos, otra réplica pudo procesar mensajes intermedios y el
+      snapshot local ya no refleja la BD → se ignora y se reconcilia completo.
+    """
+
+    def __init__(self, max_age: float = 300.0, max_gap: float = 0.0):
+        self.max_age = max_age
+        self.max_gap = max_gap
+        self._snapshots: Dict[str, Snapshot] = {}
+        self._last_seen: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.gap_invalidations = 0
+
+    def get(self, module_code: str, registry_version: Optional[int] = None) -> Optional[Snapshot]:
+        """Snapshot vigente para comparar un mensaje entrante del módulo (None si no hay)."""
+        with self._lock:
+            snap = self._snapshots.get(module_code)
+            if self.max_gap > 0:
+                now = time.monotonic()
+                last_seen = self._last_seen.get(module_code)
+                self._last_seen[module_code] = now
+                if snap is not None and (last_seen is None or now - last_seen > self.max_gap):
+                    del self._snapshots[module_code]
+                    self.gap_invalidations += 1
+                    snap = None
+        if snap is None:
+            return None
+        if self.max_age > 0 and time.monotonic() - snap.processed_at > self.max_age:
+            return None
+        if registry_version is not None and snap.registry_version != registry_version:
+            return None
+        return snap
+
+    @staticmethod
+    def compare(previous: Optional[Snapshot], card_codes: Iterable[str], loto_codes: Iterable[str]) -> SnapshotDiff:
+        cards = frozenset(card_codes)
+        lotos = frozenset(loto_codes)
+        if previous is None:
+            return SnapshotDiff(None, cards, frozenset(), lotos, frozenset())
+        return SnapshotDiff(
+            previous,
+            added_card=cards - previous.card_codes,
+            removed_card=previous.card_codes - cards,
+            added_loto=lotos - previous.loto_codes,
+            removed_loto=previous.loto_codes - lotos,
+        )
+
+    def diff(
+        self,
+        module_code: str,
+        card_codes: Iterable[str],
+        loto_codes: Iterable[str],
+        registry_version: Optional[int] = None,
+        pending: Optional[Snapshot] = None,
+    ) -> SnapshotDiff:
+        """
+        Compara con el último snapshot del módulo y cuenta el resultado (unchanged/changed).
+        pending: snapshot del mismo módulo aún sin confirmar (lote en curso); tiene prioridad.
+        """
+        previous = pending if pending is not None else self.get(module_code, registry_version)
+        result = self.compare(previous, card_codes, loto_codes)
+        with self._lock:
+            if result.unchanged:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return result
+
+    @staticmethod
+    def build(
+        card_codes: Iterable[str],
+        loto_codes: Iterable[str],
+        maintenance_id: Optional[int],
+        status: StatusPayload,
+        registry_version: int = 0,
+    ) -> Snapshot:
+        return Snapshot(
+            card_codes=frozenset(card_codes),
+            loto_codes=frozenset(loto_codes),
+            maintenance_id=maintenance_id,
+            status=status,
+            processed_at=time.monotonic(),
+            registry_version=registry_version,
+        )
+
+    def put(self, module_code: str, snap: Snapshot):
+        with self._lock:
+            self._snapshots[module_code] = snap
+
+    def commit(
+        self,
+        module_code: str,
+        card_codes: Iterable[str],
+        loto_codes: Iterable[str],
+        maintenance_id: Optional[int],
+        status: StatusPayload,
+        registry_version: int = 0,
+    ):
+        self.put(module_code, self.build(card_codes, loto_codes, maintenance_id, status, registry_version))
+
+    def invalidate(self, module_code: str):
+        with self._lock:
+            self._snapshots.pop(module_code, None)
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self._last_seen.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "modules": len(self._snapshots),
+                "unchanged": self.hits,
+                "changed": self.misses,
+                "gap_invalidations": self.gap_invalidations,
+            }
+
+
+# Instancia global del proceso
+snapshot_store = SnapshotStore(max_age=SNAPSHOT_MAX_AGE_SECONDS, max_gap=SNAPSHOT_MAX_GAP_SECONDS)
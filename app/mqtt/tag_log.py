@@ -0,0 +1,278 @@
+# app/mqtt/tag_log.py
+import csv
+import io
+import re
+import threading
+from collections import deque
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert, inspect, text
+from sqlalchemy.orm import Session
+
+from app import models
+from app.logger import get_logger
+from app.metrics import tag_reads_dropped, tag_reads_written
+from .config import (
+    TAG_READS_ENABLED,
+    TAG_READS_FLUSH_ROWS,
+    TAG_READS_FLUSH_SECONDS,
+    TAG_READS_QUEUE_SIZE,
+    TAG_READS_RETENTION_DAYS,
+)
+from .payloads import TagRead, TagsPayload, parse_timestamp
+
+log = get_logger(__name__)
+
+TABLE = models.TagReadEvent.__tablename__
+COLUMNS = ("received_at", "read_at", "module_loto_code", "tag_type", "tag_code")
+# Campo vacío sin comillas = NULL (read_at inválido); en las columnas de texto, cadena vacía
+COPY_SQL = (
+    f"COPY {TABLE} ({', '.join(COLUMNS)}) FROM STDIN "
+    f"WITH (FORMAT csv, FORCE_NOT_NULL (module_loto_code, tag_type, tag_code))"
+)
+PARTITION_RE = re.compile(rf"^{TABLE}_(\d{{8}})$")
+
+# (received_at, module_loto_code, tags del payload): se aplana al volcar, no en la ingesta
+_Pending = Tuple[datetime, str, Dict[str, List[TagRead]]]
+
+
+def partition_name(day: date) -> str:
+    return f"{TABLE}_{day:%Y%m%d}"
+
+
+class TagReadLog:
+    """
+    Registro append-only de cada lectura TAGS en la tabla tag_reads.
+    - record() no toca la BD: guarda el payload en memoria (acotada a queue_size filas;
+      si se llena, se descarta y se cuenta) y despierta al escritor al juntar flush_rows.
+    - Un hilo vuelca cada flush_interval (o antes si se llenó un lote) con COPY en
+      PostgreSQL/psycopg2 y con un INSERT ejecutado por lotes en otros motores.
+      Si el volcado falla, las filas vuelven a la cola y se reintentan.
+    - En PostgreSQL mantiene las particiones diarias: crea la de hoy y la de mañana y
+      borra (DROP TABLE) las anteriores a retention_days. Borrar una partición no deja
+      filas muertas: sin VACUUM masivo.
+    - Si al arrancar la tabla no existe (base anterior sin migrar) el registro se desactiva
+      con un único error, en lugar de reintentar cada volcado y llenar la cola.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = TAG_READS_ENABLED,
+        flush_rows: int = TAG_READS_FLUSH_ROWS,
+        flush_interval: float = TAG_READS_FLUSH_SECONDS,
+        queue_size: int = TAG_READS_QUEUE_SIZE,
+        retention_days: int = TAG_READS_RETENTION_DAYS,
+    ):
+        self.enabled = enabled
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.retention_days = retention_days
+        self._pending: Deque[_Pending] = deque()
+        self._pending_rows = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._session_factory: Optional[Callable[[], Session]] = None
+        self._maintained_on: Optional[date] = None
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.partitions_dropped = 0
+
+    # ----------- registro (hilos de ingesta) -----------
+    def record(self, payload: TagsPayload, received_at: Optional[datetime] = None):
+        if not self.enabled:
+            return
+        rows = sum(len(items) for items in payload.tags.values())
+        if not rows:
+            return
+        received_at = received_at or datetime.now(timezone.utc)
+        with self._lock:
+            if self._pending_rows + rows > self.queue_size:
+                self.dropped += rows
+                tag_reads_dropped.inc(amount=rows)
+                return
+            self._pending.append((received_at, payload.module_loto_code, payload.tags))
+            self._pending_rows += rows
+            full = self._pending_rows >= self.flush_rows
+        if full:
+            self._wake.set()
+
+    # ----------- volcado -----------
+    @staticmethod
+    def _rows(batch: Iterable[_Pending]) -> List[tuple]:
+        return [
+            (received_at, parse_timestamp(read.timestamp), module_code, tag_type, read.tag_code)
+            for received_at, module_code, tags in batch
+            for tag_type, items in tags.items()
+            for read in items
+        ]
+
+    def flush(self, db: Session) -> int:
+        """Escribe lo encolado en tag_reads. Retorna las filas escritas."""
+        with self._lock:
+            batch = list(self._pending)
+            self._pending.clear()
+            self._pending_rows = 0
+        if not batch:
+            return 0
+        rows = self._rows(batch)
+        try:
+            method = self._write(db, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                # Vuelven al frente de la cola, si entran
+                if self._pending_rows + len(rows) <= self.queue_size:
+                    self._pending.extendleft(reversed(batch))
+                    self._pending_rows += len(rows)
+                else:
+                    self.dropped += len(rows)
+                    tag_reads_dropped.inc(amount=len(rows))
+                self.flush_errors += 1
+            # Una partición faltante (p. ej. cambio de día) se crea antes del reintento
+            self._maintained_on = None
+            raise
+        tag_reads_written.inc(method, amount=len(rows))
+        with self._lock:
+            self.written += len(rows)
+            self.flushes += 1
+        log.debug("tag_reads_escritas", filas=len(rows), metodo=method)
+        return len(rows)
+
+    @staticmethod
+    def _write(db: Session, rows: List[tuple]) -> str:
+        conn = db.connection()
+        if conn.dialect.driver == "psycopg2":
+            buf = io.StringIO()
+            writer = csv.writer(buf, lineterminator="\n")
+            for received_at, read_at, module_code, tag_type, tag_code in rows:
+                writer.writerow((received_at.isoformat(), read_at.isoformat() if read_at else None, module_code, tag_type, tag_code))
+            buf.seek(0)
+            cursor = conn.connection.cursor()
+            try:
+                cursor.copy_expert(COPY_SQL, buf)
+            finally:
+                cursor.close()
+            return "copy"
+        conn.execute(insert(models.TagReadEvent.__table__), [dict(zip(COLUMNS, row)) for row in rows])
+        return "insert"
+
+    # ----------- particiones (PostgreSQL) -----------
+    def maintain_partitions(self, db: Session, today: Optional[date] = None):
+        """Crea las particiones de hoy y mañana y borra las vencidas. Sin efecto fuera de PostgreSQL."""
+        today = today or datetime.now(timezone.utc).date()
+        if db.get_bind().dialect.name != "postgresql":
+            self._maintained_on = today
+            return
+        relkind = db.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": TABLE}).scalar()
+        if relkind != "p":
+            log.warning("tag_reads_sin_particionar", tabla=TABLE)
+            self._maintained_on = today
+            return
+        for day in (today, today + timedelta(days=1)):
+            db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(day)} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM ('{day.isoformat()} 00:00:00+00') "
+                f"TO ('{(day + timedelta(days=1)).isoformat()} 00:00:00+00')"
+            ))
+        dropped: List[str] = []
+        if self.retention_days > 0:
+            oldest = today - timedelta(days=self.retention_days)
+            children = db.execute(text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(:t)"
+            ), {"t": TABLE}).scalars().all()
+            for name in children:
+                match = PARTITION_RE.match(name)
+                if match and datetime.strptime(match.group(1), "%Y%m%d").date() < oldest:
+                    db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                    dropped.append(name)
+        db.commit()
+        self.partitions_dropped += len(dropped)
+        self._maintained_on = today
+        log.info("tag_reads_particiones", hoy=partition_name(today), eliminadas=dropped)
+
+    # ----------- ciclo de vida -----------
+    def start(self, session_factory: Callable[[], Session]):
+        if not self.enabled or self._thread is not None:
+            return
+        if not self._table_exists(session_factory):
+            self.enabled = False
+            with self._lock:
+                self._pending.clear()
+                self._pending_rows = 0
+            log.error(
+                "tag_reads_desactivado_sin_tabla", tabla=TABLE,
+                detalle="crear la tabla (ver README) o definir TAG_READS_ENABLED=false",
+            )
+            return
+        self._session_factory = session_factory
+        self._running = True
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run, name="tag-reads", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _table_exists(session_factory: Callable[[], Session]) -> bool:
+        db = session_factory()
+        try:
+            return inspect(db.get_bind()).has_table(TABLE)
+        except Exception as e:
+            # Sin poder comprobarlo (BD caída al arrancar) se intenta igual: los volcados reintentan
+            log.warning("tag_reads_tabla_no_verificada", error=str(e))
+            return True
+        finally:
+            db.close()
+
+    def stop(self):
+        """Detiene el hilo y hace un último volcado."""
+        if self._thread is None:
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        self._thread = None
+        self._flush_once()
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._running:
+                self._flush_once()
+
+    def _flush_once(self):
+        db = self._session_factory()
+        try:
+            if self._maintained_on != datetime.now(timezone.utc).date():
+                self.maintain_partitions(db)
+            # Varios lotes seguidos si la ingesta los llenó mientras se escribía
+            while self.flush(db) >= self.flush_rows:
+                pass
+        except Exception as e:
+            db.rollback()
+            log.warning("error_volcando_tag_reads", error=str(e))
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "pending": self._pending_rows,
+                "written": self.written,
+                "dropped": self.dropped,
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+                "partitions_dropped": self.partitions_dropped,
+            }
+
+
+# Instancia global del proceso
+tag_read_log = TagReadLog()
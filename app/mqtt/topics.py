@@ -1,8 +1,9 @@
-from .config import MQTT_APP_PREFIX
+from .config import MQTT_APP_PREFIX, MQTT_SHARED_GROUP
 
 # Tópicos
 # APP/LOTO_RFID/{module_code}/TAGS
 # APP/LOTO_RFID/{module_code}/STATUS
+# APP/LOTO_RFID/{module_code}/USERS
 # APP/LOTO_RFID/{module_code}/ONLINE
 # APP/LOTO_RFID/{module_code}/LWT
 
@@ -12,6 +13,9 @@ def topic_tags(module_code: str) -> str:
 def topic_status(module_code: str) -> str:
     return f"{MQTT_APP_PREFIX}/{module_code}/STATUS"
 
+def topic_users(module_code: str) -> str:
+    return f"{MQTT_APP_PREFIX}/{module_code}/USERS"
+
 def topic_online(module_code: str) -> str:
     return f"{MQTT_APP_PREFIX}/{module_code}/ONLINE"
 
@@ -23,6 +27,13 @@ SUBSCRIBE_TAGS_ALL = f"{MQTT_APP_PREFIX}/+/TAGS"
 SUBSCRIBE_ONLINE_ALL  = f"{MQTT_APP_PREFIX}/+/ONLINE"
 SUBSCRIBE_LWT_ALL  = f"{MQTT_APP_PREFIX}/+/LWT"
 
+def shared(topic_filter: str, group: str = MQTT_SHARED_GROUP) -> str:
+    # Suscripción compartida MQTT 5 / extensión de Mosquitto, EMQX, HiveMQ: $share/<grupo>/<filtro>
+    return f"$share/{group}/{topic_filter}" if group else topic_filter
+
+# Filtros a los que se suscribe el backend (compartidos si MQTT_SHARED_GROUP)
+SUBSCRIPTIONS = [shared(f) for f in (SUBSCRIBE_TAGS_ALL, SUBSCRIBE_LWT_ALL, SUBSCRIBE_ONLINE_ALL)]
+
 def extract_module_code(topic: str) -> str | None:
     # Espera: APP/LOTO_RFID/{module}/SUFFIX
     parts = topic.split("/")
@@ -30,3 +41,10 @@ def extract_module_code(topic: str) -> str | None:
         return None
     # parts[0]=APP, [1]=LOTO_RFID, [2]={module}
     return parts[2]
+
+_KNOWN_SUFFIXES = {"TAGS", "LWT", "ONLINE", "STATUS", "USERS"}
+
+def topic_suffix(topic: str) -> str:
+    # Etiqueta de métricas: sólo sufijos conocidos (cardinalidad acotada)
+    suffix = topic.rsplit("/", 1)[-1]
+    return suffix if suffix in _KNOWN_SUFFIXES else "other"
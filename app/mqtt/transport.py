@@ -0,0 +1,429 @@
+# app/mqtt/transport.py
+import itertools
+import queue
+import ssl
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.client import topic_matches_sub
+
+from app.logger import get_logger
+from .config import MQTT_TRANSPORT, MQTT_INSTANCE_CLIENT_ID, MQTT_USER, MQTT_PASSWORD, MQTT_CA_CERT, MQTT_PUBLISH_MAX_INFLIGHT
+
+log = get_logger(__name__)
+
+
+class Transport(ABC):
+    """
+    Interfaz de transporte MQTT que usa MqttService (subconjunto de paho.mqtt.client.Client).
+    Los callbacks siguen la API VERSION1 de paho y reciben el propio transporte como `client`:
+        on_connect(client, userdata, flags, rc)
+        on_disconnect(client, userdata, rc)
+        on_message(client, userdata, msg)      # msg: .topic, .payload, .qos, .retain, .mid
+        on_publish(client, userdata, mid)
+    """
+
+    on_connect: Optional[Callable] = None
+    on_disconnect: Optional[Callable] = None
+    on_message: Optional[Callable] = None
+    on_publish: Optional[Callable] = None
+
+    @abstractmethod
+    def connect(self, host: str, port: int, keepalive: int = 60) -> int:
+        ...
+
+    @abstractmethod
+    def disconnect(self) -> int:
+        ...
+
+    @abstractmethod
+    def subscribe(self, topic, qos: int = 0):
+        ...
+
+    @abstractmethod
+    def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False):
+        ...
+
+    @abstractmethod
+    def loop_forever(self):
+        ...
+
+    @abstractmethod
+    def loop_start(self):
+        ...
+
+    @abstractmethod
+    def loop_stop(self):
+        ...
+
+
+# =====================================================================
+# paho (broker real)
+# =====================================================================
+class PahoTransport(Transport):
+    """Transporte sobre paho.mqtt.client.Client hacia el broker configurado (auth y TLS por env)."""
+
+    def __init__(self, client_id: str = MQTT_INSTANCE_CLIENT_ID, clean_session: bool = True):
+        self.client = mqtt.Client(client_id=client_id, clean_session=clean_session)
+        # Misma ventana que la cola de salida: paho no retiene mensajes por su cuenta
+        self.client.max_inflight_messages_set(MQTT_PUBLISH_MAX_INFLIGHT)
+        if MQTT_USER:
+            log.info("mqtt_autenticacion", user=MQTT_USER)
+            self.client.username_pw_set(MQTT_USER, MQTT_PASSWORD or None)
+
+        # Configurar TLS si existe CA_CERT
+        if MQTT_CA_CERT:
+            self.client.tls_set(
+                ca_certs=MQTT_CA_CERT,
+                certfile=None,
+                keyfile=None,
+                cert_reqs=ssl.CERT_REQUIRED,
+                tls_version=ssl.PROTOCOL_TLSv1_2
+            )
+            log.info("mqtt_tls_habilitado", ca=MQTT_CA_CERT)
+        else:
+            log.info("mqtt_sin_tls")
+
+        # paho entrega su propio Client; se reenvía el transporte para que los
+        # callbacks no dependan de la implementación
+        self.client.on_connect = self._paho_on_connect
+        self.client.on_disconnect = self._paho_on_disconnect
+        self.client.on_message = self._paho_on_message
+        self.client.on_publish = self._paho_on_publish
+
+    def _paho_on_connect(self, client, userdata, flags, rc):
+        if self.on_connect:
+            self.on_connect(self, userdata, flags, rc)
+
+    def _paho_on_disconnect(self, client, userdata, rc):
+        if self.on_disconnect:
+            self.on_disconnect(self, userdata, rc)
+
+    def _paho_on_message(self, client, userdata, msg):
+        if self.on_message:
+            self.on_message(self, userdata, msg)
+
+    def _paho_on_publish(self, client, userdata, mid):
+        if self.on_publish:
+            self.on_publish(self, userdata, mid)
+
+    def connect(self, host: str, port: int, keepalive: int = 60) -> int:
+        return self.client.connect(host, port, keepalive)
+
+    def disconnect(self) -> int:
+        return self.client.disconnect()
+
+    def subscribe(self, topic, qos: int = 0):
+        return self.client.subscribe(topic, qos=qos)
+
+    def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False):
+        return self.client.publish(topic, payload=payload, qos=qos, retain=retain)
+
+    def loop_forever(self):
+        return self.client.loop_forever()
+
+    def loop_start(self):
+        return self.client.loop_start()
+
+    def loop_stop(self):
+        return self.client.loop_stop()
+
+
+# =====================================================================
+# Broker en memoria (pruebas y benchmarks sin red)
+# =====================================================================
+class InMemoryMessage:
+    """Equivalente mínimo de paho.mqtt.client.MQTTMessage."""
+
+    __slots__ = ("topic", "payload", "qos", "retain", "mid", "dup", "timestamp")
+
+    def __init__(self, topic: str, payload: bytes, qos: int = 0, retain: bool = False, mid: int = 0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.mid = mid
+        self.dup = False
+        self.timestamp = time.monotonic()
+
+
+class InMemoryMessageInfo:
+    """Equivalente mínimo de paho.mqtt.client.MQTTMessageInfo (la entrega al broker es inmediata)."""
+
+    def __init__(self, mid: int, rc: int = 0):
+        self.mid = mid
+        self.rc = rc
+
+    def is_published(self) -> bool:
+        return self.rc == 0
+
+    def wait_for_publish(self, timeout: Optional[float] = None):
+        return None
+
+
+class _Session:
+    """Estado de un client_id en el broker: suscripciones y mensajes QoS 1 sin PUBACK."""
+
+    def __init__(self, clean_session: bool):
+        self.clean_session = clean_session
+        self.subscriptions: Dict[str, int] = {}  # filtro → qos
+        self.inflight: "OrderedDict[int, InMemoryMessage]" = OrderedDict()
+        self.queued: set = set()  # mids en vuelo que aún no se entregaron nunca (sesión desconectada)
+        self.transport: Optional["InMemoryTransport"] = None
+        self.mids = itertools.count(1)
+
+
+class InMemoryBroker:
+    """
+    Broker MQTT 3.1.1 en memoria.
+    - Enruta por filtros con comodines `+` / `#`.
+    - QoS efectivo = min(QoS de publicación, QoS de suscripción).
+    - QoS 1: cada entrega queda en vuelo hasta el PUBACK del cliente (que llega cuando
+      on_message termina sin excepción). Lo no confirmado se reenvía con dup=True al
+      reconectar una sesión persistente (clean_session=False), igual que un broker real;
+      mientras la sesión está desconectada los mensajes QoS 1 se acumulan en ella.
+    - Guarda el último mensaje retenido de cada tópico y lo entrega al suscribirse.
+    - Suscripciones compartidas `$share/<grupo>/<filtro>`: cada mensaje va a un solo
+      miembro conectado del grupo, elegido por hash del client id del publicador
+      (como la estrategia hash_clientid de EMQX: todo lo de un módulo va a la misma
+      réplica mientras el grupo no cambie). No reciben mensajes retenidos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, _Session] = {}
+        self._shared: Dict[Tuple[str, str], Dict[str, int]] = {}  # (grupo, filtro) → client_id → qos
+        self._retained: Dict[str, InMemoryMessage] = {}
+        self.published = 0
+        self.delivered = 0
+        self.redelivered = 0
+
+    # ----------- sesiones -----------
+    def connect(self, transport: "InMemoryTransport") -> Tuple[bool, List[InMemoryMessage]]:
+        """Asocia el transporte a su sesión; devuelve (session_present, mensajes a reenviar)."""
+        with self._lock:
+            session = self._sessions.get(transport.client_id)
+            present = session is not None and not transport.clean_session
+            if not present:
+                session = _Session(transport.clean_session)
+                self._sessions[transport.client_id] = session
+            session.transport = transport
+            pending = list(session.inflight.values())
+            for message in pending:
+                message.dup = message.mid not in session.queued
+            self.redelivered += sum(1 for m in pending if m.dup)
+            session.queued.clear()
+        return present, pending
+
+    def disconnect(self, transport: "InMemoryTransport"):
+        with self._lock:
+            session = self._sessions.get(transport.client_id)
+            if session is None or session.transport is not transport:
+                return
+            session.transport = None
+            if session.clean_session:
+                del self._sessions[transport.client_id]
+                for members in self._shared.values():
+                    members.pop(transport.client_id, None)
+
+    def subscribe(self, transport: "InMemoryTransport", topic_filter: str, qos: int):
+        with self._lock:
+            session = self._sessions.get(transport.client_id)
+            if session is None:
+                return
+            if topic_filter.startswith("$share/"):
+                _, group, real_filter = topic_filter.split("/", 2)
+                self._shared.setdefault((group, real_filter), {})[transport.client_id] = qos
+                return
+            session.subscriptions[topic_filter] = qos
+            retained = [m for t, m in self._retained.items() if topic_matches_sub(topic_filter, t)]
+        for message in retained:
+            self._route(session, message, qos)
+
+    def puback(self, client_id: str, mid: int):
+        with self._lock:
+            session = self._sessions.get(client_id)
+            if session is not None:
+                session.inflight.pop(mid, None)
+                session.queued.discard(mid)
+
+    # ----------- publicación -----------
+    def publish(self, topic: str, payload: bytes, qos: int = 0, retain: bool = False, publisher: str = ""):
+        message = InMemoryMessage(topic, payload, qos, retain)
+        with self._lock:
+            self.published += 1
+            if retain:
+                if payload:
+                    self._retained[topic] = message
+                else:
+                    self._retained.pop(topic, None)
+            targets: List[Tuple[_Session, int]] = []
+            for session in self._sessions.values():
+                granted = [q for f, q in session.subscriptions.items() if topic_matches_sub(f, topic)]
+                if granted:
+                    targets.append((session, max(granted)))
+            for (group, topic_filter), members in self._shared.items():
+                if not topic_matches_sub(topic_filter, topic):
+                    continue
+                connected = sorted(
+                    c for c in members if c in self._sessions and self._sessions[c].transport is not None
+                )
+                if connected:
+                    chosen = connected[zlib.crc32((publisher or topic).encode("utf-8")) % len(connected)]
+                    targets.append((self._sessions[chosen], members[chosen]))
+        for session, sub_qos in targets:
+            self._route(session, message, sub_qos)
+
+    def _route(self, session: _Session, message: InMemoryMessage, sub_qos: int):
+        qos = min(message.qos, sub_qos, 1)
+        with self._lock:
+            delivery = InMemoryMessage(message.topic, message.payload, qos, message.retain, next(session.mids) if qos else 0)
+            delivery.timestamp = message.timestamp
+            if qos:
+                session.inflight[delivery.mid] = delivery
+            transport = session.transport
+            if transport is None:
+                if qos:
+                    session.queued.add(delivery.mid)  # sesión persistente desconectada: se entrega al reconectar
+                return
+            self.delivered += 1
+        transport._deliver(delivery)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "retained": len(self._retained),
+                "inflight": sum(len(s.inflight) for s in self._sessions.values()),
+                "published": self.published,
+                "delivered": self.delivered,
+                "redelivered": self.redelivered,
+            }
+
+
+class InMemoryTransport(Transport):
+    """
+    Cliente de un InMemoryBroker con la misma interfaz que PahoTransport.
+    Como paho, los callbacks corren en un único hilo de loop por cliente.
+    """
+
+    def __init__(self, broker: InMemoryBroker, client_id: str = "", clean_session: bool = True, userdata: Any = None):
+        self.broker = broker
+        self.client_id = client_id or f"memory-{id(self)}"
+        self.clean_session = clean_session
+        self._userdata = userdata
+        self._inbox: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._connected = False
+        self._publish_mids = itertools.count(1)
+
+    # ----------- conexión -----------
+    def connect(self, host: str = "", port: int = 0, keepalive: int = 60) -> int:
+        self._connected = True
+        session_present, redeliveries = self.broker.connect(self)
+        self._inbox.put(("connect", {"session present": int(session_present)}))
+        for message in redeliveries:
+            self._deliver(message)
+        return 0
+
+    def disconnect(self) -> int:
+        if self._connected:
+            self._connected = False
+            self.broker.disconnect(self)
+            self._inbox.put(("disconnect", None))
+        return 0
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    # ----------- mensajes -----------
+    def subscribe(self, topic, qos: int = 0):
+        filters: List[Tuple[str, int]] = topic if isinstance(topic, list) else [(topic, qos)]
+        for topic_filter, filter_qos in filters:
+            self.broker.subscribe(self, topic_filter, filter_qos)
+        return 0, 0
+
+    def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False) -> InMemoryMessageInfo:
+        if payload is None:
+            data = b""
+        elif isinstance(payload, (bytes, bytearray)):
+            data = bytes(payload)
+        else:
+            data = str(payload).encode("utf-8")
+        self.broker.publish(topic, data, qos, retain, publisher=self.client_id)
+        info = InMemoryMessageInfo(next(self._publish_mids))
+        if self.on_publish:
+            self._inbox.put(("publish", info.mid))
+        return info
+
+    def _deliver(self, message: InMemoryMessage):
+        self._inbox.put(("message", message))
+
+    # ----------- loop -----------
+    def _dispatch(self, kind: str, value: Any) -> bool:
+        if kind == "message":
+            if not self._connected:
+                return True  # llegó tras desconectar: queda en vuelo en la sesión
+            if self.on_message:
+                try:
+                    self.on_message(self, self._userdata, value)
+                except Exception as e:
+                    # Sin PUBACK: el broker lo reenviará al reconectar la sesión
+                    log.exception("error_callback_mensaje", topic=value.topic, error=str(e))
+                    return True
+            if value.qos:
+                self.broker.puback(self.client_id, value.mid)
+        elif kind == "publish":
+            if self.on_publish:
+                self.on_publish(self, self._userdata, value)
+        elif kind == "connect":
+            if self.on_connect:
+                self.on_connect(self, self._userdata, value, 0)
+        elif kind == "disconnect":
+            if self.on_disconnect:
+                self.on_disconnect(self, self._userdata, 0)
+            return False
+        return True
+
+    def loop_forever(self):
+        while True:
+            kind, value = self._inbox.get()
+            if kind == "stop":
+                if value is threading.current_thread():
+                    return 0
+                continue  # sentinela de un hilo de loop anterior que ya terminó
+            if not self._dispatch(kind, value):
+                return 0
+
+    def loop_start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.loop_forever, name=f"{self.client_id}-loop", daemon=True)
+            self._thread.start()
+
+    def loop_stop(self):
+        if self._thread is not None:
+            self._inbox.put(("stop", self._thread))
+            self._thread.join()
+            self._thread = None
+
+    def pending(self) -> int:
+        """Eventos recibidos aún no despachados por el hilo de loop."""
+        return self._inbox.qsize()
+
+
+# Instancia global del proceso (MQTT_TRANSPORT=memory)
+memory_broker = InMemoryBroker()
+
+
+def create_transport(kind: str = MQTT_TRANSPORT, client_id: str = MQTT_INSTANCE_CLIENT_ID) -> Transport:
+    """Transporte según MQTT_TRANSPORT: "paho" (broker real) o "memory" (memory_broker)."""
+    if kind == "paho":
+        return PahoTransport(client_id=client_id)
+    if kind == "memory":
+        return InMemoryTransport(memory_broker, client_id=client_id)
+    raise ValueError(f"MQTT_TRANSPORT desconocido: {kind}")
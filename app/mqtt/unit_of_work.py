@@ -0,0 +1,77 @@
+# app/mqtt/unit_of_work.py
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+@event.listens_for(Session, "after_commit")
+def _count_commit(session: Session):
+    # Contador por sesión: permite medir cuántos COMMIT genera cada mensaje
+    session.info["commits"] = session.info.get("commits", 0) + 1
+
+
+class TransactionStats:
+    """Mensajes procesados vs. COMMIT/ROLLBACK emitidos por la ingesta MQTT."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.commits = 0
+        self.rollbacks = 0
+
+    def record_message(self, db: Session):
+        commits = db.info.pop("commits", 0)
+        with self._lock:
+            self.messages += 1
+            self.commits += commits
+
+    def record_rollback(self):
+        with self._lock:
+            self.rollbacks += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "messages": self.messages,
+                "commits": self.commits,
+                "rollbacks": self.rollbacks,
+                "commits_per_message": round(self.commits / self.messages, 4) if self.messages else 0.0,
+            }
+
+
+def on_commit(db: Session, callback: Callable[[], None]):
+    """Registra un efecto en memoria que sólo debe aplicarse si la transacción se confirma."""
+    db.info.setdefault("on_commit", []).append(callback)
+
+
+def on_rollback(db: Session, callback: Callable[[], None]):
+    """Registra cómo deshacer un efecto en memoria si la transacción se revierte."""
+    db.info.setdefault("on_rollback", []).append(callback)
+
+
+@contextmanager
+def unit_of_work(db: Session):
+    """
+    Aplica todos los cambios de un mensaje en una sola transacción:
+    un único flush + COMMIT al final, o ROLLBACK completo si algo falla.
+    """
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        tx_stats.record_rollback()
+        db.info.pop("on_commit", None)
+        for callback in db.info.pop("on_rollback", []):
+            callback()
+        raise
+    db.info.pop("on_rollback", None)
+    for callback in db.info.pop("on_commit", []):
+        callback()
+
+
+# Instancia global del proceso
+tx_stats = TransactionStats()
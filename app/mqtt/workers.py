@@ -0,0 +1,204 @@
+# app/mqtt/workers.py
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Callable, List, Optional
+
+from app.logger import get_logger
+
+log = get_logger(__name__)
+
+# Marca de "nada pendiente" en el consumidor: None ya es la sentinela de parada
+_NOTHING = object()
+
+
+class _Shard:
+    """Cola acotada + hilo consumidor. Procesa sus trabajos en orden FIFO."""
+
+    def __init__(self, index: int, queue_size: int):
+        self.index = index
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)  # items: (enqueued_at, job, batch_item) | None
+        self.thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Métricas de latencia (tiempo en cola + tiempo de proceso)
+        self.processed = 0
+        self.errors = 0
+        self.dropped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_last = 0.0
+
+    def record(self, latency: float, failed: bool):
+        with self._lock:
+            self.processed += 1
+            if failed:
+                self.errors += 1
+            self.latency_total += latency
+            self.latency_last = latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+
+    def stats(self) -> dict:
+        with self._lock:
+            avg = self.latency_total / self.processed if self.processed else 0.0
+            return {
+                "shard": self.index,
+                "queue_depth": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "processed": self.processed,
+                "errors": self.errors,
+                "dropped": self.dropped,
+                "latency_avg_ms": round(avg * 1000, 3),
+                "latency_max_ms": round(self.latency_max * 1000, 3),
+                "latency_last_ms": round(self.latency_last * 1000, 3),
+            }
+
+
+class ShardedWorkerPool:
+    """
+    Pool de workers particionado por clave (module_loto_code).
+    - Cada clave se asigna siempre al mismo shard (crc32 % n) → orden por módulo garantizado.
+    - Módulos distintos se reparten entre shards y se procesan en paralelo.
+    - submit() sólo encola y nunca espera: el hilo de red de paho no toca la BD ni se
+      bloquea. Con la cola del shard llena retorna False y quien llama decide qué hacer.
+    - Modo lote opcional: los ítems encolados con submit_batch_item() se agrupan
+      (hasta batch_max_size ítems o batch_max_delay segundos) y se entregan juntos
+      a batch_handler. Un trabajo normal en medio cierra el lote, así que el orden
+      por módulo se mantiene.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        queue_size: int,
+        name: str = "mqtt-worker",
+        batch_handler: Optional[Callable[[List[Any]], None]] = None,
+        batch_max_size: int = 1,
+        batch_max_delay: float = 0.0,
+        latency_observer: Optional[Callable[[float], None]] = None,
+    ):
+        if workers < 1:
+            raise ValueError("workers debe ser >= 1")
+        self.name = name
+        self.batch_handler = batch_handler
+        self.batch_max_size = max(1, batch_max_size)
+        self.batch_max_delay = batch_max_delay
+        # Recibe la latencia (encolado → fin) de cada mensaje, p. ej. un histograma
+        self.latency_observer = latency_observer
+        self._shards: List[_Shard] = [_Shard(i, queue_size) for i in range(workers)]
+        self._running = False
+
+    # ----------- ciclo de vida -----------
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for shard in self._shards:
+            shard.thread = threading.Thread(
+                target=self._run, args=(shard,), name=f"{self.name}-{shard.index}", daemon=True
+            )
+            shard.thread.start()
+        log.info("pool_workers_iniciado", pool=self.name, shards=len(self._shards))
+
+    def stop(self, timeout: float = 5.0):
+        if not self._running:
+            return
+        self._running = False
+        for shard in self._shards:
+            try:
+                shard.queue.put(None, timeout=timeout)  # sentinela
+            except queue.Full:
+                pass
+        for shard in self._shards:
+            if shard.thread:
+                shard.thread.join(timeout=timeout)
+        log.info("pool_workers_detenido", pool=self.name)
+
+    # ----------- encolado -----------
+    def shard_for(self, key: str) -> int:
+        return zlib.crc32((key or "").encode("utf-8")) % len(self._shards)
+
+    def submit(self, key: str, job: Callable[[], None]) -> bool:
+        """
+        Encola un trabajo en el shard de la clave. Si la cola está llena lo descarta
+        al instante y retorna False (esperar frenaría el keepalive de paho).
+        """
+        return self._put(key, job, None)
+
+    def submit_batch_item(self, key: str, item: Any) -> bool:
+        """Encola un ítem agrupable (requiere batch_handler)."""
+        if self.batch_handler is None:
+            raise RuntimeError("submit_batch_item requiere un batch_handler")
+        return self._put(key, None, item)
+
+    def _put(self, key: str, job: Optional[Callable[[], None]], batch_item: Any) -> bool:
+        shard = self._shards[self.shard_for(key)]
+        enqueued_at = time.perf_counter()
+        try:
+            shard.queue.put_nowait((enqueued_at, job, batch_item))
+            return True
+        except queue.Full:
+            with shard._lock:
+                shard.dropped += 1
+            log.debug("cola_shard_llena", shard=shard.index, key=key)
+            return False
+
+    # ----------- consumo -----------
+    def _run(self, shard: _Shard):
+        carry = _NOTHING  # ítem leído que cerró un lote y queda pendiente (puede ser la sentinela)
+        while True:
+            item = carry if carry is not _NOTHING else shard.queue.get()
+            carry = _NOTHING
+            if item is None:
+                shard.queue.task_done()
+                return
+            enqueued_at, job, batch_item = item
+            if job is not None:
+                self._execute(shard, [enqueued_at], job)
+                shard.queue.task_done()
+                continue
+
+            # Lote: seguir leyendo hasta llenar o vencer el plazo
+            batch = [batch_item]
+            times = [enqueued_at]
+            deadline = time.monotonic() + self.batch_max_delay
+            while len(batch) < self.batch_max_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    nxt = shard.queue.get(timeout=remaining) if remaining > 0 else shard.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None or nxt[1] is not None:
+                    carry = nxt  # sentinela o trabajo normal: cerrar lote antes
+                    break
+                batch.append(nxt[2])
+                times.append(nxt[0])
+            self._execute(shard, times, lambda: self.batch_handler(batch))
+            for _ in batch:
+                shard.queue.task_done()
+
+    def _execute(self, shard: _Shard, enqueued_times: List[float], job: Callable[[], None]):
+        failed = False
+        try:
+            job()
+        except Exception as e:
+            failed = True
+            log.exception("error_worker", shard=shard.index, error=str(e))
+        done = time.perf_counter()
+        observer = self.latency_observer
+        for enqueued_at in enqueued_times:
+            shard.record(done - enqueued_at, failed)
+            if observer is not None:
+                observer(done - enqueued_at)
+
+    # ----------- métricas -----------
+    def stats(self) -> dict:
+        shards = [s.stats() for s in self._shards]
+        return {
+            "workers": len(shards),
+            "queue_depth": sum(s["queue_depth"] for s in shards),
+            "processed": sum(s["processed"] for s in shards),
+            "dropped": sum(s["dropped"] for s in shards),
+            "shards": shards,
+        }
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from datetime import datetime
 from typing import Optional
 from app import models
 from app.database import get_db
+from app.mqtt.alert_index import alert_index
+from app.mqtt.bay_state import bay_state_view
+from app.mqtt.cache_sync import cache_sync
 
 router = APIRouter(
     prefix="/api/alerts",
@@ -107,6 +110,33 @@ def get_alerts(
     return response
 
 
+@router.put("/{alert_id}/resolve")
+def resolve_alert(alert_id: int, db: Session = Depends(get_db)):
+    """
+    Marca la alerta como resuelta. La bahía deja de contar la alerta como activa
+    (la vista de bahías se reconstruye en la próxima lectura) y una nueva infracción
+    del mismo usuario, bahía y tipo vuelve a generar alerta.
+    """
+    alert = db.query(models.Alert).filter(models.Alert.id == alert_id).first()
+    if not alert:
+        raise HTTPException(status_code=404, detail="Alerta no encontrada")
+    if not alert.resolved:
+        alert.resolved = True
+        alert.resolved_at = datetime.now()
+        key = None
+        if alert.id_users is not None:
+            key = (alert.id_users, alert.maintenance.id_bahias, alert.id_types_alerts)
+            cache_sync.notify(db, "alert_resolved", key)
+        else:
+            cache_sync.notify(db, "bay")
+        db.commit()
+        if key is not None:
+            alert_index.release([key])
+        bay_state_view.invalidate()
+    resolved_at = alert.resolved_at.strftime("%H:%M:%S %d-%m-%Y") if alert.resolved_at else "-"
+    return {"message": "Alerta resuelta", "id": alert.id, "resolvedAt": resolved_at}
+
+
 # 1️⃣ Todas las alertas:
 # GET /api/alerts
 
@@ -127,5 +157,9 @@ def get_alerts(
 # GET /api/alerts?user_id=2
 
 
-# 6️⃣ Combinado:
+# 6️⃣ Resolver una alerta:
+# PUT /api/alerts/7/resolve
+
+
+# 7️⃣ Combinado:
 # GET /api/alerts?bay_id=1&resolved=false&start_date=2025-10-01
\ No newline at end of file
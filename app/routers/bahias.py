@@ -1,100 +1,127 @@
 # app/api/bahias.py
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 from app import models
 from app.database import get_db
+from app.mqtt.bay_state import bay_state_view, format_time as _fmt
 from datetime import datetime
 
 router = APIRouter(prefix="/api/bahias", tags=["Bahías"])
 
 
+def backfill_sort_keys(db: Session) -> int:
+    """Recalcula Bahia.sort_key donde no coincide con el nombre (p. ej. tras agregar la columna)."""
+    rows = db.query(models.Bahia.id, models.Bahia.name, models.Bahia.sort_key).all()
+    changes = [
+        {"id": bay_id, "sort_key": models.bahia_sort_key(name)}
+        for bay_id, name, sort_key in rows
+        if sort_key != models.bahia_sort_key(name)
+    ]
+    if changes:
+        db.execute(update(models.Bahia), changes)
+        db.commit()
+    return len(changes)
+
+
+def _not_modified(request: Request, response: Response, version) -> Optional[Response]:
+    """
+    ETag débil a partir de la versión de la vista. Si el cliente ya tiene esa versión
+    (If-None-Match) responde 304 sin cuerpo; no-cache obliga a revalidar en cada poll.
+    """
+    etag = f'W/"{bay_state_view.epoch}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in (request.headers.get("if-none-match") or "").replace(" ", "").split(","):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
 @router.get("/")
-def get_bahias(db: Session = Depends(get_db)):
+def get_bahias(
+    request: Request,
+    response: Response,
+    headquarters: Optional[int] = Query(None, description="Filtrar por id de sede"),
+    status: Optional[str] = Query(None, description="available | inManteinance | alert | moduleDisconnected"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Tamaño de página (sin límite si se omite)"),
+    after: Optional[str] = Query(None, description="Cursor de la página siguiente (campo next)"),
+    db: Session = Depends(get_db),
+):
     """
     Retorna la lista de bahías con su estado actual:
     - available: online sin alertas ni mantenimiento activo
     - inManteinance: mantenimiento activo
     - alert: alerta activa en el mantenimiento actual o último
     - moduleDisconnected: módulo offline
-    Devuelve {"message": "empty"} si no existen bahías registradas.
+    Se sirve desde bay_state_view (en memoria, actualizada por la ingesta MQTT) sin
+    consultar la BD. `version` y el ETag cambian sólo si cambió alguna bahía: con
+    If-None-Match igual al ETag la respuesta es 304.
+    Ordenadas por número de bahía (sort_key) con paginación por cursor: `next` es el
+    cursor de la página siguiente (None en la última).
+    Devuelve {"message": "empty"} si no hay bahías (con los filtros dados).
     """
-    bahias = db.query(models.Bahia).all()
-
-    if not bahias:
-        return {"message": "empty", "data": []}
-
-    response = []
-    for b in bahias:
-        # Buscar mantenimiento actual o el más reciente
-        maintenance = (
-            db.query(models.Maintenance)
-            .filter(models.Maintenance.id_bahias == b.id)
-            .order_by(models.Maintenance.start_time.desc())
-            .first()
-        )
-
-        # Buscar alertas no resueltas asociadas al mantenimiento actual o último
-        active_alerts = 0
-        if maintenance:
-            active_alerts = (
-                db.query(models.Alert)
-                .filter(models.Alert.id_maintenance == maintenance.id)
-                .filter(models.Alert.resolved == False)
-                .count()
-            )
-
-        # --- Determinar status lógico ---
-        if b.module_loto_status == "offline":
-            status_name = "moduleDisconnected"
-        elif maintenance and maintenance.end_time is None:
-            status_name = "inManteinance"
-        elif active_alerts > 0:
-            status_name = "alert"
-        else:
-            status_name = "available"
-
-        # --- Formatear tiempos ---
-        def fmt(dt):
-            return dt.strftime("%H:%M:%S %d-%m-%Y") if dt else "-"
-
-        start_time = fmt(maintenance.start_time) if maintenance else "-"
-        end_time = fmt(maintenance.end_time) if maintenance else "-"
-
-        # --- Icono ---
-        icon = "warning" if status_name in ["alert", "inManteinance"] else "check"
-
-        response.append({
-            "id": b.id,
-            "name": b.name,
-            "status": status_name,
-            "code": b.module_loto_code,
-            "start_time": start_time,
-            "end_time": end_time,
-            "icon": icon
-        })
-
-    # --- Ordenar las bahías por número ---
-    def extract_bay_number(bay_name: str):
+    after_key = None
+    if after:
         try:
-            # Extrae el número de "Bahía X"
-            return int(bay_name.split()[-1])
-        except (ValueError, IndexError):
-            return 9999  # fallback para nombres sin número
+            after_key = tuple(int(part) for part in after.split(":", 1))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        if len(after_key) != 2:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    bay_state_view.refresh(db)
+    version, rows = bay_state_view.rows()
+    cached = _not_modified(request, response, version)
+    if cached is not None:
+        return cached
 
-    response_sorted = sorted(response, key=lambda x: extract_bay_number(x["name"]))
+    if headquarters is not None or status or after_key:
+        rows = [
+            r for r in rows
+            if (headquarters is None or r.headquarters == headquarters)
+            and (not status or r.status == status)
+            and (after_key is None or (r.sort_key, r.id) > after_key)
+        ]
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1].sort_key}:{rows[-1].id}"
 
-    return {"message": "success", "data": response_sorted}
+    if not rows:
+        return {"message": "empty", "data": [], "next": None, "version": version}
+
+    return {"message": "success", "data": [r.data for r in rows], "next": next_cursor, "version": version}
 
 
 
 @router.get("/{bahia_id}/maintenance")
-def get_bahia_maintenance_details(bahia_id: int, db: Session = Depends(get_db)):
+def get_bahia_maintenance_details(bahia_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     """
     Devuelve la información del mantenimiento más reciente o activo de una bahía específica.
     Incluye los usuarios involucrados, sus tiempos de entrada/salida y si hubo alertas.
     Si no hay mantenimientos, devuelve {"message": "empty"}.
+    La respuesta se cachea por versión de la bahía en bay_state_view (la ingesta la
+    invalida al cambiar el mantenimiento, sus personas o sus alertas); ETag/304 como la lista.
     """
+    bay_state_view.refresh(db)
+    version = bay_state_view.bay_version(bahia_id)
+    if version is None:
+        # Bahía que la vista no conoce (o inexistente): directo de la BD, sin caché
+        return _maintenance_details(bahia_id, db)
+    cached = _not_modified(request, response, f"{bahia_id}.{version}")
+    if cached is not None:
+        return cached
+    payload = bay_state_view.detail(bahia_id)
+    if payload is None:
+        payload = _maintenance_details(bahia_id, db)
+        bay_state_view.store_detail(bahia_id, version, payload)
+    return payload
+
+
+def _maintenance_details(bahia_id: int, db: Session) -> dict:
     # 1️⃣ Buscar la bahía
     bahia = db.query(models.Bahia).filter(models.Bahia.id == bahia_id).first()
     if not bahia:
@@ -126,18 +153,14 @@ def get_bahia_maintenance_details(bahia_id: int, db: Session = Depends(get_db)):
         .count() > 0
     )
 
-    # 5️⃣ Helper para formatear fechas
-    def fmt(dt):
-        return dt.strftime("%H:%M:%S %d-%m-%Y") if dt else "-"
-
-    # 6️⃣ Construir respuesta
+    # 5️⃣ Construir respuesta
     users_details = [
         {
             "name": p.user.name,
             "lastName": p.user.lastname,
             "email": p.user.email,
-            "initTime": fmt(p.entry_time),
-            "endTime": fmt(p.exit_time),
+            "initTime": _fmt(p.entry_time),
+            "endTime": _fmt(p.exit_time),
         }
         for p in people
     ]
@@ -148,8 +171,8 @@ def get_bahia_maintenance_details(bahia_id: int, db: Session = Depends(get_db)):
         "maintenanceName": maintenance.name or "-",
         "cantUsers": len(users_details),
         "usersDetails": users_details,
-        "startTime": fmt(maintenance.start_time),
-        "endTime": fmt(maintenance.end_time),
+        "startTime": _fmt(maintenance.start_time),
+        "endTime": _fmt(maintenance.end_time),
         "alerts": "Sí" if alerts_exist else "No",
     }
 
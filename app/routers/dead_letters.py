@@ -0,0 +1,43 @@
+# app/routers/dead_letters.py
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from app import schemas
+from app.mqtt.client import MqttService
+from app.mqtt.dead_letter import dead_letters
+
+router = APIRouter(
+    prefix="/api/mqtt/dead-letters",
+    tags=["MQTT dead letters"]
+)
+
+
+# Listar mensajes fallidos (más recientes primero)
+@router.get("/")
+def list_dead_letters(
+    limit: int = Query(100, ge=1, le=1000),
+    before_id: Optional[int] = Query(None, description="Paginación: entradas con id menor a este"),
+    error: Optional[str] = Query(None, description="Filtra por tipo de error"),
+    replayed: Optional[bool] = Query(None, description="Filtra por reinyectadas o no"),
+):
+    entries = dead_letters.list(limit=limit, before_id=before_id, error=error, replayed=replayed)
+    return {"message": "success" if entries else "empty", "data": entries}
+
+
+# Conteo total y por tipo de error
+@router.get("/count")
+def count_dead_letters():
+    return dead_letters.count()
+
+
+# Reinyectar mensajes en la ingesta (mismo camino que un mensaje del broker, con reorden).
+# Cada entrada se reinyecta una vez: las ya reinyectadas se omiten salvo con force
+@router.post("/replay")
+def replay_dead_letters(data: schemas.DeadLetterReplay):
+    service = MqttService.instance
+    if service is None:
+        raise HTTPException(status_code=503, detail="Servicio MQTT no inicializado")
+    entries, skipped = dead_letters.claim(ids=data.ids, limit=data.limit, error=data.error, force=data.force)
+    # Orden original de llegada (el orden por módulo importa)
+    for entry in entries:
+        service.replay(entry["topic"], dead_letters.payload(entry))
+    return {"replayed": len(entries), "ids": [e["id"] for e in entries], "skipped": skipped}
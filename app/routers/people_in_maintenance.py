@@ -4,6 +4,8 @@ from sqlalchemy.orm import Session
 from typing import List
 from app import models, schemas
 from app.database import get_db
+from app.mqtt.bay_state import bay_state_view
+from app.mqtt.cache_sync import cache_sync
 
 router = APIRouter(
     prefix="/people_in_maintenance",
@@ -15,7 +17,9 @@ router = APIRouter(
 def create_person_in_maintenance(data: schemas.PeopleInMaintenanceCreate, db: Session = Depends(get_db)):
     db_record = models.PeopleInMaintenance(**data.dict())
     db.add(db_record)
+    cache_sync.notify(db, "details")
     db.commit()
+    bay_state_view.invalidate_details()  # el detalle de la bahía lista sus personas
     db.refresh(db_record)
     return db_record
 
@@ -42,7 +46,9 @@ def update_person_in_maintenance(record_id: int, updated: schemas.PeopleInMainte
     for key, value in updated.dict().items():
         setattr(record, key, value)
 
+    cache_sync.notify(db, "details")
     db.commit()
+    bay_state_view.invalidate_details()
     db.refresh(record)
     return record
 
@@ -54,5 +60,7 @@ def delete_person_in_maintenance(record_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Registro no encontrado")
     
     db.delete(record)
+    cache_sync.notify(db, "details")
     db.commit()
+    bay_state_view.invalidate_details()
     return {"message": "Registro eliminado exitosamente"}
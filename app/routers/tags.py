@@ -5,6 +5,8 @@ from sqlalchemy.orm import Session
 from typing import List
 from app import models, schemas
 from app.database import get_db
+from app.mqtt.cache_sync import cache_sync
+from app.mqtt.registry import TagInfo, tag_registry
 
 router = APIRouter(
     prefix="/tags",
@@ -27,8 +29,11 @@ def create_tag(tag: schemas.TagCreate, db: Session = Depends(get_db)):
         id_users=tag.id_users
     )
     db.add(new_tag)
+    cache_sync.notify(db, "tag", new_tag.tag_code)  # otras réplicas lo pueden tener como desconocido
     db.commit()
     db.refresh(new_tag)
+    # Mantener sincronizado el registro en memoria usado por la lógica MQTT
+    tag_registry.put(TagInfo(new_tag.tag_code, user.id, user.name, user.lastname, type_tag.name))
     return new_tag
 
 @router.get("/", response_model=List[schemas.TagResponse])
@@ -47,6 +52,9 @@ def delete_tag(tag_id: int, db: Session = Depends(get_db)):
     tag = db.query(models.Tag).filter(models.Tag.id == tag_id).first()
     if not tag:
         raise HTTPException(status_code=404, detail="Tag no encontrado")
+    tag_code = tag.tag_code
     db.delete(tag)
+    cache_sync.notify(db, "tag", tag_code)
     db.commit()
+    tag_registry.invalidate(tag_code)
     return {"message": "Tag eliminado correctamente"}
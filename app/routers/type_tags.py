@@ -5,6 +5,8 @@ from sqlalchemy.orm import Session
 from typing import List
 from app import models, schemas
 from app.database import get_db
+from app.mqtt.cache_sync import cache_sync
+from app.mqtt.registry import tag_registry
 
 router = APIRouter(
     prefix="/type-tags",
@@ -41,5 +43,8 @@ def delete_type_tag(type_id: int, db: Session = Depends(get_db)):
     if not type_tag:
         raise HTTPException(status_code=404, detail="Tipo de tag no encontrado")
     db.delete(type_tag)
+    cache_sync.notify(db, "tags")
     db.commit()
+    # Los tags de este tipo dejan de resolverse: se descarta todo el registro
+    tag_registry.clear()
     return {"message": "Tipo de tag eliminado correctamente"}
@@ -5,6 +5,8 @@ from sqlalchemy.orm import Session
 from typing import List
 from app import models, schemas
 from app.database import get_db
+from app.mqtt.cache_sync import cache_sync
+from app.mqtt.registry import tag_registry
 from passlib.hash import bcrypt
 
 router = APIRouter(
@@ -48,5 +50,7 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     db.delete(user)
+    cache_sync.notify(db, "user", user_id)
     db.commit()
+    tag_registry.invalidate_user(user_id)
     return {"message": "Usuario eliminado correctamente"}
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Optional
 from datetime import datetime, date, time, timedelta
 
 # -------------------
@@ -180,3 +180,13 @@ class AlertResponse(AlertBase):
     id: int
     class Config:
         orm_mode = True
+
+
+# -------------------
+# DEAD LETTERS (MQTT)
+# -------------------
+class DeadLetterReplay(BaseModel):
+    ids: Optional[List[int]] = None   # entradas puntuales; si se omite, las más recientes
+    error: Optional[str] = None       # filtra por tipo de error (p. ej. "ValidationError")
+    limit: int = Field(100, ge=1, le=1000)
+    force: bool = False               # reinyecta también las ya reinyectadas
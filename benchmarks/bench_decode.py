@@ -0,0 +1,71 @@
+# benchmarks/bench_decode.py
+"""
+Micro-benchmark de decodificación de payloads TAGS.
+
+Compara la ruta anterior de _on_message (decode + strip + json.loads + TagsPayload(**data))
+con la validación directa de bytes de pydantic v2 y, si está instalado, orjson.
+
+Uso:
+    python -m benchmarks.bench_decode
+    python -m benchmarks.bench_decode --tags 500 --iterations 2000
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+
+from app.mqtt.payloads import TagsPayload, decode_tags_payload, orjson
+
+
+def build_payload(n_tags: int) -> bytes:
+    ts = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    data = {
+        "module_loto_code": "LOTO-RFID-V1-A01",
+        "tags": {
+            "CARD": [{"tag_code": f"1920021510051{i:05d}", "timestamp": ts} for i in range(n_tags)],
+            "LOTO": [{"tag_code": f"1920021510052{i:05d}", "timestamp": ts} for i in range(n_tags)],
+        },
+    }
+    return json.dumps(data).encode("utf-8")
+
+
+def legacy(raw: bytes) -> TagsPayload:
+    payload_raw = raw.decode("utf-8", errors="ignore").strip()
+    data = json.loads(payload_raw)
+    return TagsPayload(**data)
+
+
+def with_orjson(raw: bytes) -> TagsPayload:
+    return TagsPayload.model_validate(orjson.loads(raw))
+
+
+def bench(fn, raw: bytes, iterations: int) -> float:
+    fn(raw)  # calentamiento
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(raw)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de decodificación TAGS")
+    parser.add_argument("--tags", type=int, nargs="*", default=[1, 10, 100, 1000], help="tags por tipo (CARD y LOTO)")
+    parser.add_argument("--iterations", type=int, default=0, help="iteraciones por caso (0 = automático)")
+    args = parser.parse_args()
+
+    variants = [("legacy", legacy), ("pydantic_json", decode_tags_payload)]
+    if orjson is not None:
+        variants.append(("orjson", with_orjson))
+
+    print(f"{'tags':>6} {'bytes':>8} " + " ".join(f"{name:>16}" for name, _ in variants) + f" {'speedup':>8}")
+    for n_tags in args.tags:
+        raw = build_payload(n_tags)
+        iterations = args.iterations or max(20, 20000 // max(1, n_tags))
+        assert decode_tags_payload(raw) == legacy(raw)
+        times = [bench(fn, raw, iterations) for _, fn in variants]
+        cells = " ".join(f"{t * 1e6:>13.1f} us" for t in times)
+        print(f"{n_tags * 2:>6} {len(raw):>8} {cells} {times[0] / times[1]:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# benchmarks/bench_pipeline.py
+"""
+Benchmark de la ingesta completa sin broker ni PostgreSQL.
+
+Publica TAGS sintéticos en el broker en memoria (app.mqtt.transport.InMemoryBroker):
+transporte → MqttService._on_message → pool de workers → process_tags_payload
+sobre SQLite → publicación de STATUS/USERS. Reporta mensajes/segundo y percentiles
+de latencia de ingesta (encolado en el pool → fin del procesamiento).
+
+Cada módulo alterna escenarios (alerta, ok, mantenimiento, inactivo) con cuadrillas
+al azar y repite escaneos como lo hace un lector real, así que el camino rápido del
+snapshot también se ejercita.
+
+Uso:
+    python -m benchmarks.bench_pipeline                      # 1.000.000 mensajes
+    python -m benchmarks.bench_pipeline --messages 50000 --modules 100
+    python -m benchmarks.bench_pipeline --messages 50000 --rate 500   # carga abierta a tasa fija
+    MQTT_WORKERS=4 MQTT_BATCH_ENABLED=true python -m benchmarks.bench_pipeline
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import Base
+from app.mqtt.client import MqttService
+from app.mqtt.config import MQTT_APP_PREFIX, MQTT_WORKERS, MQTT_BATCH_ENABLED
+from app.mqtt.registry import tag_registry
+from app.mqtt.transport import InMemoryBroker, InMemoryTransport
+
+# Hora de lectura sintética: cada escaneo lleva timestamps nuevos, como un lector real
+# (un TAGS con lecturas idénticas se descartaría como redelivery QoS 1)
+EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def card_code(i: int) -> str:
+    return f"19200215100510{i:04d}"
+
+
+def loto_code(i: int) -> str:
+    return f"19200215100520{i:04d}"
+
+
+def module_code(i: int) -> str:
+    return f"BENCH-{i:04d}"
+
+
+def create_database(path: str, users: int, modules: int) -> sessionmaker:
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 60})
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+        dbapi_connection.execute("PRAGMA synchronous=NORMAL")
+
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    db = session_factory()
+    try:
+        card_type = models.TypeTag(name="CARD")
+        loto_type = models.TypeTag(name="LOTO")
+        db.add_all([card_type, loto_type])
+        db.flush()
+        for i in range(1, users + 1):
+            user = models.User(name=f"Usuario{i}", lastname=f"Bench{i}", email=f"bench{i}@example.com")
+            db.add(user)
+            db.flush()
+            db.add(models.Tag(tag_code=card_code(i), id_type_tag=card_type.id, id_users=user.id))
+            db.add(models.Tag(tag_code=loto_code(i), id_type_tag=loto_type.id, id_users=user.id))
+        for i in range(1, modules + 1):
+            db.add(models.Bahia(name=f"Bahía {i}", module_loto_code=module_code(i)))
+        db.commit()
+        tag_registry.load(db)
+    finally:
+        db.close()
+    return session_factory
+
+
+def scenario_frames(crew: List[int]) -> List[Tuple[List[str], List[str]]]:
+    cards = [card_code(u) for u in crew]
+    lotos = [loto_code(u) for u in crew]
+    return random.choice([
+        [(cards, []), ([], [])],              # alerta
+        [(cards, lotos)],                     # ok
+        [(cards, []), (cards, lotos), (cards, [])],  # mantenimiento
+        [([], [])],                           # inactivo
+    ])
+
+
+def encode(module: str, cards: List[str], lotos: List[str], scan: int) -> bytes:
+    ts = (EPOCH + timedelta(seconds=scan)).isoformat().replace("+00:00", "Z")
+    return json.dumps({
+        "module_loto_code": module,
+        "tags": {
+            "CARD": [{"tag_code": c, "timestamp": ts} for c in cards],
+            "LOTO": [{"tag_code": c, "timestamp": ts} for c in lotos],
+        },
+    }).encode("utf-8")
+
+
+class ModuleStream:
+    """Escaneos de un módulo: cada escaneo se repite con probabilidad `repeat`."""
+
+    def __init__(self, code: str, users: int, max_crew: int, repeat: float):
+        self.code = code
+        self.topic = f"{MQTT_APP_PREFIX}/{code}/TAGS"
+        self.users = users
+        self.max_crew = max_crew
+        self.repeat = repeat
+        self.frames: List[Tuple[List[str], List[str]]] = []
+        self.current: Tuple[List[str], List[str]] = ([], [])
+        self.scans = 0
+
+    def next(self) -> bytes:
+        self.scans += 1
+        if random.random() >= self.repeat:
+            if not self.frames:
+                crew = random.sample(range(1, self.users + 1), random.randint(1, self.max_crew))
+                self.frames = scenario_frames(crew)
+            self.current = self.frames.pop(0)
+        return encode(self.code, *self.current, self.scans)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la ingesta MQTT completa (broker en memoria + SQLite)")
+    parser.add_argument("--messages", type=int, default=1_000_000, help="mensajes TAGS a publicar")
+    parser.add_argument("--modules", type=int, default=200, help="módulos (bahías) simulados")
+    parser.add_argument("--users", type=int, default=200, help="usuarios sembrados")
+    parser.add_argument("--max-crew", type=int, default=6, help="tamaño máximo de cuadrilla")
+    parser.add_argument("--repeat", type=float, default=0.7, help="probabilidad de repetir el último escaneo")
+    parser.add_argument("--rate", type=float, default=0, help="mensajes/s ofrecidos (0 = lo más rápido posible)")
+    parser.add_argument("--max-inflight", type=int, default=64, help="mensajes pendientes antes de frenar al productor")
+    parser.add_argument("--seed", type=int, default=1, help="semilla aleatoria")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-pipeline-"), "bench.db")
+    session_factory = create_database(path, args.users, args.modules)
+
+    broker = InMemoryBroker()
+    backend = InMemoryTransport(broker, client_id="backend")
+    service = MqttService(transport=backend, session_factory=session_factory)
+    latencies: List[float] = []
+    service.pool.latency_observer = latencies.append
+
+    # Suscriptor de STATUS/USERS (como los ESP32)
+    replies: Dict[str, int] = {"STATUS": 0, "USERS": 0}
+    replies_lock = threading.Lock()
+
+    def on_reply(client, userdata, msg):
+        with replies_lock:
+            replies[msg.topic.rsplit("/", 1)[-1]] += 1
+
+    devices = InMemoryTransport(broker, client_id="devices")
+    devices.on_message = on_reply
+    devices.connect()
+    devices.subscribe([(f"{MQTT_APP_PREFIX}/+/STATUS", 1), (f"{MQTT_APP_PREFIX}/+/USERS", 1)])
+    devices.loop_start()
+    service.start()
+    while not backend.is_connected():
+        time.sleep(0.01)
+    time.sleep(0.1)
+
+    streams = [ModuleStream(module_code(i), args.users, args.max_crew, args.repeat) for i in range(1, args.modules + 1)]
+    print(
+        f"Pipeline: {args.messages} mensajes, {args.modules} módulos, {args.users} usuarios, "
+        f"workers={MQTT_WORKERS}, lotes={'sí' if MQTT_BATCH_ENABLED else 'no'}, BD={path}"
+    )
+
+    start = time.perf_counter()
+    report_every = max(1, args.messages // 10)
+    for n in range(args.messages):
+        if args.rate:
+            delay = start + n / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        stream = streams[n % len(streams)]
+        devices.publish(stream.topic, stream.next(), qos=1)
+        if n % 16 == 0:
+            # Contrapresión: no adelantarse más de max_inflight mensajes al backend
+            while backend.pending() + service.reorder.stats()["held"] + service.pool.stats()["queue_depth"] > args.max_inflight:
+                time.sleep(0.001)
+        if n and n % report_every == 0:
+            elapsed = time.perf_counter() - start
+            print(f"  {n:>9} publicados, {len(latencies):>9} procesados ({len(latencies) / elapsed:,.0f} msg/s)")
+
+    while len(latencies) + service.pool.stats()["dropped"] + service.reorder.stats()["stale"] < args.messages:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    stats = service.stats()
+    service.stop()
+    devices.loop_stop()
+
+    latencies.sort()
+    print(f"\nProcesados: {len(latencies)} en {elapsed:.1f}s → {len(latencies) / elapsed:,.0f} msg/s")
+    print(
+        "Latencia de ingesta (ms): "
+        f"p50={percentile(latencies, 50) * 1000:.2f} "
+        f"p90={percentile(latencies, 90) * 1000:.2f} "
+        f"p99={percentile(latencies, 99) * 1000:.2f} "
+        f"max={latencies[-1] * 1000 if latencies else 0:.2f}"
+    )
+    print(f"Respuestas: STATUS={replies['STATUS']} USERS={replies['USERS']}")
+    print(
+        f"Descartados={stats['pool']['dropped']} COMMIT={stats['transactions']['commits']} "
+        f"snapshots sin cambios={stats['snapshots']['unchanged']} broker={broker.stats()}"
+    )
+    outbox = stats["publish_queue"]
+    print(
+        f"Publicación: omitidas sin cambios={stats['publish_dedup']['suppressed']} "
+        f"reemplazadas en cola={outbox['superseded']} enviadas={outbox['sent']} "
+        f"confirmadas={outbox['completed']} fallidas={outbox['failed'] + outbox['timeouts'] + outbox['dropped']}"
+    )
+    print(f"Reorden: ventana={stats['reorder']['window_ms']} ms reordenados={stats['reorder']['reordered']} atrasados={stats['reorder']['stale']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,11 @@ import os
 import ssl
 import json
 import time
+import heapq
 import random
+import argparse
+import threading
+import urllib.request
 from datetime import datetime
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
@@ -20,6 +24,8 @@ MQTT_KEEPALIVE = int(os.getenv("MQTT_SIM_KEEPALIVE", 30))
 MQTT_QOS = int(os.getenv("MQTT_SIM_QOS", 1))
 MQTT_PREFIX = os.getenv("MQTT_SIM_PREFIX", "APP/LOTO_RFID")
 MQTT_CA_CERT = os.getenv("MQTT_SIM_CA_CERT", "")
+# /metrics del backend (modo carga contra un broker real): latencia de ingesta por mensaje
+MQTT_SIM_METRICS_URL = os.getenv("MQTT_SIM_METRICS_URL", "")
 MODULE_CODE = "LOTO-RFID-V1-A01"
 
 # -------------------------
@@ -167,13 +173,351 @@ def simulate_realistic(client, total_cycles=6):
 
 
 # -------------------------
-# MAIN
+# MODO CARGA (N módulos)
 # -------------------------
-if __name__ == "__main__":
-    client = mqtt.Client(client_id=MQTT_SIM_CLIENT_ID, clean_session=True)
-    client.on_connect = on_connect
-    client.on_message = on_message
+# Usuarios de app/seed.py: CARD 19200215100510NNNN / LOTO 19200215100520NNNN
+SEED_USERS = [
+    {"name": f"Usuario {i}", "CARD": f"19200215100510{i:04d}", "LOTO": f"19200215100520{i:04d}"}
+    for i in range(1, 21)
+]
+
+
+def load_module_codes(n):
+    return [f"LOTO-RFID-V1-A{i:02d}" for i in range(1, n + 1)]
+
+
+# Cada escenario de carga reproduce uno de los escenarios anteriores como
+# secuencia de escaneos (cards, lotos), sin pausas.
+def frames_alert(crew):
+    return [([u["CARD"] for u in crew], []), ([], [])]
+
+
+def frames_ok(crew):
+    return [([u["CARD"] for u in crew], [u["LOTO"] for u in crew])]
+
+
+def frames_mantenimiento(crew):
+    cards = [u["CARD"] for u in crew]
+    return [(cards, []), (cards, [u["LOTO"] for u in crew]), (cards, [])]
+
+
+def frames_idle(crew):
+    return [([], [])]
+
+
+LOAD_SCENARIOS = {
+    "alert": frames_alert,
+    "ok": frames_ok,
+    "mantenimiento": frames_mantenimiento,
+    "idle": frames_idle,
+}
+
+
+def module_frames(rng, max_crew, max_hold):
+    """Escaneos infinitos de un módulo: escenarios al azar, cada escaneo repetido 1..max_hold veces."""
+    names = list(LOAD_SCENARIOS)
+    while True:
+        crew = rng.sample(SEED_USERS, rng.randint(1, min(max_crew, len(SEED_USERS))))
+        for cards, lotos in LOAD_SCENARIOS[rng.choice(names)](crew):
+            for _ in range(rng.randint(1, max_hold)):
+                yield cards, lotos
+
+
+def tags_payload(module_code, cards, lotos):
+    ts = datetime.utcnow().isoformat() + "Z"
+    return {
+        "module_loto_code": module_code,
+        "tags": {
+            "CARD": [{"tag_code": code, "timestamp": ts} for code in cards],
+            "LOTO": [{"tag_code": code, "timestamp": ts} for code in lotos],
+        },
+    }
 
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+INGEST_HISTOGRAM = "mqtt_ingest_latency_seconds"
+
+
+def parse_histogram(text, name):
+    """[(le, acumulado)] de un histograma sin etiquetas en formato de exposición de Prometheus."""
+    prefix = f'{name}_bucket{{le="'
+    buckets = []
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            bound, value = line[len(prefix):].split('"}', 1)
+            buckets.append((float(bound), int(float(value))))
+    return sorted(buckets)
+
+
+def histogram_quantile(q, buckets):
+    """Cuantil por interpolación lineal dentro del bucket (como histogram_quantile de Prometheus)."""
+    if not buckets or buckets[-1][1] == 0:
+        return 0.0
+    rank = q * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                return lower_bound  # por encima del último bucket finito
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+class IngestLatency:
+    """
+    Latencia de ingesta de cada TAGS desde el histograma mqtt_ingest_latency_seconds del
+    backend (encolado → fin del procesamiento): cuenta todos los mensajes, también los
+    escaneos repetidos que no generan respuesta. Se lee antes y después de la carga y se
+    usa la diferencia; `source` retorna el texto de /metrics.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.before = []
+
+    def start(self):
+        self.before = parse_histogram(self.source(), INGEST_HISTOGRAM)
+
+    def report(self):
+        before = dict(self.before)
+        after = parse_histogram(self.source(), INGEST_HISTOGRAM)
+        buckets = [(bound, count - before.get(bound, 0)) for bound, count in after]
+        if not buckets or buckets[-1][1] == 0:
+            print("   Latencia de ingesta: sin mensajes en el histograma")
+            return
+        print(
+            "   Latencia de ingesta del backend (ms, por bucket): "
+            f"p50={histogram_quantile(0.5, buckets) * 1000:.1f} "
+            f"p90={histogram_quantile(0.9, buckets) * 1000:.1f} "
+            f"p99={histogram_quantile(0.99, buckets) * 1000:.1f} (n={buckets[-1][1]})"
+        )
+
+
+def fetch_metrics(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return response.read().decode("utf-8")
+
+
+class LoadStats:
+    """
+    Respuestas del backend y latencia extremo a extremo de los escaneos respondidos:
+    un USERS trae los tag_code del escaneo que lo originó, así que se empareja con el
+    envío pendiente más antiguo del módulo con el mismo conjunto de tags. Sólo los
+    escaneos que cambian el snapshot generan USERS (los repetidos se descartan al llegar
+    una respuesta posterior), así que es una muestra parcial: la latencia de todos los
+    mensajes la da IngestLatency. STATUS sólo se publica al cambiar de estado, por lo que
+    se cuenta pero no se usa para la latencia.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}  # módulo → [(frozenset tags, enviado_en)]
+        self.latencies = []
+        self.sent = 0
+        self.users_received = 0
+        self.status_received = {}
+        self.last_response = time.perf_counter()
+
+    def on_sent(self, module_code, cards, lotos):
+        with self.lock:
+            self.sent += 1
+            self.pending.setdefault(module_code, []).append((frozenset(cards) | frozenset(lotos), time.perf_counter()))
+
+    def on_message(self, client, userdata, msg):
+        now = time.perf_counter()
+        try:
+            payload = json.loads(msg.payload.decode())
+        except Exception:
+            return
+        module_code = msg.topic.split("/")[-2]
+        with self.lock:
+            self.last_response = now
+            if msg.topic.endswith("/STATUS"):
+                status = payload.get("status")
+                self.status_received[status] = self.status_received.get(status, 0) + 1
+                return
+            if not msg.topic.endswith("/USERS"):
+                return
+            self.users_received += 1
+            key = frozenset(t["tag_code"] for t in payload.get("tags_info", []))
+            pending = self.pending.get(module_code, [])
+            for i, (tags, sent_at) in enumerate(pending):
+                if tags == key:
+                    self.latencies.append(now - sent_at)
+                    del pending[: i + 1]
+                    break
+
+    def report(self, elapsed):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            print("\n📊 Resultado de la prueba de carga")
+            print(f"   Enviados: {self.sent} TAGS en {elapsed:.1f}s → {self.sent / elapsed:.1f} msg/s")
+            print(f"   Respuestas USERS: {self.users_received} ({self.users_received / elapsed:.1f} msg/s)")
+            print(f"   Respuestas STATUS: {sum(self.status_received.values())} {self.status_received}")
+            if latencies:
+                print(
+                    f"   Latencia extremo a extremo de los escaneos con USERS ({len(latencies)}/{self.sent}, ms): "
+                    f"p50={percentile(latencies, 50) * 1000:.1f} "
+                    f"p90={percentile(latencies, 90) * 1000:.1f} "
+                    f"p99={percentile(latencies, 99) * 1000:.1f} "
+                    f"max={latencies[-1] * 1000:.1f}"
+                )
+
+
+def run_load(client, stats, modules, rate, duration, max_crew, max_hold, seed=None):
+    """Publica TAGS de `modules` módulos, cada uno a `rate` escaneos por segundo, durante `duration` s."""
+    rng = random.Random(seed)
+    codes = load_module_codes(modules)
+    frames = {code: module_frames(random.Random(rng.random()), max_crew, max_hold) for code in codes}
+    period = 1.0 / rate
+    start = time.perf_counter()
+    # Desfase inicial para no publicar todos los módulos en el mismo instante
+    schedule = [(start + rng.random() * period, code) for code in codes]
+    heapq.heapify(schedule)
+    end = start + duration
+
+    while schedule:
+        due, code = heapq.heappop(schedule)
+        if due >= end:
+            break
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        cards, lotos = next(frames[code])
+        stats.on_sent(code, cards, lotos)
+        client.publish(f"{MQTT_PREFIX}/{code}/TAGS", json.dumps(tags_payload(code, cards, lotos)), qos=MQTT_QOS)
+        heapq.heappush(schedule, (due + period, code))
+    return time.perf_counter() - start
+
+
+def build_local_backend(modules):
+    """
+    Levanta el backend en este proceso sobre un InMemoryBroker y una BD SQLite temporal
+    sembrada con los usuarios/tags de app/seed.py y una bahía por módulo.
+    """
+    import tempfile
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+    from app.database import Base
+    from app import models
+    from app.mqtt.client import MqttService
+    from app.mqtt.transport import InMemoryBroker, InMemoryTransport
+    from app.mqtt.registry import tag_registry
+    from app.logger import setup_logging
+
+    setup_logging(os.getenv("LOG_LEVEL", "WARNING"))
+
+    path = os.path.join(tempfile.mkdtemp(prefix="loto-load-"), "load.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    db = session_factory()
+    try:
+        card_type = models.TypeTag(name="CARD")
+        loto_type = models.TypeTag(name="LOTO")
+        db.add_all([card_type, loto_type])
+        db.flush()
+        for i, user in enumerate(SEED_USERS, start=1):
+            row = models.User(name=user["name"], lastname=str(i), email=f"user{i}@example.com")
+            db.add(row)
+            db.flush()
+            db.add(models.Tag(tag_code=user["CARD"], id_type_tag=card_type.id, id_users=row.id))
+            db.add(models.Tag(tag_code=user["LOTO"], id_type_tag=loto_type.id, id_users=row.id))
+        for i, code in enumerate(load_module_codes(modules), start=1):
+            db.add(models.Bahia(name=f"Bahía {i}", module_loto_code=code))
+        db.commit()
+        tag_registry.load(db)
+    finally:
+        db.close()
+
+    broker = InMemoryBroker()
+    service = MqttService(transport=InMemoryTransport(broker, client_id="backend"), session_factory=session_factory)
+    service.start()
+    print(f"🧪 Backend local iniciado (SQLite en {path})")
+    return broker, service
+
+
+def wait_for_drain(stats, service=None, idle=1.0, timeout=30.0):
+    """Espera a que el backend vacíe sus colas y deje de responder."""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        queued = service.pool.stats()["queue_depth"] if service else 0
+        with stats.lock:
+            quiet = time.perf_counter() - stats.last_response
+        if queued == 0 and quiet >= idle:
+            return
+        time.sleep(0.1)
+
+
+def main_load(args):
+    service = None
+    if args.local:
+        broker, service = build_local_backend(args.modules)
+        from app.mqtt.transport import InMemoryTransport
+        client = InMemoryTransport(broker, client_id=f"{MQTT_SIM_CLIENT_ID}-load")
+    else:
+        client = create_client(f"{MQTT_SIM_CLIENT_ID}-load")
+
+    ingest = None
+    if service:
+        from app.metrics import registry
+        ingest = IngestLatency(registry.render)
+    elif args.metrics_url:
+        ingest = IngestLatency(lambda: fetch_metrics(args.metrics_url))
+    else:
+        print("⚠️ Sin --metrics-url: sólo se mide la latencia de los escaneos con respuesta USERS")
+
+    stats = LoadStats()
+    client.on_message = stats.on_message
+    client.connect(MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE)
+    client.subscribe([(f"{MQTT_PREFIX}/+/STATUS", MQTT_QOS), (f"{MQTT_PREFIX}/+/USERS", MQTT_QOS)])
+    client.loop_start()
+    time.sleep(0.5)
+    if ingest:
+        ingest.start()
+
+    print(
+        f"🚚 Carga: {args.modules} módulos × {args.rate} escaneos/s durante {args.duration}s "
+        f"(cuadrillas de hasta {args.max_crew} personas)"
+    )
+    elapsed = run_load(client, stats, args.modules, args.rate, args.duration, args.max_crew, args.max_hold, args.seed)
+    wait_for_drain(stats, service)
+    stats.report(elapsed)
+    if ingest:
+        ingest.report()
+
+    if service:
+        transactions = service.stats()["transactions"]
+        pool = service.stats()["pool"]
+        print(
+            f"   Backend: {transactions['messages']} mensajes procesados, {transactions['commits']} COMMIT, "
+            f"{pool['dropped']} descartados"
+        )
+        service.stop()
+    client.loop_stop()
+    client.disconnect()
+
+
+# -------------------------
+# MAIN
+# -------------------------
+def create_client(client_id):
+    client = mqtt.Client(client_id=client_id, clean_session=True)
     if MQTT_USER:
         client.username_pw_set(MQTT_USER, MQTT_PASSWORD or None)
 
@@ -186,6 +530,35 @@ if __name__ == "__main__":
             tls_version=ssl.PROTOCOL_TLSv1_2,
         )
         print("🔒 TLS habilitado")
+    return client
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulador de módulos LOTO RFID")
+    parser.add_argument("--load", action="store_true", help="modo carga: N módulos a una tasa fija")
+    parser.add_argument("--local", action="store_true", help="broker y backend en memoria (sin red)")
+    parser.add_argument("--modules", type=int, default=50, help="módulos simulados")
+    parser.add_argument("--rate", type=float, default=2.0, help="escaneos por segundo por módulo")
+    parser.add_argument("--duration", type=float, default=30.0, help="segundos de carga")
+    parser.add_argument("--max-crew", type=int, default=6, help="tamaño máximo de cuadrilla")
+    parser.add_argument("--max-hold", type=int, default=3, help="repeticiones máximas de cada escaneo")
+    parser.add_argument("--seed", type=int, default=None, help="semilla aleatoria")
+    parser.add_argument(
+        "--metrics-url", default=MQTT_SIM_METRICS_URL,
+        help="URL de /metrics del backend para la latencia de ingesta (con --local se lee en proceso)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.load:
+        main_load(args)
+        raise SystemExit(0)
+
+    client = create_client(MQTT_SIM_CLIENT_ID)
+    client.on_connect = on_connect
+    client.on_message = on_message
 
     print(f"🔗 Conectando al broker {MQTT_HOST}:{MQTT_PORT} ...")
     client.connect(MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE)
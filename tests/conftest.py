@@ -0,0 +1,89 @@
+# tests/conftest.py
+import os
+import tempfile
+
+# Antes de importar la app: sin red, sin tabla tag_reads y dead letters en un directorio temporal
+os.environ.setdefault("MQTT_TRANSPORT", "memory")
+os.environ.setdefault("TAG_READS_ENABLED", "false")
+os.environ.setdefault("DEAD_LETTER_DIR", os.path.join(tempfile.mkdtemp(), "dead_letters"))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import models
+from app.database import Base
+from app.mqtt.alert_index import alert_index
+from app.mqtt.bay_state import bay_state_view
+from app.mqtt.idempotency import recent_messages
+from app.mqtt.payloads import TagsPayload
+from app.mqtt.presence import presence_tracker
+from app.mqtt.publisher import publish_dedup
+from app.mqtt.registry import tag_registry
+from app.mqtt.snapshots import snapshot_store
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def seeded(session_factory):
+    """5 usuarios (CARD C<i>, LOTO L<i>) y 3 bahías con módulos M1..M3; estado global en blanco."""
+    db = session_factory()
+    card, loto = models.TypeTag(name="CARD"), models.TypeTag(name="LOTO")
+    db.add_all([card, loto])
+    db.flush()
+    for i in range(1, 6):
+        user = models.User(name=f"U{i}", lastname=f"L{i}", email=f"u{i}@example.com")
+        db.add(user)
+        db.flush()
+        db.add(models.Tag(tag_code=f"C{i}", id_type_tag=card.id, id_users=user.id))
+        db.add(models.Tag(tag_code=f"L{i}", id_type_tag=loto.id, id_users=user.id))
+    for b in range(1, 4):
+        db.add(models.Bahia(name=f"Bahía {b}", module_loto_code=f"M{b}"))
+    db.commit()
+    snapshot_store.clear()
+    recent_messages.clear()
+    publish_dedup.clear()
+    tag_registry.load(db)
+    alert_index.rebuild(db)
+    presence_tracker.load(db)
+    bay_state_view.rebuild(db)
+    db.close()
+    return session_factory
+
+
+def ts(second: int) -> str:
+    return f"2025-01-01T00:{second // 60:02d}:{second % 60:02d}Z"
+
+
+def tags_payload(module: str, cards=(), lotos=()) -> TagsPayload:
+    """TAGS del módulo; cards/lotos: códigos o pares (código, segundo del timestamp)."""
+    def reads(items):
+        return [
+            {"tag_code": c[0], "timestamp": ts(c[1])} if isinstance(c, tuple) else {"tag_code": c, "timestamp": ts(0)}
+            for c in items
+        ]
+    return TagsPayload(module_loto_code=module, tags={"CARD": reads(cards), "LOTO": reads(lotos)})
+
+
+def tags_bytes(module: str, cards=(), lotos=()) -> bytes:
+    return tags_payload(module, cards, lotos).model_dump_json().encode()
@@ -0,0 +1,51 @@
+# tests/test_alert_index.py
+from datetime import datetime, timedelta, timezone
+
+from app import models
+from app.mqtt.alert_index import AlertSuppressionIndex, alert_index
+from app.routers.alerts import resolve_alert
+
+NOW = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def test_window_suppresses_repeats_and_slides():
+    index = AlertSuppressionIndex(window_minutes=5)
+    key = (1, 1, 1)
+    assert index.reserve(key, NOW)
+    assert not index.reserve(key, NOW + timedelta(minutes=4))
+    assert not index.reserve(key, NOW + timedelta(minutes=8))    # renovada a los 4
+    assert index.reserve(key, NOW + timedelta(minutes=14))
+    index.release([key])
+    assert index.reserve(key, NOW + timedelta(minutes=15))
+    assert index.stats()["suppressed"] == 2
+
+
+def test_rebuild_loads_open_alerts(seeded, db):
+    user = db.query(models.User).first()
+    bay = db.query(models.Bahia).first()
+    maintenance = models.Maintenance(name="m", id_bahias=bay.id, start_time=datetime(2025, 1, 1))
+    db.add(maintenance)
+    db.flush()
+    db.add(models.Alert(alert_time=NOW, id_maintenance=maintenance.id, id_users=user.id, id_types_alerts=2, resolved=False))
+    db.commit()
+    index = AlertSuppressionIndex(window_minutes=5)
+    assert index.rebuild(db, now=NOW) == 1
+    assert not index.reserve((user.id, bay.id, 2), NOW)
+
+
+def test_resolving_alert_releases_its_key(seeded, db):
+    user = db.query(models.User).first()
+    bay = db.query(models.Bahia).first()
+    maintenance = models.Maintenance(name="m", id_bahias=bay.id, start_time=datetime(2025, 1, 1))
+    db.add(maintenance)
+    db.flush()
+    alert = models.Alert(alert_time=NOW, id_maintenance=maintenance.id, id_users=user.id, id_types_alerts=2, resolved=False)
+    db.add(alert)
+    db.commit()
+    key = (user.id, bay.id, 2)
+    now = datetime.now(timezone.utc)
+    assert alert_index.reserve(key, now)
+    resolve_alert(alert.id, db)
+    # Una nueva infracción tras resolver vuelve a generar alerta
+    assert alert_index.reserve(key, now)
+    assert not alert_index.reserve(key, now)
@@ -0,0 +1,48 @@
+# tests/test_async_client.py
+import asyncio
+
+import paho.mqtt.client as mqtt
+
+from app.mqtt.async_client import AsyncMqttService, _PahoAsyncioBridge
+from app.mqtt.transport import InMemoryBroker, InMemoryTransport
+
+
+def test_async_service_has_no_thread_pool():
+    service = AsyncMqttService(transport=InMemoryTransport(InMemoryBroker(), "backend"), session_factory=lambda: None)
+    assert service.pool is None
+    assert service.stats()["pool"]["mode"] == "asyncio"
+
+
+def test_bridge_connects_outside_the_event_loop():
+    async def scenario():
+        received = asyncio.Event()
+
+        async def on_client(reader, writer):
+            if await reader.read(1) == b"\x10":  # paquete CONNECT
+                received.set()
+            writer.close()
+
+        server = await asyncio.start_server(on_client, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id="test-bridge")
+        bridge = _PahoAsyncioBridge(asyncio.get_running_loop(), client)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        task = asyncio.create_task(ticker())
+        bridge.start("127.0.0.1", port, 60)  # no bloquea: el connect corre en el executor
+        try:
+            await asyncio.wait_for(received.wait(), 5)
+        finally:
+            bridge.stop()
+            task.cancel()
+            server.close()
+            await server.wait_closed()
+        return ticks
+
+    assert asyncio.run(scenario()) > 0
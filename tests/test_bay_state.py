@@ -0,0 +1,48 @@
+# tests/test_bay_state.py
+from datetime import datetime
+
+from app import models
+from app.mqtt.bay_state import BayStateView
+from app.mqtt.presence import presence_tracker
+from app.routers.alerts import resolve_alert
+
+
+def _open_maintenance_with_alert(db) -> models.Alert:
+    bay = db.query(models.Bahia).filter_by(module_loto_code="M1").one()
+    bay.module_loto_status = "online"
+    maintenance = models.Maintenance(name="m", id_bahias=bay.id, start_time=datetime(2025, 1, 1), end_time=datetime(2025, 1, 1, 1))
+    db.add(maintenance)
+    db.flush()
+    alert = models.Alert(alert_time=datetime(2025, 1, 1), id_maintenance=maintenance.id, resolved=False)
+    db.add(alert)
+    db.commit()
+    presence_tracker.load(db)
+    return alert
+
+
+def test_rebuild_keeps_version_when_rows_do_not_change(seeded, db):
+    view = BayStateView(refresh_interval=0)
+    view.rebuild(db)
+    version, rows = view.rows()
+    assert len(rows) == 3
+    view.rebuild(db)
+    assert view.rows() == (version, rows)
+    db.query(models.Bahia).filter_by(module_loto_code="M2").update({"name": "Bahía 20"})
+    db.commit()
+    view.rebuild(db)
+    assert view.rows()[0] > version
+
+
+def test_resolving_alert_invalidates_view(seeded, db, monkeypatch):
+    import app.routers.alerts as alerts
+    view = BayStateView(refresh_interval=0)
+    monkeypatch.setattr(alerts, "bay_state_view", view)
+    alert = _open_maintenance_with_alert(db)
+    view.refresh(db)
+    version, rows = view.rows()
+    assert rows[0].status == "alert"
+    assert not view.refresh(db)
+    resolve_alert(alert.id, db)
+    assert view.refresh(db)
+    new_version, rows = view.rows()
+    assert new_version > version and rows[0].status == "available"
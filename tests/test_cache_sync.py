@@ -0,0 +1,113 @@
+# tests/test_cache_sync.py
+import json
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from app.mqtt.alert_index import alert_index
+from app.mqtt.bay_state import bay_state_view
+from app.mqtt.cache_sync import CacheSync
+from app.mqtt.payloads import StatusPayload
+from app.mqtt.presence import presence_tracker
+from app.mqtt.registry import tag_registry
+from app.mqtt.snapshots import snapshot_store
+
+
+def remote(*events) -> str:
+    return json.dumps({"origin": "otra-replica", "events": [list(e) for e in events]})
+
+
+def test_notify_is_discarded_on_rollback_and_consumed_on_commit(db):
+    sync = CacheSync(enabled=True, origin="esta")
+    db.execute(text("SELECT 1"))  # transacción en curso, como en la ingesta y los routers
+    sync.notify(db, "tag", "C1")
+    assert db.info["cache_sync"] == [["tag", "C1"]]
+    db.rollback()
+    assert "cache_sync" not in db.info
+    db.execute(text("SELECT 1"))
+    sync.notify(db, "tag", "C1")
+    db.commit()  # SQLite: no hay NOTIFY, pero el aviso no queda para la próxima transacción
+    assert "cache_sync" not in db.info
+
+
+def test_disabled_sync_records_nothing(db):
+    CacheSync(enabled=False).notify(db, "tag", "C1")
+    assert "cache_sync" not in db.info
+
+
+def test_own_notifications_are_ignored(seeded, db):
+    sync = CacheSync(enabled=True, origin="esta")
+    version = tag_registry.version
+    payload = json.dumps({"origin": "esta", "events": [["tag", "C1"], ["tags", None]]})
+    assert sync.apply(payload) == 0
+    assert tag_registry.version == version
+    assert sync.stats()["received"] == 0
+
+
+def test_remote_tag_events_invalidate_registry(seeded, db):
+    sync = CacheSync(enabled=True, origin="esta")
+    tag_registry.lookup(db, ["C1", "C2", "X9"])
+    version = tag_registry.version
+    assert sync.apply(remote(("tag", "X9"), ("user", 2))) == 2
+    assert tag_registry.version == version + 2
+    hits = tag_registry.stats()["hits"]
+    tag_registry.lookup(db, ["C1", "C2", "X9"])
+    assert tag_registry.stats()["hits"] == hits + 1  # sólo C1 sigue en caché
+    sync.apply(remote(("tags", None)))
+    assert tag_registry.stats()["size"] == 0
+
+
+def test_remote_alerts_feed_suppression_index(seeded):
+    sync = CacheSync(enabled=True, origin="esta")
+    key = (1, 2, 3)
+    sync.apply(remote(("alert", key)))
+    now = datetime.now(timezone.utc)
+    assert not alert_index.reserve(key, now)
+    sync.apply(remote(("alert_resolved", key)))
+    assert alert_index.reserve(key, now)
+
+
+def test_remote_bay_event_drops_snapshot_and_view(seeded, db):
+    sync = CacheSync(enabled=True, origin="esta")
+    status = StatusPayload(module_loto_code="M1", status="ok", message="")
+    snapshot_store.commit("M1", ["C1"], ["L1"], None, status)
+    snapshot_store.commit("M2", ["C2"], ["L2"], None, status)
+    assert not bay_state_view.refresh(db)
+    sync.apply(remote(("bay", "M1")))
+    assert snapshot_store.get("M1") is None
+    assert snapshot_store.get("M2") is not None
+    assert bay_state_view.refresh(db)
+
+
+def test_remote_presence_is_adopted_without_rewriting(seeded, db):
+    sync = CacheSync(enabled=True, origin="esta")
+    status = "online" if presence_tracker.status("M1") != "online" else "offline"
+    sync.apply(remote(("presence", ["M1", status])))
+    assert presence_tracker.status("M1") == status
+    assert presence_tracker.stats()["pending"] == 0
+    assert presence_tracker.flush(db) == 0
+    # Repetido: nada cambia
+    transitions = presence_tracker.stats()["transitions"]
+    sync.apply(remote(("presence", ["M1", status])))
+    assert presence_tracker.stats()["transitions"] == transitions
+
+
+def test_presence_flush_reports_before_commit(seeded, db):
+    seen = []
+    presence_tracker.on_flush = lambda session, by_status: seen.append((session.in_transaction(), by_status))
+    try:
+        status = "online" if presence_tracker.status("M1") != "online" else "offline"
+        presence_tracker.observe("M1", status)
+        assert presence_tracker.flush(db) == 1
+    finally:
+        presence_tracker.on_flush = None
+    assert seen == [(True, {status: ["M1"]})]
+
+
+def test_large_notifications_are_split():
+    sync = CacheSync(enabled=True, origin="esta")
+    events = [["tag", f"TAG-{i:06d}"] for i in range(2000)]
+    payloads = sync._payloads(events)
+    assert len(payloads) > 1
+    assert all(len(p.encode("utf-8")) <= 7500 for p in payloads)
+    assert sum(len(json.loads(p)["events"]) for p in payloads) == 2000
@@ -0,0 +1,81 @@
+# tests/test_dead_letter.py
+import os
+
+from app.mqtt.dead_letter import DeadLetterStore
+
+
+def make_store(directory, **kwargs):
+    options = {"segment_bytes": 1 << 20, "max_segments": 4, "queue_size": 100, "flush_interval": 60}
+    options.update(kwargs)
+    store = DeadLetterStore(directory=str(directory), **options)
+    os.makedirs(store.directory, exist_ok=True)
+    return store
+
+
+def test_list_pages_newest_first_and_filters(tmp_path):
+    store = make_store(tmp_path)
+    for i in range(5):
+        store.record("APP/LOTO_RFID/M1/TAGS", b"bad%d" % i, "ValueError" if i % 2 else "UnknownModuleError")
+    assert store.flush() == 5
+    assert [e["id"] for e in store.list(limit=2)] == [5, 4]
+    assert [e["id"] for e in store.list(limit=2, before_id=4)] == [3, 2]
+    assert [e["id"] for e in store.list(error="ValueError")] == [4, 2]
+    assert store.payload(store.get([3])[0]) == b"bad2"
+    assert store.count() == {"total": 5, "by_error": {"UnknownModuleError": 3, "ValueError": 2}, "replayed": 0, "pending": 0}
+
+
+def test_repeated_key_is_recorded_once(tmp_path):
+    store = make_store(tmp_path)
+    for _ in range(3):
+        store.record("t", b"x", "UnknownModuleError", key=b"k")
+    store.flush()
+    assert store.count()["total"] == 1
+    assert store.stats()["repeated"] == 2
+
+
+def test_rotation_drops_oldest_segment_from_index_and_counts(tmp_path):
+    store = make_store(tmp_path, segment_bytes=200, max_segments=2)
+    for i in range(12):
+        store.record("t", b"payload-%02d" % i, "ValueError")
+        store.flush()
+    ids = [e["id"] for e in store.list(limit=100)]
+    assert len(os.listdir(tmp_path)) == 2
+    assert ids == sorted(ids, reverse=True) and ids[0] == 12
+    assert store.count()["total"] == len(ids) < 12
+    assert store.get([1]) == []
+
+
+def test_index_is_rebuilt_from_disk(tmp_path):
+    store = make_store(tmp_path, segment_bytes=200)
+    for i in range(6):
+        store.record("t", b"p%d" % i, "ValueError")
+    store.flush()
+    store.claim(ids=[2])
+    reloaded = make_store(tmp_path, segment_bytes=200)
+    assert [e["id"] for e in reloaded.list()] == [6, 5, 4, 3, 2, 1]
+    assert reloaded.count()["replayed"] == 1
+    reloaded.record("t", b"p6", "ValueError")
+    reloaded.flush()
+    assert reloaded.list(limit=1)[0]["id"] == 7
+
+
+def test_claim_marks_entries_as_replayed(tmp_path):
+    store = make_store(tmp_path)
+    for i in range(3):
+        store.record("t", b"p%d" % i, "ValueError")
+    store.flush()
+    entries, skipped = store.claim(limit=2)
+    assert [e["id"] for e in entries] == [2, 3] and skipped == []
+    entries, skipped = store.claim(limit=2)
+    assert [e["id"] for e in entries] == [1] and skipped == []
+    entries, skipped = store.claim(ids=[1, 3])
+    assert entries == [] and skipped == [1, 3]
+    entries, _ = store.claim(ids=[3], force=True)
+    assert [e["id"] for e in entries] == [3]
+    assert [e["id"] for e in store.list(replayed=False)] == []
+
+
+def test_reads_do_not_create_directory(tmp_path):
+    store = DeadLetterStore(directory=str(tmp_path / "missing"))
+    assert store.list() == [] and store.count()["total"] == 0
+    assert not os.path.exists(store.directory)
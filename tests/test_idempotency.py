@@ -0,0 +1,62 @@
+# tests/test_idempotency.py
+from app.mqtt.client import MqttService
+from app.mqtt.idempotency import RecentMessageIndex, message_key, recent_messages
+from app.mqtt.presence import presence_tracker
+from app.mqtt.transport import InMemoryBroker, InMemoryTransport
+
+from conftest import tags_bytes, tags_payload
+
+
+def _service(session_factory) -> MqttService:
+    return MqttService(transport=InMemoryTransport(InMemoryBroker(), "backend"), session_factory=session_factory)
+
+
+def test_message_key_ignores_read_order_and_depends_on_timestamps():
+    a = tags_payload("M1", cards=[("C1", 1)], lotos=[("L1", 2), ("L2", 3)])
+    b = tags_payload("M1", cards=[("C1", 1)], lotos=[("L2", 3), ("L1", 2)])
+    c = tags_payload("M1", cards=[("C1", 1)], lotos=[("L1", 2), ("L2", 4)])
+    assert message_key(a) == message_key(b)
+    assert message_key(a) != message_key(c)
+    assert message_key(tags_payload("M1")) is None
+
+
+def test_index_reserve_add_release_and_ttl():
+    index = RecentMessageIndex(ttl=10, max_entries=2)
+    assert index.reserve(b"a", now=0)
+    assert not index.reserve(b"a", now=5)
+    index.release([b"a", None])
+    assert index.reserve(b"a", now=6)
+    assert index.reserve(b"a", now=17)        # vencida por TTL
+    index.add(b"b", now=18)
+    index.add(b"c", now=18)                   # max_entries: sale la más antigua
+    assert index.reserve(b"a", now=19)
+    assert index.stats()["duplicates"] == 1
+
+
+def test_rescan_after_lwt_is_processed(seeded, db):
+    service = _service(seeded)
+    topic = "APP/LOTO_RFID/M1/TAGS"
+    payload = tags_bytes("M1", lotos=[("L1", 5)])
+    service._process_message(db, topic, payload)
+    service._process_message(db, "APP/LOTO_RFID/M1/LWT", b"offline")
+    assert presence_tracker.status("M1") == "offline"
+    # Re-escaneo idéntico (timestamps de primera vista): no es una redelivery
+    service._process_message(db, topic, payload)
+    assert presence_tracker.status("M1") == "online"
+    assert recent_messages.stats()["duplicates"] == 0
+
+
+def test_redelivery_with_dup_flag_is_dropped(seeded, db, monkeypatch):
+    service = _service(seeded)
+    processed = []
+    import app.mqtt.client as client
+    original = client.process_tags_payload
+    monkeypatch.setattr(client, "process_tags_payload", lambda db, p: processed.append(p) or original(db, p))
+    topic, payload = "APP/LOTO_RFID/M1/TAGS", tags_bytes("M1", lotos=[("L1", 5)])
+    service._process_message(db, topic, payload)
+    service._process_message(db, topic, payload, redelivered=True)
+    assert len(processed) == 1
+    assert recent_messages.stats()["duplicates"] == 1
+    # Un reenvío de algo que esta réplica no procesó sí se procesa
+    service._process_message(db, topic, tags_bytes("M1", lotos=[("L2", 7)]), redelivered=True)
+    assert len(processed) == 2
@@ -0,0 +1,70 @@
+# tests/test_liveness.py
+import pytest
+
+from app.mqtt.liveness import HashedTimerWheel, LivenessMonitor
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_wheel_fires_keys_in_their_tick():
+    wheel = HashedTimerWheel(tick=1, slots=10, now=0)
+    wheel.schedule("a", 3.5)
+    wheel.schedule("b", 5)
+    assert wheel.advance(2.9) == []
+    assert wheel.advance(3.0) == ["a"]
+    wheel.cancel("b")
+    assert wheel.advance(9) == [] and len(wheel) == 0
+
+
+def test_wheel_never_schedules_in_a_processed_tick():
+    wheel = HashedTimerWheel(tick=1, slots=4, now=0)
+    wheel.advance(5)
+    wheel.schedule("late", 2)        # plazo ya pasado: va al próximo tick
+    assert wheel.advance(6) == ["late"]
+
+
+def test_wheel_after_long_pause_visits_one_revolution():
+    wheel = HashedTimerWheel(tick=1, slots=4, now=0)
+    wheel.schedule("a", 1)
+    wheel.schedule("b", 3)
+    assert sorted(wheel.advance(1000)) == ["a", "b"]
+
+
+def test_wheel_rejects_non_positive_tick():
+    with pytest.raises(ValueError):
+        HashedTimerWheel(tick=0, slots=4, now=0)
+
+
+def test_monitor_expires_silent_modules_and_reschedules_active_ones():
+    clock = FakeClock()
+    expired = []
+    monitor = LivenessMonitor(timeout=10, tick=1, on_expire=expired.append, clock=clock)
+    monitor.touch("M1")
+    monitor.touch("M2")
+    clock.now += 6
+    monitor.touch("M1")              # sigue reportando
+    clock.now += 5
+    assert monitor.check() == ["M2"]
+    assert expired == ["M2"]
+    assert monitor.stats()["rescheduled"] == 1
+    clock.now += 6
+    assert monitor.check() == ["M1"]
+    monitor.touch("M3")
+    monitor.forget("M3")             # llegó su LWT
+    clock.now += 20
+    assert monitor.check() == []
+
+
+def test_monitor_validates_tick_only_when_enabled():
+    with pytest.raises(ValueError):
+        LivenessMonitor(timeout=120, tick=0)
+    disabled = LivenessMonitor(timeout=0, tick=0)
+    disabled.touch("M1")
+    disabled.forget("M1")
+    assert disabled.check() == [] and not disabled.stats()["enabled"]
@@ -0,0 +1,71 @@
+# tests/test_presence.py
+import pytest
+
+from app import models
+from app.mqtt.presence import PresenceTracker, normalize_status
+
+
+def bay_status(db, module):
+    db.expire_all()
+    return db.query(models.Bahia.module_loto_status).filter(models.Bahia.module_loto_code == module).scalar()
+
+
+def test_normalize_status():
+    assert normalize_status(" ONLINE ") == "online"
+    assert normalize_status("desconocido") == "offline"
+
+
+def test_flush_writes_only_changed_modules(seeded, db):
+    tracker = PresenceTracker(max_gap=0)
+    tracker.load(db)
+    assert tracker.observe("M1", "online")
+    assert not tracker.observe("M1", "online")
+    assert tracker.observe("M2", "online")
+    assert tracker.observe("M2", "offline")  # volvió a lo persistido: nada que escribir
+    assert tracker.stats()["pending"] == 1
+    assert tracker.flush(db) == 1
+    assert bay_status(db, "M1") == "online"
+    assert bay_status(db, "M2") == "offline"
+    assert tracker.flush(db) == 0
+
+
+def test_failed_flush_is_retried(seeded, db, monkeypatch):
+    tracker = PresenceTracker(max_gap=0)
+    tracker.load(db)
+    tracker.observe("M1", "online")
+    original = db.execute
+    calls = []
+
+    def failing_execute(*args, **kwargs):
+        if not calls:
+            calls.append(1)
+            raise RuntimeError("BD caída")
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(db, "execute", failing_execute)
+    with pytest.raises(RuntimeError):
+        tracker.flush(db)
+    assert tracker.stats()["pending"] == 1
+    assert tracker.stats()["flush_errors"] == 1
+    assert tracker.flush(db) == 1
+    assert bay_status(db, "M1") == "online"
+
+
+def test_gap_rewrites_unchanged_status(seeded, db):
+    tracker = PresenceTracker(max_gap=10)
+    tracker.load(db)
+    tracker.observe("M1", "online")
+    tracker.flush(db)
+    tracker._entries["M1"].seen -= 11      # otra réplica pudo cambiar la columna
+    assert not tracker.observe("M1", "online")
+    assert tracker.flush(db) == 1
+
+
+def test_unknown_module_is_tracked_and_written(seeded, db):
+    tracker = PresenceTracker(max_gap=0)
+    tracker.load(db)
+    db.add(models.Bahia(name="Bahía 4", module_loto_code="M4"))
+    db.commit()
+    assert tracker.observe("M4", "online")
+    assert tracker.flush(db) == 1
+    assert bay_status(db, "M4") == "online"
@@ -0,0 +1,110 @@
+# tests/test_publisher.py
+import time
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+
+from app.mqtt.publisher import PublishDeduplicator, PublishQueue, payload_digest
+
+
+class FakeBroker:
+    """publish() del transporte: entrega mids consecutivos o los de `mids`; ack_now confirma antes de retornar."""
+
+    def __init__(self, mids=None, ack_now=False):
+        self.queue = None
+        self.mids = list(mids or [])
+        self.next_mid = 1
+        self.ack_now = ack_now
+        self.published = []
+
+    def __call__(self, topic, payload, qos, retain):
+        mid = self.mids.pop(0) if self.mids else self.next_mid
+        self.next_mid += 1
+        self.published.append((topic, mid))
+        if self.ack_now:
+            self.queue.on_publish(None, None, mid)  # PUBACK antes de registrar el mid
+        return SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=mid)
+
+
+def make_queue(broker, **kwargs):
+    failures = []
+    queue = PublishQueue(publish=broker, on_failure=failures.append, **{"max_pending": 10, "max_inflight": 10, **kwargs})
+    broker.queue = queue
+    return queue, failures
+
+
+def wait_for(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_full_queue_drops_immediately_and_coalesces_same_topic():
+    queue, failures = make_queue(FakeBroker(), max_pending=1)
+    assert queue.enqueue("a", b"1")
+    started = time.monotonic()
+    assert not queue.enqueue("b", b"1")
+    assert time.monotonic() - started < 0.1
+    assert queue.enqueue("a", b"2")       # mismo tópico: reemplaza al pendiente
+    stats = queue.stats()
+    assert (stats["dropped"], stats["superseded"], stats["pending"]) == (1, 1, 1)
+    assert failures == ["b"]
+
+
+def test_puback_before_registration_completes_message():
+    broker = FakeBroker(ack_now=True)
+    queue, failures = make_queue(broker)
+    queue.start()
+    try:
+        queue.enqueue("t/1", b"x", qos=1)
+        assert wait_for(lambda: queue.stats()["completed"] == 1)
+    finally:
+        queue.stop()
+    stats = queue.stats()
+    assert (stats["inflight"], stats["unmatched_acks"], stats["timeouts"]) == (0, 0, 0)
+    assert failures == []
+
+
+def test_unacked_message_times_out_and_reports_failure():
+    queue, failures = make_queue(FakeBroker(), ack_timeout=0.05)
+    queue.start()
+    try:
+        queue.enqueue("t/1", b"x", qos=1)
+        assert wait_for(lambda: queue.stats()["timeouts"] == 1)
+    finally:
+        queue.stop()
+    assert queue.stats()["inflight"] == 0
+    assert failures == ["t/1"]
+
+
+def test_stale_puback_of_reused_mid_does_not_complete_new_message():
+    broker = FakeBroker(mids=[7])
+    queue, failures = make_queue(broker)
+    # PUBACK tardío de un uso anterior del mid 7 (paho recicla los mids)
+    queue.on_publish(None, None, 7)
+    assert queue.stats()["unmatched_acks"] == 1
+    queue.start()
+    try:
+        queue.enqueue("t/1", b"x", qos=1)
+        assert wait_for(lambda: queue.stats()["sent"] == 1)
+        stats = queue.stats()
+        assert (stats["inflight"], stats["completed"], stats["unmatched_acks"]) == (1, 0, 0)
+        queue.on_publish(None, None, 7)  # el PUBACK de este envío
+        assert queue.stats()["completed"] == 1
+    finally:
+        queue.stop()
+    assert failures == []
+
+
+def test_deduplicator_publishes_only_changes():
+    dedup = PublishDeduplicator(max_topics=1)
+    first = payload_digest({"users": [1], "timestamp": "a"}, exclude=("timestamp",))
+    same = payload_digest({"timestamp": "b", "users": [1]}, exclude=("timestamp",))
+    assert first == same
+    assert dedup.should_publish("t/1", first)
+    assert not dedup.should_publish("t/1", same)
+    assert dedup.should_publish("t/2", first)   # expulsa t/1
+    assert dedup.should_publish("t/1", first)
+    dedup.forget("t/1")
+    assert dedup.should_publish("t/1", first)
@@ -0,0 +1,53 @@
+# tests/test_registry.py
+from app.mqtt.registry import TagRegistry
+
+
+def test_misses_are_resolved_in_one_query_and_cached(seeded, db, monkeypatch):
+    registry = TagRegistry()
+    queries = []
+    original = TagRegistry._query
+    monkeypatch.setattr(TagRegistry, "_query", staticmethod(lambda db, codes=None: queries.append(codes) or original(db, codes)))
+    first = registry.lookup(db, ["C1", "L1", "NOPE", "C1"])
+    assert first["C1"].type_name == "CARD" and first["L1"].type_name == "LOTO"
+    assert first["NOPE"] is None
+    assert queries == [["C1", "L1", "NOPE"]]
+    # Caché negativa incluida: la segunda vez no consulta
+    assert registry.lookup(db, ["C1", "NOPE"]) == {"C1": first["C1"], "NOPE": None}
+    assert len(queries) == 1
+    stats = registry.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 3)
+
+
+def test_lru_evicts_least_recently_used(seeded, db):
+    registry = TagRegistry(max_size=2)
+    registry.lookup(db, ["C1"])
+    registry.lookup(db, ["C2"])
+    registry.lookup(db, ["C1"])   # C2 queda como el más antiguo
+    registry.lookup(db, ["C3"])
+    assert list(registry._entries) == ["C1", "C3"]
+    assert registry.stats()["evictions"] == 1
+
+
+def test_invalidation_during_query_is_not_cached(seeded, db, monkeypatch):
+    registry = TagRegistry()
+    original = TagRegistry._query
+
+    def racing_query(db, codes=None):
+        rows = original(db, codes)
+        registry.invalidate("C1")  # un router escribe mientras se consulta
+        return rows
+
+    monkeypatch.setattr(TagRegistry, "_query", staticmethod(racing_query))
+    assert registry.lookup(db, ["C1"])["C1"] is not None
+    assert "C1" not in registry._entries
+
+
+def test_invalidate_user_drops_only_their_tags(seeded, db):
+    registry = TagRegistry()
+    registry.load(db)
+    version = registry.version
+    user_id = registry.lookup(db, ["C1"])["C1"].user_id
+    registry.invalidate_user(user_id)
+    assert "C1" not in registry._entries and "L1" not in registry._entries
+    assert "C2" in registry._entries
+    assert registry.version == version + 1
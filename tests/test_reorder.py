@@ -0,0 +1,125 @@
+# tests/test_reorder.py
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.mqtt.reorder import ReorderBuffer, advance, dump_watermark, load_watermark, snapshot_reads
+
+from conftest import tags_bytes
+
+T0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def reads(*pairs):
+    return frozenset((code.encode(), T0 + timedelta(seconds=s)) for code, s in pairs)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Collector:
+    def __init__(self):
+        self.items = []
+        self.event = threading.Event()
+
+    def __call__(self, module_code, item):
+        self.items.append(item)
+        self.event.set()
+
+
+def test_snapshot_reads_parses_raw_payload():
+    raw = tags_bytes("M1", cards=[("C1", 3)], lotos=[("L1", 5)])
+    assert snapshot_reads(raw) == reads(("C1", 3), ("L1", 5))
+    assert snapshot_reads(b'{"module_loto_code": "M1"}') is None
+
+
+def test_window_releases_older_snapshot_first():
+    out = Collector()
+    buffer = ReorderBuffer(window=0.05, on_release=out)
+    buffer.start()
+    try:
+        # L3 se retiró antes del snapshot "nuevo": el que la trae es anterior aunque llegue después
+        buffer.offer("M1", reads(("L1", 10), ("L2", 20)), "nuevo")
+        buffer.offer("M1", reads(("L1", 10), ("L3", 15)), "viejo")
+        deadline = time.monotonic() + 2
+        while len(out.items) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        buffer.stop()
+    assert out.items == ["viejo", "nuevo"]
+    assert buffer.stats()["reordered"] == 1
+
+
+def test_stale_snapshot_after_release_is_dropped():
+    out = Collector()
+    buffer = ReorderBuffer(window=0, on_release=out)
+    assert buffer.offer("M1", reads(("L1", 10), ("L2", 20)), "nuevo")
+    assert not buffer.offer("M1", reads(("L1", 10), ("L3", 15)), "viejo")
+    # Alguien se retiró: no es atrasado aunque su timestamp más nuevo baje
+    assert buffer.offer("M1", reads(("L1", 10)), "retiro")
+    assert out.items == ["nuevo", "retiro"]
+    assert buffer.stats()["stale"] == 1
+
+
+def test_reset_forgets_applied_and_clock_regression_is_accepted():
+    out = Collector()
+    buffer = ReorderBuffer(window=0, on_release=out, max_regression=300)
+    buffer.offer("M1", reads(("L1", 10), ("L2", 20)), "a")
+    buffer.reset("M1")
+    assert buffer.offer("M1", reads(("L1", 10), ("L3", 15)), "tras_reset")
+    # Más de max_regression atrás: reloj del lector reiniciado
+    buffer.offer("M2", reads(("L1", 1000)), "b")
+    assert buffer.offer("M2", reads(("L1", 1000), ("L9", 10)), "reloj")
+    assert out.items == ["a", "tras_reset", "b", "reloj"]
+
+
+def test_reset_discards_pending_deadlines_of_module():
+    out = Collector()
+    buffer = ReorderBuffer(window=0.5, on_release=out)
+    buffer.start()
+    try:
+        buffer.offer("M1", reads(("L1", 10)), "antes")
+        buffer.reset("M1")               # libera "antes" y su plazo ya no cuenta
+        assert out.event.wait(1)
+        time.sleep(0.25)
+        # Reloj del lector reiniciado: su clave queda antes que la de "antes"
+        buffer.offer("M1", reads(("L1", 5)), "despues")
+        time.sleep(0.4)                  # venció el plazo de "antes", no el de "despues"
+        assert out.items == ["antes"]
+        time.sleep(0.3)
+        assert out.items == ["antes", "despues"]
+    finally:
+        buffer.stop()
+
+
+def test_idle_modules_are_pruned():
+    clock = FakeClock()
+    buffer = ReorderBuffer(window=0, on_release=Collector(), clock=clock, max_idle=60)
+    for i in range(10):
+        buffer.offer(f"M{i}", reads(("L1", 10)), i)
+    assert buffer.stats()["modules"] == 10
+    clock.now = 61
+    buffer.offer("M0", reads(("L1", 10)), "otra_vez")
+    stats = buffer.stats()
+    assert stats["modules"] == 1 and stats["pruned"] == 10
+
+
+def test_watermark_roundtrip_and_stale_detection():
+    now = T0 + timedelta(seconds=30)
+    ref = advance(reads(("L1", 10), ("L2", 20)), None)
+    assert ref == (reads(("L1", 10), ("L2", 20)), T0 + timedelta(seconds=20))
+    stored = dump_watermark(*ref, now)
+    loaded = load_watermark(stored, now + timedelta(seconds=5), max_idle=120)
+    assert loaded == ref
+    assert advance(reads(("L1", 10), ("L3", 15)), loaded) is None
+    # Sin lecturas (todos se retiraron): la referencia no retrocede
+    assert advance(frozenset(), loaded) == (frozenset(), T0 + timedelta(seconds=20))
+    # Vencida por max_idle o ilegible: sin referencia
+    assert load_watermark(stored, now + timedelta(seconds=121), max_idle=120) is None
+    assert load_watermark({"at": "x"}, now) is None
+    assert load_watermark(None, now) is None
@@ -0,0 +1,28 @@
+# tests/test_simulate_mqtt.py
+from app.metrics import Histogram
+from simulate_mqtt import IngestLatency, histogram_quantile, parse_histogram
+
+
+def exposition(histogram: Histogram) -> str:
+    return "\n".join(histogram.collect())
+
+
+def test_parse_and_quantile_interpolate_within_bucket():
+    histogram = Histogram("mqtt_ingest_latency_seconds", "", buckets=(0.01, 0.1))
+    for value in [0.005] * 50 + [0.05] * 50:
+        histogram.observe(value)
+    buckets = parse_histogram(exposition(histogram), "mqtt_ingest_latency_seconds")
+    assert buckets == [(0.01, 50), (0.1, 100), (float("inf"), 100)]
+    assert histogram_quantile(0.5, buckets) == 0.01
+    assert abs(histogram_quantile(0.9, buckets) - 0.082) < 1e-9
+
+
+def test_ingest_latency_counts_only_messages_of_the_run(capsys):
+    histogram = Histogram("mqtt_ingest_latency_seconds", "", buckets=(0.01, 0.1))
+    histogram.observe(0.5)  # anterior a la carga
+    ingest = IngestLatency(lambda: exposition(histogram))
+    ingest.start()
+    for _ in range(10):
+        histogram.observe(0.005)
+    ingest.report()
+    assert "(n=10)" in capsys.readouterr().out
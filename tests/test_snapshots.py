@@ -0,0 +1,54 @@
+# tests/test_snapshots.py
+import time
+from dataclasses import replace
+
+from app.mqtt.payloads import StatusPayload
+from app.mqtt.snapshots import SnapshotStore
+
+STATUS = StatusPayload(module_loto_code="M1", status="ok", message="")
+
+
+def test_diff_against_last_committed_snapshot():
+    store = SnapshotStore(max_age=0)
+    first = store.diff("M1", ["C1"], ["L1"])
+    assert not first.unchanged and first.added_card == {"C1"}
+    store.commit("M1", ["C1"], ["L1"], 7, STATUS)
+    assert store.diff("M1", ["C1"], ["L1"]).unchanged
+    diff = store.diff("M1", ["C1", "C2"], [])
+    assert (diff.added_card, diff.removed_card, diff.removed_loto) == ({"C2"}, frozenset(), {"L1"})
+    assert diff.loto_changed and diff.previous.maintenance_id == 7
+    assert (store.stats()["unchanged"], store.stats()["changed"]) == (1, 2)
+
+
+def test_pending_snapshot_takes_precedence():
+    store = SnapshotStore(max_age=0)
+    store.commit("M1", ["C1"], [], None, STATUS)
+    pending = store.build(["C1", "C2"], [], None, STATUS)
+    assert store.diff("M1", ["C1", "C2"], [], pending=pending).unchanged
+
+
+def test_expired_snapshot_forces_full_reconciliation():
+    store = SnapshotStore(max_age=60)
+    snap = store.build(["C1"], [], None, STATUS)
+    store.put("M1", replace(snap, processed_at=time.monotonic() - 61))
+    assert store.get("M1") is None
+    store.put("M1", snap)
+    assert store.get("M1") is snap
+
+
+def test_registry_version_change_invalidates():
+    store = SnapshotStore(max_age=0)
+    store.commit("M1", ["C1"], [], None, STATUS, registry_version=3)
+    assert store.get("M1", registry_version=3) is not None
+    assert store.get("M1", registry_version=4) is None
+
+
+def test_gap_between_messages_drops_snapshot():
+    store = SnapshotStore(max_age=0, max_gap=10)
+    store.commit("M1", ["C1"], [], None, STATUS)
+    assert store.get("M1") is None           # nunca visto por esta réplica
+    store.commit("M1", ["C1"], [], None, STATUS)
+    assert store.get("M1") is not None       # visto recién
+    store._last_seen["M1"] -= 11
+    assert store.get("M1") is None
+    assert store.stats()["gap_invalidations"] == 2
@@ -0,0 +1,70 @@
+# tests/test_tag_log.py
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.mqtt.tag_log import TagReadLog
+from conftest import tags_payload
+
+RECEIVED = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def stored(db):
+    return db.query(models.TagReadEvent.module_loto_code, models.TagReadEvent.tag_type, models.TagReadEvent.tag_code).all()
+
+
+def test_flush_writes_one_row_per_read(db):
+    log = TagReadLog(enabled=True, queue_size=100)
+    log.record(tags_payload("M1", cards=["C1", "C2"], lotos=[("L1", 5)]), RECEIVED)
+    log.record(tags_payload("M2"), RECEIVED)  # sin lecturas: no se encola
+    assert log.stats()["pending"] == 3
+    assert log.flush(db) == 3
+    assert sorted(stored(db)) == [("M1", "CARD", "C1"), ("M1", "CARD", "C2"), ("M1", "LOTO", "L1")]
+    read_at = db.query(models.TagReadEvent.read_at).filter(models.TagReadEvent.tag_code == "L1").scalar()
+    assert read_at.replace(tzinfo=None) == datetime(2025, 1, 1, 0, 0, 5)
+    assert log.stats()["pending"] == 0
+
+
+def test_full_queue_drops_new_reads():
+    log = TagReadLog(enabled=True, queue_size=3)
+    log.record(tags_payload("M1", cards=["C1", "C2"]), RECEIVED)
+    log.record(tags_payload("M1", cards=["C1", "C2"]), RECEIVED)
+    assert log.stats()["pending"] == 2
+    assert log.stats()["dropped"] == 2
+
+
+def test_failed_flush_requeues_in_order(db, monkeypatch):
+    log = TagReadLog(enabled=True, queue_size=100)
+    log.record(tags_payload("M1", cards=["C1"]), RECEIVED)
+    log.record(tags_payload("M2", cards=["C2"]), RECEIVED)
+
+    def failing_write(db, rows):
+        raise RuntimeError("BD caída")
+
+    with monkeypatch.context() as m:
+        m.setattr(TagReadLog, "_write", staticmethod(failing_write))
+        with pytest.raises(RuntimeError):
+            log.flush(db)
+    log.record(tags_payload("M3", cards=["C3"]), RECEIVED)
+    assert log.stats()["flush_errors"] == 1
+    assert [module for _, module, _ in log._pending] == ["M1", "M2", "M3"]
+    assert log.flush(db) == 3
+
+
+def test_disabled_log_records_nothing():
+    log = TagReadLog(enabled=False)
+    log.record(tags_payload("M1", cards=["C1"]), RECEIVED)
+    assert log.stats()["pending"] == 0
+
+
+def test_start_without_table_disables_logging():
+    engine = create_engine("sqlite://")
+    log = TagReadLog(enabled=True)
+    log.record(tags_payload("M1", cards=["C1"]), RECEIVED)
+    log.start(sessionmaker(bind=engine))
+    assert not log.enabled
+    assert log.stats()["pending"] == 0
+    engine.dispose()
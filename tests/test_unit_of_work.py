@@ -0,0 +1,46 @@
+# tests/test_unit_of_work.py
+import pytest
+
+from app import models
+from app.mqtt.unit_of_work import on_commit, on_rollback, tx_stats, unit_of_work
+
+
+def test_commit_runs_commit_hooks_only(db):
+    events = []
+    with unit_of_work(db):
+        db.add(models.TypeTag(name="CARD"))
+        on_commit(db, lambda: events.append("commit"))
+        on_rollback(db, lambda: events.append("rollback"))
+    assert events == ["commit"]
+    assert db.query(models.TypeTag).count() == 1
+    assert "on_commit" not in db.info and "on_rollback" not in db.info
+
+
+def test_failure_rolls_back_and_runs_rollback_hooks(db):
+    events = []
+    rollbacks = tx_stats.stats()["rollbacks"]
+    with pytest.raises(RuntimeError):
+        with unit_of_work(db):
+            db.add(models.TypeTag(name="CARD"))
+            db.flush()
+            on_commit(db, lambda: events.append("commit"))
+            on_rollback(db, lambda: events.append("rollback"))
+            raise RuntimeError("falla")
+    assert events == ["rollback"]
+    assert db.query(models.TypeTag).count() == 0
+    assert tx_stats.stats()["rollbacks"] == rollbacks + 1
+    # Los hooks no se arrastran a la próxima transacción
+    with unit_of_work(db):
+        pass
+    assert events == ["rollback"]
+
+
+def test_commits_are_counted_per_message(db):
+    before = tx_stats.stats()
+    with unit_of_work(db):
+        db.add(models.TypeTag(name="CARD"))
+    tx_stats.record_message(db)
+    after = tx_stats.stats()
+    assert after["messages"] == before["messages"] + 1
+    assert after["commits"] == before["commits"] + 1
+    assert "commits" not in db.info
@@ -0,0 +1,95 @@
+# tests/test_workers.py
+import random
+import threading
+import time
+
+import pytest
+
+from app.mqtt.workers import ShardedWorkerPool
+
+
+def test_jobs_of_a_key_run_in_submission_order():
+    pool = ShardedWorkerPool(workers=4, queue_size=1000)
+    seen = {}
+    lock = threading.Lock()
+
+    def job(key, i):
+        def run():
+            time.sleep(random.random() / 1000)
+            with lock:
+                seen.setdefault(key, []).append(i)
+        return run
+
+    pool.start()
+    keys = [f"M{k}" for k in range(10)]
+    for i in range(50):
+        for key in keys:
+            assert pool.submit(key, job(key, i))
+    pool.stop()
+    assert seen == {key: list(range(50)) for key in keys}
+    assert pool.stats()["processed"] == 500
+
+
+def test_full_shard_drops_without_blocking():
+    pool = ShardedWorkerPool(workers=1, queue_size=2)
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    pool.start()
+    assert pool.submit("M1", blocker)
+    assert started.wait(5)
+    assert pool.submit("M1", lambda: None)
+    assert pool.submit("M1", lambda: None)
+    t0 = time.perf_counter()
+    assert not pool.submit("M1", lambda: None)
+    assert time.perf_counter() - t0 < 0.1
+    release.set()
+    pool.stop()
+    stats = pool.stats()
+    assert stats["dropped"] == 1
+    assert stats["processed"] == 3
+
+
+def test_batches_close_on_size_and_on_a_plain_job():
+    calls = []
+    pool = ShardedWorkerPool(
+        workers=1, queue_size=100, batch_handler=lambda batch: calls.append(list(batch)),
+        batch_max_size=3, batch_max_delay=0.05,
+    )
+    # Encolado antes de arrancar: el consumidor ve todo de una vez
+    for item in ("a", "b"):
+        pool.submit_batch_item("M1", item)
+    pool.submit("M1", lambda: calls.append("job"))
+    for item in ("c", "d", "e", "f"):
+        pool.submit_batch_item("M1", item)
+    pool.start()
+    t0 = time.perf_counter()
+    pool.stop()
+    assert calls == [["a", "b"], "job", ["c", "d", "e"], ["f"]]
+    # La sentinela que cierra el último lote no se pierde: stop no agota su timeout
+    assert time.perf_counter() - t0 < 1.0
+
+
+def test_failed_job_is_counted_and_latency_observed():
+    observed = []
+    pool = ShardedWorkerPool(workers=1, queue_size=10, latency_observer=observed.append)
+
+    def boom():
+        raise RuntimeError("falla")
+
+    pool.submit("M1", boom)
+    pool.submit("M1", lambda: None)
+    pool.start()
+    pool.stop()
+    shard = pool.stats()["shards"][0]
+    assert (shard["processed"], shard["errors"]) == (2, 1)
+    assert len(observed) == 2 and all(v >= 0 for v in observed)
+
+
+def test_batch_item_requires_handler():
+    with pytest.raises(RuntimeError):
+        ShardedWorkerPool(workers=1, queue_size=1).submit_batch_item("M1", object())